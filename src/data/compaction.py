@@ -0,0 +1,83 @@
+"""
+Compaction of the frames of the dashboards, once they are built.
+
+Label columns are repeated on every row (e.g. the sector of a bilan, on each of its postes
+d'émissions): they are converted to categoricals. Integers are downcast to the smallest dtype that
+holds their values, and floats to float32 (a relative precision of ~1e-7, well below the precision
+of the published figures).
+
+    >>> df = compact_frame(df, categorical_columns=["Type de structure", "naf1"], name="profiles")
+"""
+
+import logging
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+
+FLOAT_DTYPE = np.dtype("float32")
+
+
+def _smallest_int_dtype(values: pd.Series) -> np.dtype:
+    if values.empty:
+        return np.dtype("int8")
+    low, high = values.min(), values.max()
+    for dtype in map(np.dtype, ["int8", "int16", "int32"]):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return dtype
+    return values.dtype
+
+
+def compact_schema(
+    df: pd.DataFrame, categorical_columns: Sequence[str]
+) -> dict[str, object]:
+    """The compact dtype of each column of `df` (only for the columns whose dtype changes).
+
+    Args:
+        categorical_columns: the label columns (the ones absent from `df` are ignored)
+    """
+    schema = {}
+    for col, dtype in df.dtypes.items():
+        if col in categorical_columns:
+            if not isinstance(dtype, pd.CategoricalDtype):
+                schema[col] = "category"
+        # (only numpy dtypes: nullable integers, datetimes, ... are kept as is)
+        elif isinstance(dtype, np.dtype) and dtype.kind in "iu":
+            new_dtype = _smallest_int_dtype(df[col])
+            if new_dtype.itemsize < dtype.itemsize:
+                schema[col] = new_dtype
+        elif isinstance(dtype, np.dtype) and dtype.kind == "f":
+            if dtype.itemsize > FLOAT_DTYPE.itemsize:
+                schema[col] = FLOAT_DTYPE
+    return schema
+
+
+def memory_report(before: pd.DataFrame, after: pd.DataFrame) -> pd.DataFrame:
+    """Dtype and memory usage (bytes) of each column, before and after the compaction (and in total)."""
+    report = pd.DataFrame(
+        {
+            "dtype_before": before.dtypes.astype(str),
+            "dtype_after": after.dtypes.astype(str),
+            "bytes_before": before.memory_usage(deep=True, index=False),
+            "bytes_after": after.memory_usage(deep=True, index=False),
+        }
+    )
+    report.loc["total", ["bytes_before", "bytes_after"]] = report[
+        ["bytes_before", "bytes_after"]
+    ].sum()
+    return report
+
+
+def compact_frame(
+    df: pd.DataFrame, categorical_columns: Sequence[str], name: str = "frame"
+) -> pd.DataFrame:
+    """Convert the columns of `df` to their compact dtypes (see `compact_schema`), and log the memory
+    usage before and after."""
+    compact = df.astype(compact_schema(df, categorical_columns))
+    report = memory_report(df, compact)
+    logging.debug(f"{name}: memory usage of the columns\n{report.to_string()}")
+    before, after = report.loc["total", ["bytes_before", "bytes_after"]]
+    logging.info(
+        f"{name}: compacted from {before / 2**20:.1f} MB to {after / 2**20:.1f} MB"
+    )
+    return compact
@@ -0,0 +1,166 @@
+"""
+Index of the financial data from INPI (see src/data/inpi.py), by (SIREN, fiscal year).
+
+The filtered financial data (FILTERED_FINANCIAL_DATA_PATH) is compiled once into a structured
+array, sorted by an integer key (siren * 10000 + year), and saved as a .npy file that is
+memory-mapped when loaded. Financial data is then attached to other datasets by binary search
+on the keys (see `FinancialIndex.lookup`), and the data of a single entity can be read without
+loading the whole index (see `FinancialIndex.entity`).
+"""
+
+import functools
+import logging
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from src.settings import FILTERED_FINANCIAL_DATA_PATH, FINANCIAL_INDEX_PATH
+
+_YEAR_FACTOR = 10_000
+
+_DTYPE = np.dtype(
+    [
+        ("key", "<i8"),
+        ("ca", "<f8"),
+        ("resultat_net", "<f8"),
+        ("date_cloture_exercice", "<M8[D]"),
+        ("type_bilan", "S1"),
+    ]
+)
+
+
+def encode_sirens(sirens: pd.Series) -> np.ndarray:
+    """SIREN codes as integers (-1 for missing values and codes that are not 9 digits)."""
+    # (only encode the unique values)
+    codes, uniques = pd.factorize(sirens)
+    uniques = pd.Series(uniques, dtype="string")
+    valid = uniques.str.fullmatch(r"\d{9}").fillna(False).to_numpy(bool)
+    encoded = np.full(len(uniques) + 1, -1, dtype=np.int64)
+    encoded[:-1][valid] = uniques[valid].astype("int64").to_numpy()
+    # (missing values have the code -1, i.e. the last one)
+    return encoded[codes]
+
+
+def _encode_keys(sirens: pd.Series, years: pd.Series) -> np.ndarray:
+    codes = encode_sirens(sirens)
+    years = pd.to_numeric(years, errors="coerce").to_numpy(dtype=float)
+    valid = (codes >= 0) & (years >= 0) & (years < _YEAR_FACTOR)
+    return np.where(
+        valid, codes * _YEAR_FACTOR + np.nan_to_num(years).astype(np.int64), -1
+    )
+
+
+@dataclass
+class FinancialIndex:
+    """
+    Attributes:
+        data: structured array of financial data (see `_DTYPE`), sorted by key
+    """
+
+    data: np.ndarray
+
+    def _find(self, keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Position of each key in the index, and whether it was found."""
+        pos = np.searchsorted(self.data["key"], keys)
+        pos = np.minimum(pos, len(self.data) - 1)
+        found = (keys >= 0) & (len(self.data) > 0)
+        if len(self.data) > 0:
+            found &= self.data["key"][pos] == keys
+        return pos, found
+
+    def lookup(self, sirens: pd.Series, years: pd.Series) -> pd.DataFrame:
+        """Financial data for each (siren, fiscal year) pair (NaN if not found).
+
+        Returns:
+            a DataFrame with the same index as `sirens`, and the columns date_cloture_exercice,
+            ca, resultat_net, type_bilan_financier and annee_cloture_exercice
+        """
+        pos, found = self._find(_encode_keys(sirens, years))
+        rows = self.data[pos[found]]
+
+        def _column(values, dtype):
+            x = np.full(len(found), np.nan, dtype=dtype)
+            x[found] = values
+            return x
+
+        annee = rows["key"] % _YEAR_FACTOR
+        return pd.DataFrame(
+            {
+                "date_cloture_exercice": _column(
+                    np.datetime_as_string(rows["date_cloture_exercice"]), object
+                ),
+                "ca": _column(rows["ca"], float),
+                "resultat_net": _column(rows["resultat_net"], float),
+                "type_bilan_financier": _column(rows["type_bilan"].astype(str), object),
+                # (integers, unless some years are missing, as with a pandas merge)
+                "annee_cloture_exercice": annee
+                if found.all()
+                else _column(annee, float),
+            },
+            index=sirens.index,
+        )
+
+    def entity(self, siren: str) -> pd.DataFrame:
+        """Financial data of a single entity, by fiscal year."""
+        code = encode_sirens(pd.Series([siren]))[0]
+        if code < 0:
+            rows = self.data[:0]
+        else:
+            start, end = np.searchsorted(
+                self.data["key"], [code * _YEAR_FACTOR, (code + 1) * _YEAR_FACTOR]
+            )
+            rows = self.data[start:end]
+        return pd.DataFrame(
+            {
+                "annee_cloture_exercice": rows["key"] % _YEAR_FACTOR,
+                "date_cloture_exercice": rows["date_cloture_exercice"],
+                "ca": rows["ca"],
+                "resultat_net": rows["resultat_net"],
+                "type_bilan": rows["type_bilan"].astype(str),
+            }
+        )
+
+
+def compile_financial_index() -> FinancialIndex:
+    """Compile the filtered financial data into FINANCIAL_INDEX_PATH."""
+    df = pd.read_csv(FILTERED_FINANCIAL_DATA_PATH, dtype={"siren": str})
+    keys = _encode_keys(df["siren"], df["annee_cloture_exercice"])
+    assert (keys >= 0).all(), "unexpected SIREN or fiscal year in the financial data"
+    assert pd.Index(keys).is_unique, "expected one bilan per SIREN and fiscal year"
+
+    data = np.empty(len(df), dtype=_DTYPE)
+    data["key"] = keys
+    data["ca"] = df["ca"]
+    data["resultat_net"] = df["resultat_net"]
+    data["date_cloture_exercice"] = pd.to_datetime(
+        df["date_cloture_exercice"], format="%Y-%m-%d"
+    ).to_numpy()
+    data["type_bilan"] = df["type_bilan"].to_numpy(dtype="S1")
+    data = data[np.argsort(keys, kind="stable")]
+
+    np.save(FINANCIAL_INDEX_PATH, data)
+    logging.info(f"compiled the financial index into {FINANCIAL_INDEX_PATH}")
+    return FinancialIndex(data)
+
+
+def load_financial_index() -> FinancialIndex:
+    """Load the (memory-mapped) financial index, and compile it first if needed."""
+    if (
+        not FINANCIAL_INDEX_PATH.exists()
+        or FINANCIAL_INDEX_PATH.stat().st_mtime
+        < FILTERED_FINANCIAL_DATA_PATH.stat().st_mtime
+    ):
+        compile_financial_index()
+    return FinancialIndex(np.load(FINANCIAL_INDEX_PATH, mmap_mode="r"))
+
+
+@functools.cache
+def get_financial_index() -> FinancialIndex:
+    """The financial index, loaded once per process (e.g. for the app)."""
+    return load_financial_index()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    compile_financial_index()
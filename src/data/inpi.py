@@ -1,9 +1,22 @@
+import argparse
+import functools
+import io
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from pathlib import Path
+from typing import Optional
 
+import numpy as np
 import pandas as pd
 
-from src.settings import DATA_PATH, RAW_ADEME_DATA_PATH, FILTERED_FINANCIAL_DATA_PATH
+from src.data.profiling import StageProfiler, stage
+from src.settings import (
+    FINANCIAL_DATA_PATH,
+    RAW_ADEME_DATA_PATH,
+    FILTERED_FINANCIAL_DATA_PATH,
+    RAW_FINANCIAL_DATA_PATH,
+)
 
 
 def get_fiscal_year(date):
@@ -11,48 +24,102 @@ def get_fiscal_year(date):
     return date.year if date.month >= 7 else date.year - 1
 
 
+def get_fiscal_years(dates: pd.Series) -> pd.Series:
+    """Vectorized version of `get_fiscal_year`."""
+    return dates.dt.year - (dates.dt.month < 7)
+
+
 def keep_one_bilan(df_bilan, prio: dict):
-    df_bilan["type_bilan_priority"] = df_bilan["type_bilan"].map(prio)
-    df_bilan = df_bilan.sort_values(
-        ["siren", "annee_cloture_exercice", "type_bilan_priority"],
-        ascending=[True, False, True],
-    )
-    df_bilan = df_bilan.drop_duplicates(
-        subset=["siren", "annee_cloture_exercice"], keep="first"
+    """Keep one bilan per entity and fiscal year: the one whose type_bilan has the lowest `prio`
+    value (the first one in case of ties, and bilans of other types only as a last resort).
+
+    The result is sorted by siren, and by decreasing fiscal year.
+    """
+    # Integer-coded priority (unknown types last)
+    prio_rank = {k: i for i, k in enumerate(sorted(prio, key=prio.get))}
+    priority = (
+        df_bilan["type_bilan"].map(prio_rank).fillna(len(prio_rank)).to_numpy("int64")
     )
-    df_bilan = df_bilan.drop(columns=["type_bilan_priority"])
-    return df_bilan
 
+    # Group-wise argmin of the priority (rather than a sort of the whole frame): the position of the
+    # first row with the lowest priority, in each group. Groups are numbered in the output order.
+    n = len(df_bilan)
+    siren = _sorted_codes(df_bilan["siren"])
+    year = _sorted_codes(-df_bilan["annee_cloture_exercice"])
+    group = siren * (year.max(initial=0) + 1) + year
+    best = pd.Series(priority * n + np.arange(n)).groupby(group).min() % n
+    return df_bilan.iloc[best.to_numpy()]
 
-def process_bilans_financiers():
+
+def _sorted_codes(values: pd.Series) -> np.ndarray:
+    """Integer codes of the values, in the same order as the values (missing values last).
+
+    Same as `pd.factorize(values, sort=True)`, but only the unique values are sorted (with numpy,
+    which is faster than sorting python strings).
     """
-    Process financial data from INPI.
+    codes, uniques = pd.factorize(values)
+    uniques = np.asarray(uniques)
+    if uniques.dtype == object:
+        uniques = uniques.astype(str)
+    rank = np.empty(len(uniques) + 1, dtype=np.int64)
+    rank[np.argsort(uniques, kind="stable")] = np.arange(len(uniques))
+    rank[-1] = len(uniques)
+    return rank[codes]
 
-    The original CSV (~300Mb) can be downloaded from
-    https://www.data.gouv.fr/fr/datasets/r/9d213815-1649-4527-9eb4-427146ef2e5b
-    The documentation can be found at : https://www.data.gouv.fr/fr/datasets/ratios-financiers-bce-inpi/
 
-    This code is partly taken from the data pipeline of the "Annuaire des Entreprises" :
-    https://github.com/annuaire-entreprises-data-gouv-fr/search-infra/tree/4386f3c2bc54ba8635b050769a34015a3f97a8dd/workflows/data_pipelines/bilans_financiers
+# Keep only selected fields.
+# Another field (in the original INPI database, but not in this .csv) could
+# be helpful : the duration of the "exercice comptable", since it is not always 1 year
+FIELDS = [
+    "siren",
+    "chiffre_d_affaires",
+    "resultat_net",
+    "date_cloture_exercice",
+    "type_bilan",
+]
+# Number of rows of the raw INPI data read at once, when filtering SIRENs during the read
+CHUNKSIZE = 500_000
+# Maximum size of the parts of the raw INPI data parsed by each worker, when parsing in parallel
+RANGE_BYTES = 32 * 2**20
+
+KEEP_ONE_BILAN_PRIO = {
+    # Consolidated entries takes priority
+    "K": "1-K",
+    # Then complete entries
+    "C": "2-C",
+    # Then simplified entries
+    "S": "3-S",
+}
+
+
+def read_bilans_financiers(
+    sirens: Optional[pd.Index] = None, chunksize: int = CHUNKSIZE
+) -> pd.DataFrame:
+    """Read the raw INPI data (keep only the interesting fields for us).
+
+    Args:
+        sirens: if set, only keep the rows of these SIREN codes. The file is then read by chunks of
+            `chunksize` rows, filtered as they are read, so that the whole file is never in memory.
     """
-    # Keep only selected fields.
-    # Another field (in the original INPI database, but not in this .csv) could
-    # be helpful : the duration of the "exercice comptable", since it is not always 1 year
-    fields = [
-        "siren",
-        "chiffre_d_affaires",
-        "resultat_net",
-        "date_cloture_exercice",
-        "type_bilan",
-    ]
-
-    # Read csv (keep only the interesting fields for us)
-    _raw_data_path = DATA_PATH / "raw/heavy/ratios_inpi_bce.csv"
+    _raw_data_path = RAW_FINANCIAL_DATA_PATH
     logging.info(f"loading {_raw_data_path}...")
-    df_bilan = pd.read_csv(_raw_data_path, dtype=str, sep=";", usecols=fields)
+    with stage("read_ratios_inpi_bce") as s:
+        if sirens is None:
+            df_bilan = pd.read_csv(_raw_data_path, dtype=str, sep=";", usecols=FIELDS)
+        else:
+            chunks = pd.read_csv(
+                _raw_data_path, dtype=str, sep=";", usecols=FIELDS, chunksize=chunksize
+            )
+            df_bilan = pd.concat(
+                [chunk[chunk["siren"].isin(sirens)] for chunk in chunks]
+            )
+        s.output(df_bilan)
 
     logging.info(f"loaded 'ratios_inpi_bce.csv' ({len(df_bilan)} rows)")
+    return df_bilan
+
 
+def _convert_types(df_bilan: pd.DataFrame) -> pd.DataFrame:
     # Rename columns
     df_bilan = df_bilan.rename(columns={"chiffre_d_affaires": "ca"})
 
@@ -62,44 +129,54 @@ def process_bilans_financiers():
     )
     df_bilan["ca"] = df_bilan["ca"].astype(float)
     df_bilan["resultat_net"] = df_bilan["resultat_net"].astype(float)
+    return df_bilan
 
+
+def _add_fiscal_year(df_bilan: pd.DataFrame, current_fiscal_year: int) -> pd.DataFrame:
     # Get the current fiscal year
-    df_bilan["annee_cloture_exercice"] = df_bilan["date_cloture_exercice"].apply(
-        get_fiscal_year
+    df_bilan["annee_cloture_exercice"] = get_fiscal_years(
+        df_bilan["date_cloture_exercice"]
     )
 
     # Filter out rows with fiscal years greater than the current fiscal year
-    current_fiscal_year = get_fiscal_year(datetime.now())
-    df_bilan = df_bilan[df_bilan["annee_cloture_exercice"] <= current_fiscal_year]
-    logging.info(
-        f"dropped fiscal years that are in the future (remaining: {len(df_bilan)} rows)"
-    )
+    return df_bilan[df_bilan["annee_cloture_exercice"] <= current_fiscal_year]
+
 
+def _drop_duplicates(df_bilan: pd.DataFrame) -> pd.DataFrame:
     # Drop duplicates based on siren, fiscal year, and type_bilan
-    df_bilan = df_bilan.drop_duplicates(
+    return df_bilan.drop_duplicates(
         subset=["siren", "annee_cloture_exercice", "type_bilan"], keep="last"
     )
-    logging.info(f"dropped duplicate entries (remaining: {len(df_bilan)} rows)")
 
-    df_bilan = keep_one_bilan(
-        df_bilan,
-        {
-            # Consolidated entries takes priority
-            "K": "1-K",
-            # Then complete entries
-            "C": "2-C",
-            # Then simplified entries
-            "S": "3-S",
-        },
+
+def clean_bilans_financiers(df_bilan: pd.DataFrame) -> pd.DataFrame:
+    """Convert the raw INPI data, and keep one bilan per entity and fiscal year."""
+    with stage("convert_types", df_bilan) as s:
+        df_bilan = s.output(_convert_types(df_bilan))
+
+    with stage("get_fiscal_year", df_bilan) as s:
+        current_fiscal_year = get_fiscal_year(datetime.now())
+        df_bilan = s.output(_add_fiscal_year(df_bilan, current_fiscal_year))
+    logging.info(
+        f"dropped fiscal years that are in the future (remaining: {len(df_bilan)} rows)"
     )
+    return reduce_bilans_financiers(df_bilan)
+
+
+def reduce_bilans_financiers(df_bilan: pd.DataFrame) -> pd.DataFrame:
+    """Keep one bilan per entity and fiscal year (of converted INPI data)."""
+    with stage("drop_duplicates", df_bilan) as s:
+        df_bilan = s.output(_drop_duplicates(df_bilan))
+    logging.info(f"dropped duplicate entries (remaining: {len(df_bilan)} rows)")
+
+    with stage("keep_one_bilan", df_bilan) as s:
+        df_bilan = s.output(keep_one_bilan(df_bilan, KEEP_ONE_BILAN_PRIO))
     logging.info(
         f"combined entries to keep one bilan per year per entity, with consolidated bilans first"
         f" (remaining: {len(df_bilan)} rows)"
     )
     logging.info(f'{df_bilan["type_bilan"].value_counts()}')
 
-    df_bilan.to_csv(DATA_PATH / "interim/synthese_bilans_financiers.csv", index=False)
-
     # This is also possible if we need it
     # df_bilan_operational_first = keep_one_bilan(df_bilan, {
     #     # Complete entries take priority
@@ -109,16 +186,185 @@ def process_bilans_financiers():
     #     # Then consolidated entries
     #     'K': '3-K',
     # })
+    return df_bilan
 
 
-def filter_bilans_financiers_keep_only_ademe_sirens():
+def _get_byte_ranges(path: Path, range_bytes: int, n_min: int) -> list[tuple[int, int]]:
+    """Split a CSV file (after its header) into byte ranges of whole lines.
+
+    The ranges are at most `range_bytes` long (unless a line is longer), and there are at least
+    `n_min` of them (if the file has enough lines). This assumes that quoted fields do not contain
+    line breaks, which is the case of the INPI data.
+    """
+    size = path.stat().st_size
+    with open(path, "rb") as f:
+        f.readline()
+        start = f.tell()
+        n = max(n_min, -(-(size - start) // range_bytes))
+        boundaries = [start]
+        for offset in np.linspace(start, size, n + 1)[1:-1].astype(int):
+            f.seek(max(offset - 1, 0))
+            # go to the start of the next line
+            f.readline()
+            boundaries.append(f.tell())
+    boundaries.append(size)
+    boundaries = sorted(set(boundaries))
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _process_byte_range(
+    path: Path,
+    columns: list[str],
+    byte_range: tuple[int, int],
+    sirens: Optional[pd.Index],
+    current_fiscal_year: int,
+) -> pd.DataFrame:
+    """Parse, filter and convert a part of the raw INPI data (in a worker process)."""
+    start, end = byte_range
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
     df_bilan = pd.read_csv(
-        DATA_PATH / "interim/synthese_bilans_financiers.csv", dtype=str
+        io.BytesIO(data), dtype=str, sep=";", header=None, names=columns, usecols=FIELDS
     )
-    df_ademe = pd.read_csv(RAW_ADEME_DATA_PATH, sep=";")
-    ademe_siren_codes = df_ademe["SIREN principal"].unique()
-    df_bilan = df_bilan[df_bilan["siren"].isin(ademe_siren_codes)]
-    df_bilan.to_csv(FILTERED_FINANCIAL_DATA_PATH, index=False)
+    if sirens is not None:
+        df_bilan = df_bilan[df_bilan["siren"].isin(sirens)]
+    df_bilan = _add_fiscal_year(_convert_types(df_bilan), current_fiscal_year)
+    # Duplicates are also dropped in the final reduction, but this reduces the partial results
+    # (keeping the last duplicate of each part keeps the last one overall)
+    return _drop_duplicates(df_bilan)
+
+
+def read_bilans_financiers_parallel(
+    sirens: Optional[pd.Index] = None, workers: int = 2
+) -> pd.DataFrame:
+    """Parse, filter (if `sirens` is set) and convert the raw INPI data in `workers` processes,
+    each processing byte ranges of the file.
+
+    The partial results are concatenated in the order of the file, so that the output (after
+    `reduce_bilans_financiers`) does not depend on the number of workers.
+    """
+    _raw_data_path = RAW_FINANCIAL_DATA_PATH
+    logging.info(f"loading {_raw_data_path} with {workers} workers...")
+    with stage("read_ratios_inpi_bce") as s:
+        columns = pd.read_csv(_raw_data_path, sep=";", nrows=0).columns.tolist()
+        byte_ranges = _get_byte_ranges(_raw_data_path, RANGE_BYTES, n_min=workers)
+        process = functools.partial(
+            _process_byte_range,
+            _raw_data_path,
+            columns,
+            sirens=sirens,
+            current_fiscal_year=get_fiscal_year(datetime.now()),
+        )
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            df_bilan = s.output(pd.concat(executor.map(process, byte_ranges)))
+
+    logging.info(
+        f"loaded 'ratios_inpi_bce.csv' ({len(df_bilan)} rows, in {len(byte_ranges)} parts)"
+    )
+    return df_bilan
+
+
+def _read_and_clean_bilans_financiers(
+    sirens: Optional[pd.Index], chunksize: int, workers: int
+) -> pd.DataFrame:
+    if workers > 1:
+        return reduce_bilans_financiers(
+            read_bilans_financiers_parallel(sirens, workers)
+        )
+    if sirens is None:
+        return clean_bilans_financiers(read_bilans_financiers())
+    return clean_bilans_financiers(read_bilans_financiers(sirens, chunksize))
+
+
+def process_bilans_financiers(workers: int = 1):
+    """
+    Process financial data from INPI, for all entities.
+
+    The original CSV (~300Mb) can be downloaded from
+    https://www.data.gouv.fr/fr/datasets/r/9d213815-1649-4527-9eb4-427146ef2e5b
+    The documentation can be found at : https://www.data.gouv.fr/fr/datasets/ratios-financiers-bce-inpi/
+
+    This code is partly taken from the data pipeline of the "Annuaire des Entreprises" :
+    https://github.com/annuaire-entreprises-data-gouv-fr/search-infra/tree/4386f3c2bc54ba8635b050769a34015a3f97a8dd/workflows/data_pipelines/bilans_financiers
+    """
+    df_bilan = _read_and_clean_bilans_financiers(
+        sirens=None, chunksize=CHUNKSIZE, workers=workers
+    )
+    with stage("save_synthese_bilans_financiers", df_bilan):
+        df_bilan.to_csv(FINANCIAL_DATA_PATH, index=False)
+
+
+def filter_bilans_financiers_keep_only_ademe_sirens():
+    with stage("read_synthese_bilans_financiers") as s:
+        df_bilan = s.output(pd.read_csv(FINANCIAL_DATA_PATH, dtype=str))
+    with stage("read_ademe_sirens") as s:
+        df_ademe = s.output(pd.read_csv(RAW_ADEME_DATA_PATH, sep=";"))
+    with stage("filter_ademe_sirens", df_bilan) as s:
+        ademe_siren_codes = df_ademe["SIREN principal"].unique()
+        df_bilan = s.output(df_bilan[df_bilan["siren"].isin(ademe_siren_codes)])
+    with stage("save_filtered_bilans_financiers", df_bilan):
+        df_bilan.to_csv(FILTERED_FINANCIAL_DATA_PATH, index=False)
+
+
+def process_bilans_financiers_ademe_only(chunksize: int = CHUNKSIZE, workers: int = 1):
+    """
+    Same as `process_bilans_financiers` followed by `filter_bilans_financiers_keep_only_ademe_sirens`,
+    but the SIRENs that are not in the ADEME data are dropped while reading the raw INPI data,
+    before any processing (much faster, and the whole file is never in memory).
+
+    Args:
+        chunksize: number of rows read at once (with a single worker)
+        workers: if > 1, parse the raw INPI data in parallel in this number of processes
+    """
+    with stage("read_ademe_sirens") as s:
+        df_ademe = s.output(
+            pd.read_csv(
+                RAW_ADEME_DATA_PATH, sep=";", usecols=["SIREN principal"], dtype=str
+            )
+        )
+    ademe_siren_codes = pd.Index(df_ademe["SIREN principal"].dropna().unique())
+
+    df_bilan = _read_and_clean_bilans_financiers(
+        sirens=ademe_siren_codes, chunksize=chunksize, workers=workers
+    )
+    with stage("save_filtered_bilans_financiers", df_bilan):
+        df_bilan.to_csv(FILTERED_FINANCIAL_DATA_PATH, index=False)
+
+
+def main(
+    all_sirens: bool = False,
+    chunksize: int = CHUNKSIZE,
+    workers: int = 1,
+    report: Optional[Path] = None,
+    pyinstrument: bool = False,
+):
+    """
+    Args:
+        all_sirens: if True, also save the financial data of all the entities (not only the ones
+            in the ADEME data) to FINANCIAL_DATA_PATH. Much slower.
+        chunksize: number of rows of the raw INPI data read at once (if not all_sirens)
+        workers: if > 1, parse the raw INPI data in parallel in this number of processes
+        report: if set, save a JSON report of the time and memory used by each stage to this path
+            (see `StageProfiler`).
+        pyinstrument: if True, also save a pyinstrument profile of each stage, next to the report.
+    """
+
+    def run():
+        if all_sirens:
+            process_bilans_financiers(workers=workers)
+            filter_bilans_financiers_keep_only_ademe_sirens()
+        else:
+            process_bilans_financiers_ademe_only(chunksize=chunksize, workers=workers)
+
+    if report is None:
+        run()
+        return
+
+    pyinstrument_dir = report.with_suffix("") if pyinstrument else None
+    with StageProfiler(pyinstrument_dir=pyinstrument_dir) as profiler:
+        run()
+    profiler.save(report)
 
 
 if __name__ == "__main__":
@@ -130,5 +376,43 @@ if __name__ == "__main__":
     # For now, we run this pipeline locally, assuming the ratios_inpi_bce.csv file has been
     # downloaded manually and is in data/raw/heavy, and we save the light output to
     # data/interim/, to put it in the git repo.
-    process_bilans_financiers()
-    filter_bilans_financiers_keep_only_ademe_sirens()
+    parser = argparse.ArgumentParser(
+        description="Process the INPI financial data (ratios_inpi_bce.csv)"
+    )
+    parser.add_argument(
+        "--all-sirens",
+        action="store_true",
+        help="also save the financial data of all the entities (not only the ones in the ADEME data)",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=CHUNKSIZE,
+        help="number of rows of the raw INPI data read at once",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="parse the raw INPI data in parallel in WORKERS processes",
+    )
+    parser.add_argument(
+        "--report",
+        type=Path,
+        help="save a JSON report of the time and memory used by each stage to REPORT",
+    )
+    parser.add_argument(
+        "--pyinstrument",
+        action="store_true",
+        help="with --report, also save a pyinstrument profile of each stage next to the report",
+    )
+    args = parser.parse_args()
+    if args.pyinstrument and args.report is None:
+        parser.error("--pyinstrument requires --report")
+    main(
+        all_sirens=args.all_sirens,
+        chunksize=args.chunksize,
+        workers=args.workers,
+        report=args.report,
+        pyinstrument=args.pyinstrument,
+    )
@@ -0,0 +1,96 @@
+"""
+Compact integer codes for the keys of the processed datasets: the SIREN of the entities, and the
+Id of the bilans.
+
+The codes are assigned when the processed datasets are saved (see `add_key_columns`), and the
+reverse mapping is saved next to them (PROCESSED_KEYS_PATH). The app groups and counts on the
+codes (int32), and only decodes them for display:
+
+    - siren_code: index of the SIREN in the sorted array of SIRENs (missing if no valid SIREN)
+    - id_code: position of the bilan in the processed bilans dataset (0 to n_bilans - 1)
+"""
+
+import functools
+import logging
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from src.settings import PROCESSED_KEYS_PATH
+
+KEY_COLUMNS = ["siren_code", "id_code"]
+
+
+@dataclass
+class KeyEncoding:
+    """
+    Attributes:
+        sirens: the SIREN of each siren_code (sorted)
+        ids: the bilan Id of each id_code (in the order of the processed bilans dataset)
+    """
+
+    sirens: np.ndarray
+    ids: np.ndarray
+
+    @classmethod
+    def build(cls, df_bilans: pd.DataFrame) -> "KeyEncoding":
+        """Assign codes to the SIRENs and Ids of the processed bilans (one row per Id)."""
+        return cls(
+            sirens=np.sort(df_bilans["SIREN principal"].dropna().unique().astype(str)),
+            ids=df_bilans["Id"].to_numpy(dtype=np.int64),
+        )
+
+    def encode_sirens(self, sirens) -> np.ndarray:
+        """siren_code of each SIREN (-1 if missing or unknown)."""
+        return pd.Index(self.sirens).get_indexer(sirens).astype(np.int32)
+
+    def encode_ids(self, ids) -> np.ndarray:
+        """id_code of each bilan Id (-1 if unknown)."""
+        return pd.Index(self.ids).get_indexer(ids).astype(np.int32)
+
+    def decode_sirens(self, codes) -> np.ndarray:
+        """SIREN of each siren_code (NaN for missing codes)."""
+        codes = pd.array(codes, dtype="Int32").fillna(-1).to_numpy(dtype=np.int32)
+        x = np.full(len(codes), np.nan, dtype=object)
+        x[codes >= 0] = self.sirens[codes[codes >= 0]]
+        return x
+
+    def decode_ids(self, codes) -> np.ndarray:
+        """Bilan Id of each id_code."""
+        return self.ids[np.asarray(codes)]
+
+    def save(self, path=PROCESSED_KEYS_PATH):
+        np.savez(path, sirens=self.sirens, ids=self.ids)
+        logging.info(f"saved the key encoding to {path}")
+
+
+def load_key_encoding(path=PROCESSED_KEYS_PATH) -> KeyEncoding:
+    with np.load(path) as data:
+        return KeyEncoding(sirens=data["sirens"], ids=data["ids"])
+
+
+@functools.cache
+def get_key_encoding() -> KeyEncoding:
+    """The key encoding of the processed datasets, loaded once per process (e.g. for the app)."""
+    return load_key_encoding()
+
+
+def add_key_columns(
+    df_bilans: pd.DataFrame, df_emissions: pd.DataFrame, keys: KeyEncoding
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Add the siren_code and id_code columns to the bilans, and id_code to the emissions.
+
+    Args:
+        df_bilans: df with one row per Id, in the order used to build `keys`
+        df_emissions: df with one row per Id and non-empty poste d'émissions
+    """
+    siren_code = keys.encode_sirens(df_bilans["SIREN principal"])
+    df_bilans = df_bilans.assign(
+        siren_code=pd.arrays.IntegerArray(siren_code, mask=siren_code < 0),
+        id_code=np.arange(len(df_bilans), dtype=np.int32),
+    )
+    id_code = keys.encode_ids(df_emissions["Id"])
+    assert (id_code >= 0).all(), "emissions of an unknown bilan"
+    df_emissions = df_emissions.assign(id_code=id_code)
+    return df_bilans, df_emissions
@@ -1,75 +1,80 @@
+import argparse
+import hashlib
+import logging
+from pathlib import Path
 from typing import Optional
 
 import numpy as np
 import pandas as pd
 
-from src.settings import DATA_PATH, RAW_ADEME_DATA_PATH, FILTERED_FINANCIAL_DATA_PATH
+from src.settings import (
+    DATA_PATH,
+    RAW_ADEME_DATA_PATH,
+    FILTERED_FINANCIAL_DATA_PATH,
+    FINANCIAL_INDEX_PATH,
+    NAF_HIERARCHY_PATH,
+    PROCESSED_ALL_DATA_PATH,
+    PROCESSED_EMISSIONS_DATA_PATH,
+    PROCESSED_KEYS_PATH,
+    PROCESSED_MANIFEST_PATH,
+    STAGE_CACHE_PATH,
+)
+from src.data import naf
+from src.data import financial_index
+from src.data import keys as key_encoding
+from src.data.financial_index import FinancialIndex, load_financial_index
+from src.data.keys import KEY_COLUMNS, KeyEncoding, add_key_columns
+from src.data.naf import load_naf_hierarchy
+from src.data.profiling import StageProfiler, stage
+from src.data.stage_cache import Artifact, StageCache
+
+# Label columns with a small number of distinct values, repeated over many rows.
+# They are stored as categorical (i.e. dictionary-encoded) columns in the processed files.
+CATEGORICAL_COLUMNS = [
+    "Méthode BEGES (V4,V5)",
+    "Type de structure",
+    "Type de collectivité",
+    "Mode de consolidation",
+    "Recalcul",
+    "Comparaison avec le précédent bilan",
+    "Structure obligée",
+    "nb_salaries_range",
+    "naf5",
+    "naf5_non_unique",
+    *(f"naf{i}" for i in range(1, 5)),
+    *(f"naf{i}_code" for i in range(1, 5)),
+    "type_bilan_financier",
+    "poste_emissions",
+    "scope_name",
+    "poste_name",
+    "sub_poste_name",
+]
+
+
+def _nb_salaries_bounds(
+    nb_salaries: pd.Series,
+) -> tuple[pd.Series, pd.Series, pd.Series]:
+    """Parse the number of employees (e.g. 'Entre 5 000 et 9 999', 'Plus de 9 999').
 
-
-def _load_naf5_to_nafi_data() -> dict[str, dict[str, str]]:
-    # NIV5	    NIV4	NIV3	NIV2	NIV1
-    # 01.11Z	01.11	01.1	01	    A
-    # 01.12Z	01.12	01.1	01	    A
-    _df_naf_5_niveaux = pd.read_excel(
-        DATA_PATH / "raw/light/naf2008_5_niveaux.xls", dtype=str
+    Returns:
+        The (range, min, max) series. For instance: ('5000-9999', 5000, 9999) or ('9999-', 9999, nan)
+    """
+    bounds = (
+        nb_salaries.str.replace(" ", "")
+        .str.removeprefix("Entre")
+        .str.removeprefix("Plusde")
+        .str.split("et", n=1, expand=True)
+        .reindex(columns=[0, 1])
     )
-    _naf5_to_nafi = _df_naf_5_niveaux.set_index("NIV5").to_dict()
-    return _naf5_to_nafi
-
-
-def _load_naf_to_libelle_data() -> dict[str, dict[str, str]]:
-    df_naf_v1_to_v2 = pd.read_excel(DATA_PATH / "raw/light/table_NAF2-NAF1.xls")
-    df_naf_v1_to_v2 = df_naf_v1_to_v2.rename(
-        columns={f"NAF\nrév. {i}": f"naf_v{i}" for i in (1, 2)}
+    nb_min = pd.to_numeric(bounds[0])
+    nb_max = pd.to_numeric(bounds[1])
+    nb_range = (
+        nb_min.astype("Int64").astype(str)
+        + "-"
+        + nb_max.astype("Int64").astype(str).replace("<NA>", "")
     )
-    _naf_v1_to_v2 = df_naf_v1_to_v2[["naf_v1", "naf_v2"]].set_index("naf_v1").to_dict()
-
-    _naf_to_libelle = {}
-    for n in range(1, 5):
-        df_naf = pd.read_excel(
-            DATA_PATH / f"raw/light/naf2008_liste_n{n}.xls",
-            skiprows=2,
-            dtype={"Code": str},
-        )
-        _naf_to_libelle[f"NIV{n}"] = df_naf.set_index("Code").to_dict()["Libellé"]
-    return _naf_to_libelle
-
-
-def _nb_salaries_range(x: str):
-    """
-    Examples:
-        >>> _nb_salaries_range('Entre 5 000 et 9 999')
-        '5000-9999'
-        >>> _nb_salaries_range('Plus de 9 999')
-        '9999-'
-    """
-    if pd.isna(x):
-        return None
-    if "Plus de" in x:
-        x = x.removeprefix("Plus de ")
-        i = int(x.replace(" ", ""))
-        return f"{i}-"
-    x = x.removeprefix("Entre ")
-    i, j = x.split(" et ")
-    i = int(i.replace(" ", ""))
-    j = int(j.replace(" ", ""))
-    x = f"{i}-{j}"
-    return x
-
-
-def _nb_salaries_min(x: Optional[str]):
-    if x is None:
-        return None
-    return int(x.split("-")[0])
-
-
-def _nb_salaries_max(x: Optional[str]):
-    if x is None:
-        return None
-    i, j = x.split("-")
-    if len(j) == 0:
-        return None
-    return int(j)
+    nb_range = nb_range.where(nb_min.notna())
+    return nb_range, nb_min, nb_max
 
 
 def get_last_naf5(df):
@@ -101,55 +106,53 @@ def get_last_naf5(df):
     return y
 
 
-def enrich_df(df_raw: pd.DataFrame) -> pd.DataFrame:
+def _get_month_publication(date_publication: pd.Series) -> pd.Series:
+    # Convert to a python date (month is enough)
+    return pd.to_datetime(date_publication, dayfirst=True).dt.to_period("M")
+
+
+def _get_naf5(ape: pd.Series) -> pd.Series:
+    # e.g. 0111Z -> 01.11Z
+    return ape.str[:2] + "." + ape.str[2:]
+
+
+def enrich_df(
+    df_raw: pd.DataFrame, last_naf5: Optional[pd.Series] = None
+) -> pd.DataFrame:
+    """
+    Args:
+        df_raw: raw ADEME data
+        last_naf5: the unique naf5 of entities with multiple naf5 (see `get_last_naf5`). By default,
+            it is computed from df_raw, which then needs to contain all the bilans of each entity.
+    """
     df = df_raw.copy()
 
     # Get useful stats for number of employees
-    df["nb_salaries_range"] = df["Nombre de salariés/d'agents"].map(_nb_salaries_range)
-    df["nb_salaries_min"] = df["nb_salaries_range"].map(_nb_salaries_min)
-    df["nb_salaries_max"] = df["nb_salaries_range"].map(_nb_salaries_max)
+    nb_range, nb_min, nb_max = _nb_salaries_bounds(df["Nombre de salariés/d'agents"])
+    df["nb_salaries_range"] = nb_range
+    df["nb_salaries_min"] = nb_min
+    df["nb_salaries_max"] = nb_max
     df["nb_salaries_mean"] = (df["nb_salaries_min"] + df["nb_salaries_max"]) / 2
     # arbitrary value for 10000+ companies
     df.loc[df.nb_salaries_max.isnull(), "nb_salaries_mean"] = 15000
 
-    # Convert to a python date (month is enough)
-    df["month_publication"] = pd.to_datetime(
-        df["Date de publication"], dayfirst=True
-    ).dt.to_period("M")
-
-    df["naf5"] = df["APE(NAF) associé"].map(
-        lambda x: None if pd.isna(x) else f"{x[:2]}.{x[2:]}"
-    )
+    df["month_publication"] = _get_month_publication(df["Date de publication"])
+    df["naf5"] = _get_naf5(df["APE(NAF) associé"])
 
     # A few entities have multiple naf values registered (over multiple entries).
     # Introduce a 'naf5_last' column with a unique naf5 value per SIREN (typically the last one)
-    d = get_last_naf5(df).to_dict()["naf5"]
-
-    def _f(j):
-        if j["SIREN principal"] in d:
-            return d[j["SIREN principal"]]
-        return j["naf5"]
-
-    df["naf5_last"] = df.apply(_f, axis=1)
+    if last_naf5 is None:
+        last_naf5 = get_last_naf5(df)["naf5"]
+    siren = df["SIREN principal"]
+    df["naf5_last"] = siren.map(last_naf5).where(siren.isin(last_naf5.index), df.naf5)
     df = df.rename(columns={"naf5_last": "naf5", "naf5": "naf5_non_unique"})
 
-    # Get a readable name for NAF
-    _naf5_to_nafi = _load_naf5_to_nafi_data()
-    _naf_to_libelle = _load_naf_to_libelle_data()
-
-    def get_nafi(naf5: Optional[str], niv: int) -> Optional[str]:
-        if naf5 is None or naf5 not in _naf5_to_nafi[f"NIV{niv}"]:
-            return None
-        return _naf5_to_nafi[f"NIV{niv}"][naf5]
-
-    def naf_to_libelle(naf5: Optional[str], niv: int) -> Optional[str]:
-        if naf5 is None or naf5 not in _naf5_to_nafi[f"NIV{niv}"]:
-            return None
-        return _naf_to_libelle[f"NIV{niv}"][get_nafi(naf5, niv)]
-
+    # Get a readable name for NAF, using the compiled NAF hierarchy
+    naf = load_naf_hierarchy()
+    naf_idx = naf.ancestors(df.naf5)
     for i in range(1, 5):
-        df[f"naf{i}"] = df.naf5.map(lambda x: naf_to_libelle(x, niv=i))
-        df[f"naf{i}_code"] = df.naf5.map(lambda x: get_nafi(x, niv=i))
+        df[f"naf{i}"] = naf.take(naf.libelles[i], naf_idx[i])
+        df[f"naf{i}_code"] = naf.take(naf.codes[i], naf_idx[i])
     return df
 
 
@@ -199,62 +202,99 @@ def _load_emission_categories_code_to_name():
     return poste_code_to_name
 
 
-def add_financial_data(df):
+def add_financial_data(df, index: Optional[FinancialIndex] = None):
     """Add financial data from INPI (CA / resultat_net) to the ADEME dataset.
 
     Limitations:
         * This almost only affects entries with type_structure='Entreprises'.
         * For now, the financial dataset only contains data for years >=2019.
     """
-    df_financial = pd.read_csv(FILTERED_FINANCIAL_DATA_PATH, dtype={"siren": str})
-    df_financial = df_financial.rename(columns={"type_bilan": "type_bilan_financier"})
-    df = pd.merge(
-        df,
-        df_financial.rename(columns={"siren": "SIREN principal"}),
-        left_on=["SIREN principal", "Année de reporting"],
-        right_on=["SIREN principal", "annee_cloture_exercice"],
-        how="left",
-    )
-    return df
-
+    if index is None:
+        index = load_financial_index()
+    df_financial = index.lookup(df["SIREN principal"], df["Année de reporting"])
+    # (the columns of df are not copied)
+    return pd.concat([df, df_financial], axis=1, copy=False)
+
+
+def _get_poste_codes(columns) -> list[str]:
+    """Codes of the postes d'émissions (e.g. '1.1'), from the 'Emissions publication P1.1', ... columns"""
+    return [c.split(" P")[-1] for c in columns if "Emissions publication" in c]
+
+
+# Columns of the bilans (one row per Id) that are used along with the emissions in the benchmark
+# (the bilans and entities are identified by their integer codes, see src/data/keys.py)
+BENCHMARK_BILAN_COLUMNS = [
+    "id_code",
+    "siren_code",
+    "Méthode BEGES (V4,V5)",
+    "Type de structure",
+    "Type de collectivité",
+    "Mode de consolidation",
+    "Recalcul",
+    "Comparaison avec le précédent bilan",
+    "nb_salaries_range",
+    "nb_salaries_min",
+    "nb_salaries_max",
+    "nb_salaries_mean",
+    "naf5",
+    "naf1",
+    "naf2",
+    "naf3",
+    "naf4",
+    "month_publication",
+    "Année de reporting",
+    "Structure obligée",
+    "ca",
+    "resultat_net",
+]
+
+
+def transform_to_emissions_df(df_enriched: pd.DataFrame) -> pd.DataFrame:
+    """Sparse long format of the emissions of each bilan.
 
-def transform_to_benchmark_df(df_enriched: pd.DataFrame) -> pd.DataFrame:
-    poste_code_to_name = _load_emission_categories_code_to_name()
-
-    _emission_cols = [c for c in df_enriched.columns if "Emissions publication" in c]
-    _emission_cols = [c.split(" P")[-1] for c in _emission_cols]
+    Returns:
+        A dataframe with 3 columns (Id / poste_emissions / emissions), with one row per bilan and poste
+        d'émissions. Empty postes (nan or zero emissions) are dropped: most bilans only fill a few postes.
+    """
+    _emission_cols = _get_poste_codes(df_enriched.columns)
     df = df_enriched.rename(
         columns={f"Emissions publication P{i}": i for i in _emission_cols}
     )
     df = df.melt(
-        id_vars=[
-            "Id",
-            "SIREN principal",
-            "Méthode BEGES (V4,V5)",
-            "Type de structure",
-            "Type de collectivité",
-            "Mode de consolidation",
-            "Recalcul",
-            "Comparaison avec le précédent bilan",
-            "nb_salaries_range",
-            "nb_salaries_min",
-            "nb_salaries_max",
-            "nb_salaries_mean",
-            "naf5",
-            "naf1",
-            "naf2",
-            "naf3",
-            "naf4",
-            "month_publication",
-            "Année de reporting",
-            "Structure obligée",
-            "ca",
-            "resultat_net",
-        ],
+        id_vars=["Id"],
         value_vars=_emission_cols,
         value_name="emissions",
         var_name="poste_emissions",
     )
+    df = df[df["emissions"].fillna(0).ne(0)]
+    return df.reset_index(drop=True)
+
+
+def get_benchmark_df(
+    df_bilans: pd.DataFrame, df_emissions: pd.DataFrame
+) -> pd.DataFrame:
+    """Long format view of the emissions, as used by the benchmark dashboard.
+
+    Args:
+        df_bilans: df with one row per Id (at least with the BENCHMARK_BILAN_COLUMNS)
+        df_emissions: df with one row per Id and non-empty poste d'émissions (see `transform_to_emissions_df`),
+            with the id_code of the bilans (see `add_key_columns`)
+
+    Returns:
+        One row per Id and non-empty poste d'émissions, with the bilan columns, the emission intensities and
+        the names of the postes.
+    """
+    poste_code_to_name = _load_emission_categories_code_to_name()
+
+    # id_code is a dense integer key: join by position instead of hashing the Ids
+    id_code = df_bilans["id_code"].to_numpy()
+    rows = np.full(id_code.max() + 1 if len(id_code) else 0, -1)
+    rows[id_code] = np.arange(len(id_code))
+    rows = rows[df_emissions["id_code"].to_numpy()]
+    assert (rows >= 0).all(), "emissions of an unknown bilan"
+    df = df_bilans[BENCHMARK_BILAN_COLUMNS].iloc[rows].reset_index(drop=True)
+    df["poste_emissions"] = df_emissions["poste_emissions"].to_numpy()
+    df["emissions"] = df_emissions["emissions"].to_numpy()
 
     df["emissions_par_salarie"] = df["emissions"] / df["nb_salaries_mean"]
     # clip to 1 (instead of 0) to be able to apply log
@@ -270,15 +310,10 @@ def transform_to_benchmark_df(df_enriched: pd.DataFrame) -> pd.DataFrame:
         np.inf, np.nan
     )
 
-    df["scope_name"] = df["poste_emissions"].map(
-        lambda x: poste_code_to_name["nom_scope"][x]
-    )
-    df["poste_name"] = df["poste_emissions"].map(
-        lambda x: poste_code_to_name["nom_poste"][x]
-    )
-    df["sub_poste_name"] = df["poste_emissions"].map(
-        lambda x: poste_code_to_name["nom_sous_poste"][x]
-    )
+    poste_code = df["poste_emissions"].astype(object)
+    df["scope_name"] = poste_code.map(poste_code_to_name["nom_scope"])
+    df["poste_name"] = poste_code.map(poste_code_to_name["nom_poste"])
+    df["sub_poste_name"] = poste_code.map(poste_code_to_name["nom_sous_poste"])
     return df
 
 
@@ -286,7 +321,7 @@ def _clean_and_add_scope_3(df_a, df_b):
     """
     Args:
         df_a: df with one row per Id
-        df_b: df with multiple rows per Id (one for each poste emissions)
+        df_b: df with one row per Id and non-empty poste d'émissions (see `transform_to_emissions_df`)
 
     Returns:
         df_a, with a new column 'has_scope_3'
@@ -295,29 +330,432 @@ def _clean_and_add_scope_3(df_a, df_b):
     df_a = df_a[[c for c in df_a.columns if "Emissions" not in c]]
 
     # compute which Id have scope 3 data or not
-    scope3 = df_b.groupby(["Id", "scope_name"], as_index=False).emissions.sum()
-    scope3.emissions = scope3.emissions.fillna(0)
-    scope3 = scope3[scope3.scope_name == "3"]
-    scope3["has_scope_3"] = scope3.emissions.ne(0)
-    scope3 = scope3[["Id", "has_scope_3"]]
+    nom_scope = _load_emission_categories_code_to_name()["nom_scope"]
+    scope3 = df_b[df_b.poste_emissions.map(nom_scope) == "3"]
+    scope3 = scope3.groupby("Id").emissions.sum()
+
+    df_a = df_a.copy()
+    df_a["has_scope_3"] = df_a.Id.map(scope3).fillna(0).ne(0)
+    return df_a
+
+
+def save_processed(df: pd.DataFrame, path):
+    """Save a processed dataset as a typed parquet file.
+
+    Label columns are dictionary-encoded, and `month_publication` keeps its period dtype, so that
+    the app does not have to parse and infer the types again when loading the data.
+    """
+    if "naf5" in df.columns:
+        # (the "nan" placeholder of `get_last_naf5` is a missing value, as when read from a CSV)
+        df = df.assign(naf5=df["naf5"].mask(df["naf5"] == "nan"))
+    df = df.astype({c: "category" for c in CATEGORICAL_COLUMNS if c in df.columns})
+    df.to_parquet(path, index=False)
+
+
+def load_processed(path, columns: Optional[list[str]] = None) -> pd.DataFrame:
+    """Load a processed dataset saved with `save_processed` (optionally, only some of its columns)."""
+    df = pd.read_parquet(path, columns=columns)
+    # The app code expects plain (object) label columns for now (fillna, groupby, ...)
+    cat_columns = df.select_dtypes("category").columns
+    df[cat_columns] = df[cat_columns].astype(object)
+    return df
 
-    return pd.merge(df_a, scope3, on="Id")
+
+# Explicit dtypes for the columns of the raw ADEME export that are used to build the datasets.
+# (emission columns are float64, other columns are only passed through to the processed data)
+_RAW_DTYPES = {
+    "Id": "int64",
+    "SIREN principal": str,
+    "Méthode BEGES (V4,V5)": str,
+    "Type de structure": str,
+    "Type de collectivité": str,
+    "Mode de consolidation": str,
+    "Recalcul": str,
+    "Comparaison avec le précédent bilan": str,
+    "Nombre de salariés/d'agents": str,
+    "Date de publication": str,
+    "APE(NAF) associé": str,
+    "Année de reporting": "int64",
+    "Structure obligée": str,
+}
+
+
+def read_raw_ademe_data(path, chunksize: Optional[int] = None):
+    """Read the raw ADEME export (or an iterator over chunks of `chunksize` rows).
+
+    Only the emissions after publication ('Emissions publication P1.1', ...) are read: the other
+    emission columns (there are many) are not used.
+    """
+    columns = pd.read_csv(path, sep=";", nrows=0).columns
+    usecols = [
+        c for c in columns if "Emissions" not in c or "Emissions publication" in c
+    ]
+    dtype = _RAW_DTYPES | {
+        c: "float64" for c in usecols if "Emissions publication" in c
+    }
+    return pd.read_csv(path, sep=";", usecols=usecols, dtype=dtype, chunksize=chunksize)
+
+
+def _stage_deps() -> dict[str, list[Path]]:
+    """The files that each stage depends on, besides its inputs: the processing code, the
+    reference data and the artifacts compiled from them (compiled first if needed)."""
+    if not NAF_HIERARCHY_PATH.exists():
+        naf.compile_naf_hierarchy()
+    # (also compiles the financial index if it is missing or outdated)
+    load_financial_index()
+    return {
+        "enrich_df": [
+            Path(naf.__file__),
+            NAF_HIERARCHY_PATH,
+            *sorted((DATA_PATH / "raw/light").glob("*.xls")),
+        ],
+        "add_financial_data": [
+            Path(financial_index.__file__),
+            FILTERED_FINANCIAL_DATA_PATH,
+            FINANCIAL_INDEX_PATH,
+        ],
+        "_clean_and_add_scope_3": [
+            DATA_PATH / "raw/light/mapping-poste-emissions-ademe.csv"
+        ],
+    }
 
 
-def main():
+def _build_stages(cache: StageCache, raw: Artifact) -> tuple[Artifact, Artifact]:
+    deps = _stage_deps()
+    enriched = cache.stage(enrich_df, raw, deps=deps["enrich_df"])
+    enriched = cache.stage(
+        add_financial_data, enriched, deps=deps["add_financial_data"]
+    )
+    emissions = cache.stage(transform_to_emissions_df, enriched)
+    enriched = cache.stage(
+        _clean_and_add_scope_3,
+        enriched,
+        emissions,
+        deps=deps["_clean_and_add_scope_3"],
+    )
+    return enriched, emissions
+
+
+def build_datasets(df_raw: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Build the processed datasets from the raw ADEME data.
+
+    Returns:
+        df_enriched: one row per bilan (Id)
+        df_emissions: one row per bilan and non-empty poste d'émissions
+    """
+    enriched, emissions = _build_stages(StageCache(), Artifact.from_value(df_raw))
+    return enriched.load(), emissions.load()
+
+
+def _inputs_paths() -> list[Path]:
+    """The files (except raw ADEME rows) that the processed datasets depend on: the processing
+    code, the financial data, the light reference data and the artifacts compiled from them (the
+    same files as the stage deps, see `_stage_deps`)."""
+    paths = [
+        Path(__file__),
+        Path(key_encoding.__file__),
+        *(path for deps in _stage_deps().values() for path in deps),
+        *sorted((DATA_PATH / "raw/light").iterdir()),
+    ]
+    # (the paths in several lists are only listed once)
+    return list(dict.fromkeys(paths))
+
+
+def _inputs_fingerprint() -> str:
+    """Fingerprint of the files of `_inputs_paths`."""
+    h = hashlib.sha256()
+    for path in _inputs_paths():
+        h.update(path.read_bytes())
+    return h.hexdigest()
+
+
+def get_manifest(
+    df_raw: pd.DataFrame, fingerprint: Optional[str] = None
+) -> pd.DataFrame:
+    """Hash each raw bilan, to detect new or changed bilans between two ADEME exports.
+
+    The hash also depends on the `fingerprint` of the other inputs (by default, see `_inputs_fingerprint`):
+    if the code or the financial data change, all bilans are considered as changed.
+
+    Returns:
+        A dataframe with 3 columns (Id / SIREN principal / row_hash), one row per bilan
+    """
+    if fingerprint is None:
+        fingerprint = _inputs_fingerprint()
+    row_hash = pd.util.hash_pandas_object(
+        df_raw, index=False, hash_key=fingerprint[:16]
+    )
+    return pd.DataFrame(
+        {
+            "Id": df_raw["Id"].values,
+            "SIREN principal": df_raw["SIREN principal"].values,
+            "row_hash": row_hash.values,
+        }
+    )
+
+
+def build_datasets_incremental(
+    df_raw: pd.DataFrame,
+    manifest: pd.DataFrame,
+    df_enriched_prev: pd.DataFrame,
+    df_emissions_prev: pd.DataFrame,
+    manifest_prev: pd.DataFrame,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Same as `build_datasets`, but reuse the previously processed datasets and only process new
+    or changed bilans (according to the manifests).
+
+    Since naf5 is unified per entity (see `get_last_naf5`), a new or changed bilan can modify the
+    other bilans of the same entity: all the bilans of the affected entities (SIREN) are processed again.
+    """
+    x = pd.merge(
+        manifest,
+        manifest_prev,
+        on="Id",
+        how="outer",
+        suffixes=("", "_prev"),
+        indicator=True,
+    )
+    # new, changed or removed bilans (a changed bilan may also have changed its SIREN)
+    x = x[(x._merge != "both") | (x.row_hash != x.row_hash_prev)]
+    affected_sirens = pd.concat(
+        [x["SIREN principal"], x["SIREN principal_prev"]]
+    ).dropna()
+    logging.info(
+        f"{len(x)} new, changed or removed bilans ({affected_sirens.nunique()} entities affected)"
+    )
+
+    df_raw = df_raw[df_raw["SIREN principal"].isin(affected_sirens)]
+    if len(df_raw):
+        df_enriched, df_emissions = build_datasets(df_raw)
+    else:
+        df_enriched, df_emissions = (
+            df_enriched_prev.iloc[:0],
+            df_emissions_prev.iloc[:0],
+        )
+    df_enriched = pd.concat(
+        [
+            df_enriched_prev[
+                ~df_enriched_prev["SIREN principal"].isin(affected_sirens)
+            ],
+            df_enriched,
+        ]
+    )
+    df_emissions = pd.concat(
+        [
+            df_emissions_prev[
+                ~df_emissions_prev["Id"].isin(
+                    df_enriched_prev.loc[
+                        df_enriched_prev["SIREN principal"].isin(affected_sirens), "Id"
+                    ]
+                )
+            ],
+            df_emissions,
+        ]
+    )
+
+    return _sort_like_full_build(
+        df_enriched, df_emissions, ids=manifest["Id"], columns=df_raw.columns
+    )
+
+
+def _sort_like_full_build(
+    df_enriched: pd.DataFrame, df_emissions: pd.DataFrame, ids: pd.Series, columns
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Sort the datasets built by parts in the same order as `build_datasets`.
+
+    Args:
+        ids: the bilan Ids, in the order of the raw data
+        columns: the columns of the raw data
+    """
+    ids = pd.Index(ids)
+    postes = pd.Index(_get_poste_codes(columns))
+    df_enriched = df_enriched.iloc[
+        np.argsort(ids.get_indexer(df_enriched["Id"]), kind="stable")
+    ]
+    df_emissions = df_emissions.iloc[
+        np.lexsort(
+            (
+                ids.get_indexer(df_emissions["Id"]),
+                postes.get_indexer(df_emissions["poste_emissions"]),
+            )
+        )
+    ]
+    return df_enriched.reset_index(drop=True), df_emissions.reset_index(drop=True)
+
+
+def build_datasets_streaming(
+    path, chunksize: int
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Same as `build_datasets` (and `get_manifest`), but read and process the raw ADEME export by
+    chunks of `chunksize` rows, so that the whole export is never loaded in memory at once.
+
+    Only the (much lighter) processed outputs are accumulated.
+    """
+    # naf5 is unified per entity, which requires all the bilans of the entity: do a first
+    # (light) pass on the needed columns only
+    with stage("get_last_naf5") as s:
+        df = pd.read_csv(
+            path,
+            sep=";",
+            usecols=["SIREN principal", "APE(NAF) associé", "Date de publication"],
+            dtype=str,
+        )
+        df["naf5"] = _get_naf5(df["APE(NAF) associé"])
+        df["month_publication"] = _get_month_publication(df["Date de publication"])
+        last_naf5 = s.output(get_last_naf5(df))["naf5"]
+        del df
+
+    index = load_financial_index()
+    fingerprint = _inputs_fingerprint()
+    enriched, emissions, manifests = [], [], []
+    for df_raw in read_raw_ademe_data(path, chunksize=chunksize):
+        with stage("enrich_df", df_raw) as s:
+            df_enriched = s.output(enrich_df(df_raw, last_naf5=last_naf5))
+        with stage("add_financial_data", df_enriched) as s:
+            df_enriched = s.output(add_financial_data(df_enriched, index))
+        with stage("transform_to_emissions_df", df_enriched) as s:
+            df_emissions = s.output(transform_to_emissions_df(df_enriched))
+        with stage("_clean_and_add_scope_3", df_enriched, df_emissions) as s:
+            enriched.append(s.output(_clean_and_add_scope_3(df_enriched, df_emissions)))
+        emissions.append(df_emissions)
+        with stage("get_manifest", df_raw) as s:
+            manifests.append(s.output(get_manifest(df_raw, fingerprint)))
+        logging.info(f"processed {sum(len(x) for x in enriched)} bilans")
+
+    manifest = pd.concat(manifests, ignore_index=True)
+    with stage("_sort_like_full_build") as s:
+        df_enriched, df_emissions = s.output(
+            *_sort_like_full_build(
+                pd.concat(enriched),
+                pd.concat(emissions),
+                ids=manifest["Id"],
+                columns=df_raw.columns,
+            )
+        )
+    return df_enriched, df_emissions, manifest
+
+
+def main(
+    incremental: bool = False,
+    use_cache: bool = True,
+    chunksize: Optional[int] = None,
+    report: Optional[Path] = None,
+    pyinstrument: bool = False,
+):
     """Runs data processing scripts to turn raw data from (../raw) into
     cleaned data ready to be analyzed (saved in ../processed).
+
+    Args:
+        incremental: if True, reuse the previously processed data and only process
+            new or changed bilans.
+        use_cache: if True, skip the stages whose inputs did not change since a previous
+            run (see `StageCache`).
+        chunksize: if set, read and process the raw data by chunks of `chunksize` bilans
+            to bound memory usage (without incremental build or cache).
+        report: if set, save a JSON report of the time and memory used by each stage to this path
+            (see `StageProfiler`).
+        pyinstrument: if True, also save a pyinstrument profile of each stage, next to the report.
     """
-    df_raw = pd.read_csv(RAW_ADEME_DATA_PATH, sep=";")
+    if report is None:
+        _build_and_save(incremental, use_cache, chunksize)
+        return
 
-    df_enriched = enrich_df(df_raw)
-    df_enriched = add_financial_data(df_enriched)
-    df_benchmark = transform_to_benchmark_df(df_enriched)
-    df_enriched = _clean_and_add_scope_3(df_enriched, df_benchmark)
+    pyinstrument_dir = report.with_suffix("") if pyinstrument else None
+    with StageProfiler(pyinstrument_dir=pyinstrument_dir) as profiler:
+        _build_and_save(incremental, use_cache, chunksize)
+    profiler.save(report)
 
-    df_enriched.to_csv(DATA_PATH / "processed/bilans-ges-all.csv", index=False)
-    df_benchmark.to_csv(DATA_PATH / "processed/bilans-ges-benchmark.csv", index=False)
+
+def _build_and_save(incremental: bool, use_cache: bool, chunksize: Optional[int]):
+    if chunksize is not None:
+        df_enriched, df_emissions, manifest = build_datasets_streaming(
+            RAW_ADEME_DATA_PATH, chunksize
+        )
+    else:
+        cache = StageCache(STAGE_CACHE_PATH if use_cache else None)
+        raw = cache.file(RAW_ADEME_DATA_PATH, read_raw_ademe_data)
+        # (the deps of the manifest are the files of its fingerprint)
+        manifest = cache.stage(get_manifest, raw, deps=_inputs_paths()).load()
+
+        if incremental and PROCESSED_MANIFEST_PATH.exists():
+            with stage("load_previous_datasets") as s:
+                df_enriched_prev, df_emissions_prev, manifest_prev = s.output(
+                    # (the key codes are assigned again to the new datasets)
+                    pd.read_parquet(PROCESSED_ALL_DATA_PATH).drop(columns=KEY_COLUMNS),
+                    pd.read_parquet(PROCESSED_EMISSIONS_DATA_PATH).drop(
+                        columns=["id_code"]
+                    ),
+                    pd.read_parquet(PROCESSED_MANIFEST_PATH),
+                )
+            df_raw = raw.load()
+            with stage("build_datasets_incremental", df_raw) as s:
+                df_enriched, df_emissions = s.output(
+                    *build_datasets_incremental(
+                        df_raw,
+                        manifest,
+                        df_enriched_prev=df_enriched_prev,
+                        df_emissions_prev=df_emissions_prev,
+                        manifest_prev=manifest_prev,
+                    )
+                )
+        else:
+            enriched, emissions = _build_stages(cache, raw)
+            df_enriched, df_emissions = enriched.load(), emissions.load()
+            cache.prune()
+
+    with stage("add_key_columns", df_enriched, df_emissions) as s:
+        keys = KeyEncoding.build(df_enriched)
+        df_enriched, df_emissions = s.output(
+            *add_key_columns(df_enriched, df_emissions, keys)
+        )
+
+    with stage("save_processed", df_enriched, df_emissions, manifest):
+        keys.save(PROCESSED_KEYS_PATH)
+        save_processed(df_enriched, PROCESSED_ALL_DATA_PATH)
+        save_processed(df_emissions, PROCESSED_EMISSIONS_DATA_PATH)
+        manifest.to_parquet(PROCESSED_MANIFEST_PATH, index=False)
 
 
 if __name__ == "__main__":
-    main()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description="Process the raw data into datasets that the app can use"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only process new or changed bilans, reusing the previously processed data",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="run all the stages, even if their inputs did not change since the previous run",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        help="read and process the raw data by chunks of CHUNKSIZE bilans, to bound memory usage",
+    )
+    parser.add_argument(
+        "--report",
+        type=Path,
+        help="save a JSON report of the time and memory used by each stage to REPORT",
+    )
+    parser.add_argument(
+        "--pyinstrument",
+        action="store_true",
+        help="with --report, also save a pyinstrument profile of each stage next to the report",
+    )
+    args = parser.parse_args()
+    if args.pyinstrument and args.report is None:
+        parser.error("--pyinstrument requires --report")
+    if args.chunksize is not None and args.incremental:
+        parser.error("--chunksize cannot be used with --incremental")
+    main(
+        incremental=args.incremental,
+        use_cache=not args.no_cache,
+        chunksize=args.chunksize,
+        report=args.report,
+        pyinstrument=args.pyinstrument,
+    )
@@ -0,0 +1,121 @@
+"""
+NAF 2008 nomenclature (activity sectors), with 5 levels. For instance:
+
+    NIV5	    NIV4	NIV3	NIV2	NIV1
+    01.11Z	01.11	01.1	01	    A
+
+The original INSEE tables (.xls files in data/raw/light/) are slow to read, so they are compiled once
+into a compact artifact (see `compile_naf_hierarchy`): for each level, the array of codes, their libellé,
+and the index of their parent code in the level above.
+"""
+
+import logging
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from src.settings import DATA_PATH, NAF_HIERARCHY_PATH
+
+N_LEVELS = 5
+
+
+def _load_naf5_to_nafi_data() -> dict[str, dict[str, str]]:
+    # NIV5	    NIV4	NIV3	NIV2	NIV1
+    # 01.11Z	01.11	01.1	01	    A
+    # 01.12Z	01.12	01.1	01	    A
+    _df_naf_5_niveaux = pd.read_excel(
+        DATA_PATH / "raw/light/naf2008_5_niveaux.xls", dtype=str
+    )
+    _naf5_to_nafi = _df_naf_5_niveaux.set_index("NIV5").to_dict()
+    return _naf5_to_nafi
+
+
+def _load_naf_to_libelle_data() -> dict[str, dict[str, str]]:
+    _naf_to_libelle = {}
+    for n in range(1, N_LEVELS + 1):
+        df_naf = pd.read_excel(
+            DATA_PATH / f"raw/light/naf2008_liste_n{n}.xls",
+            skiprows=2,
+            dtype={"Code": str},
+        )
+        _naf_to_libelle[f"NIV{n}"] = df_naf.set_index("Code").to_dict()["Libellé"]
+    return _naf_to_libelle
+
+
+@dataclass
+class NafHierarchy:
+    """
+    Attributes:
+        codes: for each level (1 to 5), the array of NAF codes
+        libelles: for each level, the libellé of each code
+        parents: for each level (2 to 5), the index of the parent of each code, in the level above
+    """
+
+    codes: dict[int, np.ndarray]
+    libelles: dict[int, np.ndarray]
+    parents: dict[int, np.ndarray]
+
+    def ancestors(self, naf5: pd.Series) -> dict[int, np.ndarray]:
+        """Index of the code of each level (1 to 5) for each naf5 value (-1 if unknown)."""
+        idx = {N_LEVELS: pd.Index(self.codes[N_LEVELS]).get_indexer(naf5)}
+        for level in range(N_LEVELS, 1, -1):
+            parent = self.parents[level][idx[level]]
+            idx[level - 1] = np.where(idx[level] >= 0, parent, -1)
+        return idx
+
+    @staticmethod
+    def take(values: np.ndarray, idx: np.ndarray) -> np.ndarray:
+        """Select `values[idx]`, with NaN for unknown codes (idx=-1)."""
+        x = values.astype(object)[idx]
+        x[idx < 0] = np.nan
+        return x
+
+
+def compile_naf_hierarchy() -> NafHierarchy:
+    """Compile the NAF 2008 tables into NAF_HIERARCHY_PATH."""
+    df_naf_5_niveaux = pd.read_excel(
+        DATA_PATH / "raw/light/naf2008_5_niveaux.xls", dtype=str
+    )
+    naf_to_libelle = _load_naf_to_libelle_data()
+
+    codes, libelles, parents = {}, {}, {}
+    for level in range(1, N_LEVELS + 1):
+        codes[level] = df_naf_5_niveaux[f"NIV{level}"].unique().astype(str)
+        libelles[level] = np.array(
+            [naf_to_libelle[f"NIV{level}"][c] for c in codes[level]], dtype=str
+        )
+    for level in range(2, N_LEVELS + 1):
+        x = df_naf_5_niveaux.drop_duplicates(f"NIV{level}")
+        assert (x[f"NIV{level}"].values == codes[level]).all()
+        parents[level] = (
+            pd.Index(codes[level - 1])
+            .get_indexer(x[f"NIV{level - 1}"])
+            .astype(np.int32)
+        )
+
+    np.savez_compressed(
+        NAF_HIERARCHY_PATH,
+        **{f"codes_{i}": x for i, x in codes.items()},
+        **{f"libelles_{i}": x for i, x in libelles.items()},
+        **{f"parents_{i}": x for i, x in parents.items()},
+    )
+    logging.info(f"compiled the NAF hierarchy into {NAF_HIERARCHY_PATH}")
+    return NafHierarchy(codes=codes, libelles=libelles, parents=parents)
+
+
+def load_naf_hierarchy() -> NafHierarchy:
+    """Load the compiled NAF hierarchy (and compile it first if needed)."""
+    if not NAF_HIERARCHY_PATH.exists():
+        return compile_naf_hierarchy()
+    with np.load(NAF_HIERARCHY_PATH) as data:
+        return NafHierarchy(
+            codes={i: data[f"codes_{i}"] for i in range(1, N_LEVELS + 1)},
+            libelles={i: data[f"libelles_{i}"] for i in range(1, N_LEVELS + 1)},
+            parents={i: data[f"parents_{i}"] for i in range(2, N_LEVELS + 1)},
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    compile_naf_hierarchy()
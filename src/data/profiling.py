@@ -0,0 +1,178 @@
+"""
+Instrumentation of the stages of the data pipelines (`make_dataset` and `inpi`).
+
+Stages are marked in the code with `stage(...)`, which does nothing unless a `StageProfiler` is
+active. When it is, each stage records its wall time, CPU time, peak RSS, row counts and memory
+usage of its input and output frames, and optionally a pyinstrument profile:
+
+    >>> with StageProfiler(pyinstrument_dir=Path("reports")) as profiler:
+    ...     with stage("enrich_df", df_raw) as s:
+    ...         df = s.output(enrich_df(df_raw))
+    >>> profiler.save(Path("reports/make_dataset.json"))
+"""
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+
+import pandas as pd
+import psutil
+
+# Interval between two measurements of the RSS of the process, to find its peak during a stage
+_RSS_SAMPLING_INTERVAL = 0.005
+
+_active_profiler: Optional["StageProfiler"] = None
+
+
+def _frames_stats(frames: tuple) -> tuple[Optional[int], Optional[int]]:
+    """Total number of rows and memory usage (bytes) of the DataFrames among `frames`."""
+    frames = [x for x in frames if isinstance(x, pd.DataFrame)]
+    if not frames:
+        return None, None
+    return (
+        sum(len(x) for x in frames),
+        int(sum(x.memory_usage(deep=True).sum() for x in frames)),
+    )
+
+
+class _RssSampler(threading.Thread):
+    """Measure the peak RSS of the process in a background thread."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self._process = psutil.Process()
+        self._stop_event = threading.Event()
+        self.peak = self._process.memory_info().rss
+
+    def run(self):
+        while not self._stop_event.wait(_RSS_SAMPLING_INTERVAL):
+            self.peak = max(self.peak, self._process.memory_info().rss)
+
+    def stop(self) -> int:
+        self._stop_event.set()
+        self.join()
+        return max(self.peak, self._process.memory_info().rss)
+
+
+class StageRecord:
+    """Measurements of a stage (see `stage`)."""
+
+    def __init__(self, name: str, inputs: tuple = (), enabled: bool = True):
+        self.name = name
+        self.enabled = enabled
+        self.stats: dict[str, Any] = {"name": name}
+        if enabled:
+            self.stats["rows_in"], self.stats["memory_in"] = _frames_stats(inputs)
+            self.stats["rows_out"], self.stats["memory_out"] = None, None
+
+    def output(self, *outputs):
+        """Record the output(s) of the stage, and return them unchanged."""
+        if self.enabled:
+            self.stats["rows_out"], self.stats["memory_out"] = _frames_stats(outputs)
+        return outputs[0] if len(outputs) == 1 else outputs
+
+
+class StageProfiler:
+    """Collect the measurements of the stages run while it is active (as a context manager).
+
+    Args:
+        pyinstrument_dir: if set, also save a pyinstrument profile (.html) of each stage
+            in this folder (pyinstrument must be installed).
+    """
+
+    def __init__(self, pyinstrument_dir: Optional[Path] = None):
+        self.pyinstrument_dir = pyinstrument_dir
+        self.records: list[dict[str, Any]] = []
+        self._depth = 0
+        self._previous: Optional[StageProfiler] = None
+        self._start = None
+        self.total_wall_time: Optional[float] = None
+
+    def __enter__(self):
+        global _active_profiler
+        self._previous, _active_profiler = _active_profiler, self
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active_profiler
+        _active_profiler = self._previous
+        self.total_wall_time = time.perf_counter() - self._start
+
+    @contextmanager
+    def _run(self, record: StageRecord):
+        # pyinstrument only supports one profiler at a time: nested stages are part of the
+        # profile of their parent stage
+        profiler = None
+        if self.pyinstrument_dir is not None and self._depth == 0:
+            from pyinstrument import Profiler
+
+            profiler = Profiler()
+            profiler.start()
+
+        sampler = _RssSampler()
+        sampler.start()
+        rss_start = sampler.peak
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        self._depth += 1
+        try:
+            yield record
+        finally:
+            self._depth -= 1
+            record.stats.update(
+                depth=self._depth,
+                wall_time=time.perf_counter() - wall_start,
+                cpu_time=time.process_time() - cpu_start,
+                rss_start=rss_start,
+                rss_peak=sampler.stop(),
+            )
+            if profiler is not None:
+                profiler.stop()
+                self.pyinstrument_dir.mkdir(parents=True, exist_ok=True)
+                path = (
+                    self.pyinstrument_dir
+                    / f"{len(self.records):02d}-{record.name}.html"
+                )
+                profiler.write_html(path)
+                record.stats["pyinstrument_profile"] = str(path)
+            self.records.append(record.stats)
+            logging.info(
+                f"{record.name}: {record.stats['wall_time']:.2f}s, "
+                f"peak RSS {record.stats['rss_peak'] / 2**20:.0f}MiB"
+            )
+
+    def report(self) -> dict[str, Any]:
+        return {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "total_wall_time": self.total_wall_time,
+            "stages": self.records,
+        }
+
+    def save(self, path: Path):
+        """Save the report as JSON."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.report(), indent=2))
+        logging.info(f"saved the stages report to {path}")
+
+
+@contextmanager
+def stage(name: str, *inputs):
+    """Mark a stage of a pipeline, measured if a `StageProfiler` is active.
+
+    Args:
+        name: name of the stage in the report
+        inputs: inputs of the stage (the DataFrames among them are measured)
+
+    Yields:
+        a `StageRecord`, whose `output` method should be called with the output(s) of the stage
+    """
+    if _active_profiler is None:
+        yield StageRecord(name, enabled=False)
+        return
+    with _active_profiler._run(StageRecord(name, inputs)) as record:
+        yield record
@@ -0,0 +1,121 @@
+"""
+Frames shared by the processes of the app (`panel serve --num-procs N`), through memory-mapped
+Arrow files.
+
+The first process that needs a frame builds it, and saves it as an uncompressed Arrow IPC file,
+keyed by the files it is built from and by the code building it (the module of the build function,
+and all the modules of the same package that it imports). All the processes then map this
+file: the numerical, datetime and categorical columns of the frame are read-only views on the
+mapping, whose pages are shared by the processes (through the OS page cache) instead of being
+copied in each of them. Only the other columns (strings, booleans, integers with missing values)
+are still materialized by each process.
+
+    >>> df = load_shared_frame("benchmark", build_df, deps=[PROCESSED_ALL_DATA_PATH])
+"""
+
+import ast
+import importlib.util
+import logging
+import os
+import sys
+from pathlib import Path
+from types import ModuleType
+from typing import Callable, Sequence
+
+import pandas as pd
+import pyarrow as pa
+
+from src.data.stage_cache import _file_hash, _hash
+from src.settings import SHARED_FRAMES_PATH
+
+
+def _to_arrow(df: pd.DataFrame) -> pa.Table:
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for i, col in enumerate(df.columns):
+        if df[col].dtype.kind == "f":
+            # keep NaN as values instead of nulls: the column can then be viewed without a copy
+            array = pa.array(df[col].to_numpy(), from_pandas=False)
+            table = table.set_column(i, table.field(i), array)
+    return table
+
+
+def save_shared_frame(df: pd.DataFrame, path: Path):
+    """Save a frame as an (uncompressed) Arrow IPC file, that can be memory-mapped."""
+    table = _to_arrow(df)
+    # write to a temporary file first: other processes may be reading `path` concurrently
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with pa.OSFile(str(tmp_path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    tmp_path.replace(path)
+
+
+def read_shared_frame(path: Path) -> pd.DataFrame:
+    """Memory-map a frame saved with `save_shared_frame` (see the module docstring)."""
+    table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+    # (without split_blocks, columns of the same dtype would be copied into a single block)
+    return table.to_pandas(split_blocks=True)
+
+
+def _imported_modules(module: ModuleType) -> list[ModuleType]:
+    """The module, and the modules of its (top-level) package that it imports, recursively."""
+    package = module.__name__.split(".")[0]
+    modules = {}
+    todo = [module]
+    while todo:
+        module = todo.pop()
+        if module.__name__ in modules or not getattr(module, "__file__", None):
+            continue
+        modules[module.__name__] = module
+        # (the import statements, since imported constants do not tell their module)
+        for node in ast.walk(ast.parse(Path(module.__file__).read_bytes())):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom):
+                parent = importlib.util.resolve_name(
+                    "." * node.level + (node.module or ""), module.__package__
+                )
+                # (`from package import module` imports a module)
+                names = [parent, *(f"{parent}.{alias.name}" for alias in node.names)]
+            else:
+                continue
+            todo += [
+                sys.modules[name]
+                for name in names
+                if name.split(".")[0] == package and name in sys.modules
+            ]
+    return [modules[name] for name in sorted(modules)]
+
+
+def _code_version(build: Callable) -> str:
+    # `build` also depends on the helpers it calls, in other modules (e.g. src.data.make_dataset
+    # or src.data.compaction): hash the source files of all the modules that may define them
+    modules = _imported_modules(sys.modules[build.__module__])
+    return _hash(*(_file_hash(Path(m.__file__)) for m in modules))
+
+
+def load_shared_frame(
+    name: str,
+    build: Callable[[], pd.DataFrame],
+    deps: Sequence[Path] = (),
+    cache_dir: Path = SHARED_FRAMES_PATH,
+) -> pd.DataFrame:
+    """The frame built by `build()`, memory-mapped from `cache_dir` (and built first if needed).
+
+    Args:
+        name: name of the frame (and of its file)
+        build: function building the frame
+        deps: files read by `build`, that should invalidate the saved frame when they change (the
+            source files of the code are already taken into account, see `_code_version`)
+    """
+    key = _hash(name, _code_version(build), *(_file_hash(p) for p in deps))
+    path = cache_dir / f"{name}-{key[:16]}.arrow"
+    if not path.exists():
+        logging.info(f"{name}: building the shared frame {path.name}")
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        save_shared_frame(build(), path)
+        for stale_path in cache_dir.glob(f"{name}-*.arrow"):
+            if stale_path != path:
+                # (processes still mapping it keep their view, until they close it)
+                stale_path.unlink(missing_ok=True)
+    return read_shared_frame(path)
@@ -0,0 +1,148 @@
+import functools
+import hashlib
+import inspect
+import logging
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Optional, Sequence
+
+import pandas as pd
+
+from src.data.profiling import stage
+
+
+@dataclass
+class Artifact:
+    """The (lazy) output of a pipeline stage.
+
+    Attributes:
+        key: content-addressed key of the artifact. It only depends on the inputs of the stage
+            that produced it (and their own keys), so it is known before computing anything.
+        load: compute or load the artifact value (only once).
+    """
+
+    key: Optional[str]
+    load: Callable[[], Any]
+
+    @classmethod
+    def from_value(cls, value, key: Optional[str] = None):
+        return cls(key=key, load=lambda: value)
+
+
+def _hash(*parts: str | bytes) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode() if isinstance(part, str) else part)
+        # separator, so that ("ab", "c") and ("a", "bc") have different hashes
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _file_hash(path: Path) -> str:
+    stat = path.stat()
+    return _file_content_hash(path, stat.st_mtime_ns, stat.st_size)
+
+
+@functools.cache
+def _file_content_hash(path: Path, mtime_ns: int, size: int) -> str:
+    # mtime and size are only used to invalidate the memoized hash
+    return _hash(path.read_bytes())
+
+
+@functools.cache
+def _code_version(fn: Callable) -> str:
+    # Use the source code of the whole module, since stages also depend on other helper functions
+    return _hash(inspect.getsource(sys.modules[fn.__module__]))
+
+
+class StageCache:
+    """Content-addressed cache for the stages of the data pipeline.
+
+    Each stage is keyed by a fingerprint of its inputs (files or outputs of previous stages),
+    its data dependencies and its code version. Outputs are stored in `cache_dir`, so that a
+    stage whose key did not change is loaded from disk instead of being computed again.
+
+    Artifacts are lazy: if the last stages of the pipeline are already cached, the previous
+    stages (and the raw data) are not even loaded.
+
+    Examples:
+        >>> cache = StageCache(DATA_PATH / "cache")
+        >>> raw = cache.file(RAW_ADEME_DATA_PATH, read_raw_ademe_data)
+        >>> enriched = cache.stage(enrich_df, raw)
+        >>> df = enriched.load()
+    """
+
+    def __init__(self, cache_dir: Optional[Path] = None):
+        """
+        Args:
+            cache_dir: where to store the outputs of the stages. If None, nothing is cached
+                and stages are simply computed.
+        """
+        self.cache_dir = cache_dir
+        self._used_paths: set[Path] = set()
+        if cache_dir is not None:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def file(self, path: Path, read: Callable[[Path], Any]) -> Artifact:
+        """An input file of the pipeline, keyed by its content."""
+
+        def load():
+            with stage(read.__name__) as s:
+                return s.output(read(path))
+
+        return Artifact(key=_file_hash(path), load=functools.cache(load))
+
+    def stage(
+        self, fn: Callable, *inputs: Artifact, deps: Sequence[Path] = ()
+    ) -> Artifact:
+        """Run `fn(*inputs)` as a pipeline stage (lazily).
+
+        Args:
+            fn: the stage function, returning a DataFrame.
+            inputs: artifacts passed as arguments to `fn`.
+            deps: other files read by `fn`, that should invalidate the cache when they change.
+        """
+
+        def compute():
+            args = [i.load() for i in inputs]
+            with stage(fn.__name__, *args) as s:
+                return s.output(fn(*args))
+
+        if self.cache_dir is None:
+            return Artifact(key=None, load=functools.cache(compute))
+
+        key = _hash(
+            fn.__qualname__,
+            _code_version(fn),
+            *(i.key for i in inputs),
+            *(_file_hash(p) for p in deps),
+        )
+        path = self.cache_dir / f"{fn.__name__}-{key[:16]}.pkl"
+        self._used_paths.add(path)
+
+        @functools.cache
+        def load():
+            if path.exists():
+                logging.info(f"{fn.__name__}: loading cached output {path.name}")
+                with stage(fn.__name__) as s:
+                    s.stats["cached"] = True
+                    return s.output(pd.read_pickle(path))
+            logging.info(f"{fn.__name__}: computing...")
+            value = compute()
+            # write to a temporary file first, so that an interrupted run never leaves a corrupted entry
+            tmp_path = path.with_suffix(".tmp")
+            value.to_pickle(tmp_path)
+            tmp_path.rename(path)
+            return value
+
+        return Artifact(key=key, load=load)
+
+    def prune(self):
+        """Remove the cached outputs that were not used by the current pipeline."""
+        if self.cache_dir is None:
+            return
+        for path in self.cache_dir.glob("*.pkl"):
+            if path not in self._used_paths:
+                logging.info(f"removing stale cache entry {path.name}")
+                path.unlink()
@@ -0,0 +1,261 @@
+"""
+Synthetic (scaled-up) versions of the raw datasets, to benchmark the data pipeline and the app
+at arbitrary sizes (e.g. 10x or 100x the number of bilans of the real ADEME export).
+
+The synthetic data is obtained by resampling the *entities* (SIREN) of the real data, with all
+their bilans. This preserves the column schema, the distribution of NAF codes, the sparsity of the
+postes d'émissions (emissions are only multiplied by a random factor per entity) and the
+SIREN/year overlap with the INPI financial data. The first copy of the real data keeps its
+original SIRENs and Ids, the other copies get new ones.
+
+The outputs are written with the same layout as the data/ folder, so that the pipeline can run on
+them by pointing the BILANS_GES_DATA_PATH environment variable to the output folder:
+
+    python -m src.data.synthetic --scale 10 --output-dir data/synthetic/x10
+    BILANS_GES_DATA_PATH=data/synthetic/x10 python -m src.data.make_dataset
+"""
+
+import argparse
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.settings import (
+    DATA_PATH,
+    FILTERED_FINANCIAL_DATA_PATH,
+    RAW_ADEME_DATA_PATH,
+    RAW_FINANCIAL_DATA_PATH,
+)
+
+# Standard deviation of the (log-normal) factor applied to the emissions and financial data
+# of each synthetic entity
+ENTITY_FACTOR_SIGMA = 0.3
+# In the raw INPI data, the number of rows for SIRENs that are not in the ADEME data, relative to
+# the number of rows for SIRENs that are (roughly 3M rows vs 10k rows).
+# Only used when the raw INPI data is not available.
+UNMATCHED_FINANCIAL_ROWS_RATIO = 300
+# Only used when the raw INPI data is not available, to emulate the entries that are dropped by
+# `process_bilans_financiers`: fraction of rows duplicated with another type_bilan, and
+# fraction of rows that are exact duplicates
+OTHER_TYPE_BILAN_FRACTION = 0.15
+DUPLICATE_FRACTION = 0.02
+
+_FINANCIAL_FIELDS = [
+    "siren",
+    "chiffre_d_affaires",
+    "resultat_net",
+    "date_cloture_exercice",
+    "type_bilan",
+]
+
+
+def _new_sirens(n: int, exclude) -> np.ndarray:
+    """`n` valid (9 digits) SIREN codes, not in `exclude`."""
+    exclude = pd.Index(exclude).dropna()
+    candidates = np.arange(100_000_000, 100_000_000 + n + len(exclude))
+    candidates = pd.Index([f"{x:09d}" for x in candidates])
+    return candidates[~candidates.isin(exclude)][:n].to_numpy()
+
+
+def _ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Concatenation of the ranges [start, start + length)."""
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + np.arange(lengths.sum()) - offsets
+
+
+def scale_ademe_data(
+    df_raw: pd.DataFrame, scale: float, rng: np.random.Generator, exclude_sirens=()
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Resample the entities of the raw ADEME data.
+
+    Args:
+        df_raw: raw ADEME data (read as strings)
+        scale: ratio between the number of synthetic entities and real entities. The real entities
+            are copied `int(scale)` times, and the remaining ones are sampled without replacement.
+        exclude_sirens: SIREN codes that should not be used for the new entities
+
+    Returns:
+        df: the synthetic ADEME data
+        df_sirens: the SIREN of each synthetic entity ('siren'), the SIREN of its original entity
+            ('siren_source') and the factor applied to its data ('factor')
+    """
+    # bilans without SIREN are considered as separate entities
+    entity = df_raw["SIREN principal"].fillna("Id " + df_raw["Id"].astype(str))
+    codes, uniques = pd.factorize(entity)
+    n_entities = len(uniques)
+    n_copies, n_remaining = divmod(round(scale * n_entities), n_entities)
+    source = np.concatenate(
+        [
+            np.tile(np.arange(n_entities), n_copies),
+            np.sort(rng.choice(n_entities, n_remaining, replace=False)),
+        ]
+    )
+    copy = np.arange(len(source)) // n_entities
+    factor = np.where(
+        copy == 0, 1.0, rng.lognormal(0, ENTITY_FACTOR_SIGMA, len(source))
+    )
+
+    # all the bilans of each synthetic entity
+    rows = np.argsort(codes, kind="stable")
+    counts = np.bincount(codes, minlength=n_entities)
+    starts = np.cumsum(counts) - counts
+    row_idx = rows[_ranges(starts[source], counts[source])]
+    entity_idx = np.repeat(np.arange(len(source)), counts[source])
+    # keep the order of the real data within each copy
+    order = np.lexsort((row_idx, copy[entity_idx]))
+    row_idx, entity_idx = row_idx[order], entity_idx[order]
+
+    df = df_raw.iloc[row_idx].reset_index(drop=True)
+    is_copy = copy[entity_idx] > 0
+    ids = df["Id"].astype("int64")
+    df["Id"] = np.where(is_copy, ids.max() + np.cumsum(is_copy), ids)
+
+    siren_source = uniques.to_numpy()[source]
+    has_siren = (copy > 0) & ~pd.Series(siren_source).str.startswith("Id ").to_numpy()
+    siren = np.where(copy == 0, siren_source, None)
+    siren[has_siren] = _new_sirens(
+        has_siren.sum(), exclude=np.concatenate([uniques, list(exclude_sirens)])
+    )
+    df.loc[is_copy, "SIREN principal"] = siren[entity_idx][is_copy]
+    if "Raison sociale" in df.columns:
+        df.loc[is_copy, "Raison sociale"] += (
+            " (" + copy[entity_idx][is_copy].astype(str) + ")"
+        )
+
+    for c in df.columns:
+        if "Emissions" in c:
+            df[c] = pd.to_numeric(df[c]) * factor[entity_idx]
+
+    df_sirens = pd.DataFrame(
+        {"siren": siren, "siren_source": siren_source, "factor": factor}
+    )
+    df_sirens = df_sirens[~df_sirens.siren_source.str.startswith("Id ")]
+    return df, df_sirens.reset_index(drop=True)
+
+
+def scale_financial_data(
+    df_financial: pd.DataFrame, df_sirens: pd.DataFrame
+) -> pd.DataFrame:
+    """The financial data of the synthetic entities (see `scale_ademe_data`).
+
+    Args:
+        df_financial: financial data, with a 'siren' column and either 'ca' or 'chiffre_d_affaires'
+    """
+    df = df_sirens.merge(
+        df_financial.rename(columns={"siren": "siren_source"}), on="siren_source"
+    )
+    for c in ["ca", "chiffre_d_affaires", "resultat_net"]:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c]) * df["factor"]
+    return df.drop(columns=["siren_source", "factor"])
+
+
+def _emulate_raw_financial_data(
+    df_financial: pd.DataFrame,
+    n_unmatched: int,
+    rng: np.random.Generator,
+    exclude_sirens,
+) -> pd.DataFrame:
+    """Emulate the raw INPI data (ratios_inpi_bce.csv) from the filtered financial data."""
+    df = df_financial.rename(columns={"ca": "chiffre_d_affaires"})[_FINANCIAL_FIELDS]
+
+    # entities that are not in the ADEME data: resample the entities of the filtered data
+    # (with all their rows), with new SIRENs
+    codes, uniques = pd.factorize(df["siren"])
+    rows = np.argsort(codes, kind="stable")
+    counts = np.bincount(codes)
+    starts = np.cumsum(counts) - counts
+    source = rng.integers(0, len(uniques), round(n_unmatched / counts.mean()))
+    unmatched = df.iloc[rows[_ranges(starts[source], counts[source])]].copy()
+    new_sirens = _new_sirens(len(source), exclude=exclude_sirens)
+    unmatched["siren"] = np.repeat(new_sirens, counts[source])
+
+    df = pd.concat([df, unmatched])
+    other_type = df.sample(frac=OTHER_TYPE_BILAN_FRACTION, random_state=rng)
+    other_type["type_bilan"] = rng.choice(["K", "C", "S"], len(other_type))
+    duplicates = df.sample(frac=DUPLICATE_FRACTION, random_state=rng)
+    return pd.concat([df, other_type, duplicates]).sort_values(
+        ["siren", "date_cloture_exercice"], kind="stable"
+    )
+
+
+def generate(scale: float, output_dir: Path, seed: int = 0):
+    """Write synthetic versions of the raw ADEME data, of the raw INPI data and of the filtered
+    financial data to `output_dir` (with the same layout as DATA_PATH)."""
+    rng = np.random.default_rng(seed)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    df_raw = pd.read_csv(RAW_ADEME_DATA_PATH, sep=";", dtype=str)
+    df_filtered = pd.read_csv(FILTERED_FINANCIAL_DATA_PATH, dtype=str)
+    if RAW_FINANCIAL_DATA_PATH.exists():
+        df_financial_raw = pd.read_csv(
+            RAW_FINANCIAL_DATA_PATH, sep=";", dtype=str, usecols=_FINANCIAL_FIELDS
+        )
+        unmatched_sirens = df_financial_raw["siren"].unique()
+    else:
+        df_financial_raw = None
+        unmatched_sirens = []
+
+    df, df_sirens = scale_ademe_data(
+        df_raw, scale, rng, exclude_sirens=unmatched_sirens
+    )
+    logging.info(f"generated {len(df)} bilans ({df_sirens.siren.nunique()} SIRENs)")
+
+    path = output_dir / RAW_ADEME_DATA_PATH.relative_to(DATA_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    df.to_csv(path, sep=";", index=False)
+
+    path = output_dir / FILTERED_FINANCIAL_DATA_PATH.relative_to(DATA_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    df_filtered = scale_financial_data(df_filtered, df_sirens)
+    df_filtered.to_csv(path, index=False)
+
+    if df_financial_raw is not None:
+        # copies of the real entities, and the other entities unchanged
+        is_ademe = df_financial_raw["siren"].isin(df_sirens["siren_source"])
+        df_financial_raw = pd.concat(
+            [
+                scale_financial_data(df_financial_raw[is_ademe], df_sirens),
+                df_financial_raw[~is_ademe],
+            ]
+        )
+    else:
+        df_financial_raw = _emulate_raw_financial_data(
+            df_filtered,
+            n_unmatched=UNMATCHED_FINANCIAL_ROWS_RATIO * len(df_filtered),
+            rng=rng,
+            exclude_sirens=df["SIREN principal"].unique(),
+        )
+    df_financial_raw.to_csv(
+        output_dir / RAW_FINANCIAL_DATA_PATH.relative_to(DATA_PATH),
+        sep=";",
+        index=False,
+    )
+    logging.info(f"generated {len(df_financial_raw)} rows of raw INPI data")
+
+    (output_dir / "processed").mkdir(exist_ok=True)
+    # the light data (NAF tables, ...) is unchanged
+    light_path = output_dir / "raw/light"
+    if not light_path.exists():
+        os.symlink(DATA_PATH / "raw/light", light_path, target_is_directory=True)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic (scaled-up) versions of the raw datasets"
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        required=True,
+        help="ratio between the number of synthetic and real entities (e.g. 10)",
+    )
+    parser.add_argument("--output-dir", type=Path, required=True)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate(args.scale, args.output_dir, seed=args.seed)
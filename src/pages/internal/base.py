@@ -54,6 +54,7 @@ def _get_navbar_links(page):
         for href, n in [
             ("benchmark", "Benchmark Émissions"),
             ("profiles", "Profil des entreprises et des bilans publiés"),
+            ("ranking", "Positionner un bilan"),
             ("about", "À propos"),
         ]
     ]
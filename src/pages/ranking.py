@@ -0,0 +1,5 @@
+from src.pages.internal import base as b
+from src.visualization.panel_figures.ranking import get_ranking_dashboard
+
+template = b.get_template(main=get_ranking_dashboard(), page="ranking")
+template.servable()
@@ -0,0 +1,5 @@
+from src.pages.internal import base as b
+from src.visualization.panel_figures.stats import get_stats_dashboard
+
+template = b.get_template(main=get_stats_dashboard(), page="stats")
+template.servable()
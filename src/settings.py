@@ -1,10 +1,39 @@
+import os
 from pathlib import Path
 
-DATA_PATH = Path(__file__).resolve().parents[1] / "data/"
+# Can be overridden, e.g. to run the pipeline on synthetic data (see src/data/synthetic.py)
+DATA_PATH = Path(
+    os.environ.get(
+        "BILANS_GES_DATA_PATH", Path(__file__).resolve().parents[1] / "data/"
+    )
+).resolve()
 # Path to the (uncompressed) dataset of Bilans GES
 RAW_ADEME_DATA_PATH = DATA_PATH / "raw/heavy/export-inventaires-opendata-21-07-2024.csv"
+# Path to the (uncompressed) financial data from INPI (not versioned, see src/data/inpi.py)
+RAW_FINANCIAL_DATA_PATH = DATA_PATH / "raw/heavy/ratios_inpi_bce.csv"
+# Path to the financial data (one bilan per entity and fiscal year)
+FINANCIAL_DATA_PATH = DATA_PATH / "interim/synthese_bilans_financiers.csv"
 # Path to the financial data (C.A. from INPI data), after filtering to keep only
 # entries already present in the ADEME dataset
 FILTERED_FINANCIAL_DATA_PATH = (
     DATA_PATH / "interim/synthese_bilans_financiers_ademe_only.csv"
 )
+# Index of the filtered financial data by (SIREN, fiscal year) (see src/data/financial_index.py)
+FINANCIAL_INDEX_PATH = DATA_PATH / "interim/financial_index.npy"
+# Processed datasets (typed parquet files), used by the app
+PROCESSED_ALL_DATA_PATH = DATA_PATH / "processed/bilans-ges-all.parquet"
+PROCESSED_EMISSIONS_DATA_PATH = DATA_PATH / "processed/bilans-ges-emissions.parquet"
+# Hash of each raw bilan used to build the processed datasets (for incremental builds)
+PROCESSED_MANIFEST_PATH = DATA_PATH / "processed/manifest.parquet"
+# Integer codes of the SIRENs and bilan Ids of the processed datasets (see src/data/keys.py)
+PROCESSED_KEYS_PATH = DATA_PATH / "processed/keys.npz"
+# Outputs of the data pipeline stages, to skip the stages whose inputs did not change
+STAGE_CACHE_PATH = DATA_PATH / "cache"
+# Frames of the app, memory-mapped by all its processes (see src/data/shared_frames.py)
+SHARED_FRAMES_PATH = DATA_PATH / "cache/shared"
+# NAF 2008 nomenclature, compiled from the INSEE tables (see src/data/naf.py)
+NAF_HIERARCHY_PATH = DATA_PATH / "interim/naf2008.npz"
+
+# Number of worker threads computing the results of the dashboards, outside of the event loop of the
+# server (see src/visualization/panel_figures/benchmark.py)
+DASHBOARD_WORKERS = int(os.environ.get("BILANS_GES_DASHBOARD_WORKERS", 4))
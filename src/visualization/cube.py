@@ -0,0 +1,300 @@
+"""
+Aggregation cube of a long frame of emissions (one row per bilan and poste d'émissions), to answer
+the filter and group_by states of the benchmark dashboard without grouping the long frame.
+
+The cube holds the values of each bilan and poste in a dense array (value, bilan, poste). A query
+selects the bilans (with a `FilterIndex` on the bilan columns) and the postes (on the poste
+columns), and sums the cube along the postes of each group: either all of them (group by a bilan
+column, summed by category of postes first), or the postes of each category, scope, ... (group by
+a poste column).
+"""
+
+import threading
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from src.visualization.filter_index import FilterIndex
+
+
+class AggregationCube:
+    """
+    Args:
+        df: long frame, with one row per bilan (`id_column`) and poste
+        bilan_columns: columns with one value per bilan, that can be filtered and grouped on
+        poste_columns: columns with one value per poste, that can be filtered and grouped on. The
+            first one identifies the poste, the others are coarser levels (category, scope, ...).
+        value_columns: numerical columns, summed by the queries (NaN are considered as 0)
+    """
+
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        bilan_columns: Sequence[str],
+        poste_columns: Sequence[str],
+        value_columns: Sequence[str],
+        id_column: str = "id_code",
+    ):
+        self.bilan_columns = list(bilan_columns)
+        self.poste_columns = list(poste_columns)
+        self.value_columns = list(value_columns)
+        self.id_column = id_column
+
+        _, first_row, bilan_codes = np.unique(
+            df[id_column], return_index=True, return_inverse=True
+        )
+        self.bilans = df.iloc[first_row][[id_column, *bilan_columns]].reset_index(
+            drop=True
+        )
+        self.bilan_index = FilterIndex(self.bilans, columns=bilan_columns)
+
+        poste_codes, postes = pd.factorize(df[poste_columns[0]], sort=True)
+        assert (poste_codes >= 0).all(), "missing poste"
+        first_row = np.unique(poste_codes, return_index=True)[1]
+        self.postes = df.iloc[first_row][poste_columns].reset_index(drop=True)
+
+        cell = bilan_codes * len(postes) + poste_codes
+        assert len(np.unique(cell)) == len(cell), "expected one row per bilan and poste"
+        # (the sums are computed in float64, and returned with the dtypes of the value columns)
+        self.value_dtypes = df[value_columns].dtypes.tolist()
+        self.values = np.zeros((len(value_columns), len(self.bilans), len(postes)))
+        self.values[:, bilan_codes, poste_codes] = (
+            df[value_columns].fillna(0).to_numpy(dtype=float).T
+        )
+        # (see `_poste_groups`)
+        self._groups: dict[str, tuple[np.ndarray, pd.Index]] = {}
+
+    def _check_query(self, selection: dict, group_by: str):
+        unknown = set(selection) - {*self.bilan_columns, *self.poste_columns}
+        if unknown:
+            raise ValueError(f"Unknown columns {unknown}")
+        if group_by not in self.bilan_columns and group_by not in self.poste_columns:
+            raise ValueError(f"Cannot group by {group_by}")
+
+    def _select_bilans(self, selection: dict[str, Optional[Sequence]]) -> np.ndarray:
+        return self.bilan_index.rows(
+            {c: v for c, v in selection.items() if c in self.bilan_columns}
+        )
+
+    def _select_postes(self, selection: dict[str, Optional[Sequence]]) -> np.ndarray:
+        """Mask of the selected postes."""
+        mask = np.ones(len(self.postes), dtype=bool)
+        for col in self.poste_columns:
+            if selection.get(col) is not None:
+                mask &= self.postes[col].isin(selection[col]).to_numpy()
+        return mask
+
+    def _poste_groups(self, column: str) -> tuple[np.ndarray, pd.Index]:
+        """The group of each poste for a poste column, and the labels of the groups."""
+        if column not in self._groups:
+            # (missing values are a group, as with groupby(dropna=False))
+            self._groups[column] = pd.factorize(
+                self.postes[column], use_na_sentinel=False
+            )
+        return self._groups[column]
+
+    def _block_column(self, group_by: str) -> str:
+        """The poste column whose groups (the blocks) are summed separately: `group_by` itself for
+        a poste column, and the categories of postes (the level above the poste) for a bilan
+        column, whose sums are then the sums of their blocks (see `_reduce_blocks`).
+
+        (The queries on a bilan column are summed by block too, so that `IncrementalQuery` can
+        update the sums of a few blocks and give exactly the same results.)
+        """
+        if group_by in self.poste_columns:
+            return group_by
+        return self.poste_columns[min(1, len(self.poste_columns) - 1)]
+
+    def _reduce_blocks(
+        self, sums: np.ndarray, counts: np.ndarray, *, group_by: str
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """The `_sums` of the groups of `group_by`, from the `_sums` of its blocks."""
+        if group_by in self.poste_columns:
+            return sums, counts
+        # (in the order of the blocks)
+        return sums.sum(axis=2, keepdims=True), counts.sum(axis=1, keepdims=True)
+
+    def _sums(
+        self,
+        bilans: np.ndarray,
+        postes: np.ndarray,
+        *,
+        nonzero: str,
+        column: str,
+        selected: list[int],
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """The sums (value, bilan, group) of the selected value columns over the given postes, by
+        group of a poste `column`, and the number of postes (bilan, group) with a non-zero value of
+        `nonzero`."""
+        # (only the selected cells are copied)
+        present = (
+            self.values[self.value_columns.index(nonzero)][np.ix_(bilans, postes)] != 0
+        )
+        values = np.where(present, self.values[np.ix_(selected, bilans, postes)], 0.0)
+        group_codes = self._poste_groups(column)[0][postes]
+        n_groups = len(self._poste_groups(column)[1])
+        sums = np.zeros((len(selected), len(bilans), n_groups))
+        counts = np.zeros((len(bilans), n_groups), dtype=np.int32)
+        for g in np.unique(group_codes):
+            sums[:, :, g] = values[:, :, group_codes == g].sum(axis=2)
+            counts[:, g] = present[:, group_codes == g].sum(axis=1)
+        return sums, counts
+
+    def _to_frame(
+        self,
+        bilans: np.ndarray,
+        sums: np.ndarray,
+        counts: np.ndarray,
+        *,
+        group_by: str,
+        value_columns: Sequence[str],
+    ) -> pd.DataFrame:
+        """The result of a query, from the `_sums` of the selected bilans."""
+        rows, group_idx = np.nonzero(counts > 0)
+        if group_by in self.bilan_columns:
+            labels = self.bilans[group_by].array.take(bilans[rows])
+        else:
+            labels = self._poste_groups(group_by)[1].take(group_idx)
+        sums = sums[:, rows, group_idx]
+
+        df = pd.DataFrame(
+            {
+                group_by: labels,
+                self.id_column: self.bilans[self.id_column]
+                .iloc[bilans[rows]]
+                .to_numpy(),
+                **{
+                    col: values.astype(self.value_dtypes[self.value_columns.index(col)])
+                    for col, values in zip(value_columns, sums)
+                },
+            }
+        )
+        df = df.sort_values([group_by, self.id_column], kind="stable")
+        return df.reset_index(drop=True)
+
+    def query(
+        self,
+        selection: dict[str, Optional[Sequence]],
+        *,
+        nonzero: str,
+        group_by: str,
+        value_columns: Optional[Sequence[str]] = None,
+    ) -> pd.DataFrame:
+        """Sum of the values of each bilan and group, over the selected bilans and postes.
+
+        The result is the same as filtering the long frame (see `FilterIndex.rows`), and then
+        grouping it by [group_by, id_column] and summing the value columns.
+
+        Args:
+            selection: the selected values for each bilan or poste column (None to select all)
+            nonzero: only sum the postes with a non-zero value in this column
+            group_by: a bilan or poste column
+            value_columns: only sum these value columns (by default, all of them)
+
+        Returns:
+            a frame with the columns group_by, id_column and value_columns, with one row per
+            bilan and group with at least one non-zero value of `nonzero`, sorted by group and bilan
+        """
+        self._check_query(selection, group_by)
+        if value_columns is None:
+            value_columns = self.value_columns
+        bilans = self._select_bilans(selection)
+        sums, counts = self._sums(
+            bilans,
+            np.flatnonzero(self._select_postes(selection)),
+            nonzero=nonzero,
+            column=self._block_column(group_by),
+            selected=[self.value_columns.index(c) for c in value_columns],
+        )
+        sums, counts = self._reduce_blocks(sums, counts, group_by=group_by)
+        return self._to_frame(
+            bilans, sums, counts, group_by=group_by, value_columns=value_columns
+        )
+
+
+class IncrementalQuery:
+    """The successive queries of a session on an AggregationCube, answered by updating the sums
+    of the previous query.
+
+    The sums are kept by block of postes (see `AggregationCube._block_column`): selecting other
+    postes (e.g. toggling a category of emissions) only computes again the blocks whose selected
+    postes changed, and selecting a subset of the bilans does not compute anything. The sums are
+    computed again from scratch (for the selected bilans) when more blocks changed than were kept,
+    when other bilans are selected, or when the other arguments of the query change.
+
+    A block is always summed over all its selected postes, in the same order, and the blocks are
+    summed as in `AggregationCube.query`: the result of a query is exactly the one of the cube,
+    whatever the previous queries of the session.
+
+    Args:
+        cube: the cube to query (`IncrementalQuery.query` has the same signature as
+            `AggregationCube.query`)
+    """
+
+    def __init__(self, cube: AggregationCube):
+        self.cube = cube
+        self.n_full = 0
+        self.n_incremental = 0
+        self._key = None
+        # (the bilans and postes of the kept sums, and the sums and counts of each block)
+        self._bilans: Optional[np.ndarray] = None
+        self._postes: Optional[np.ndarray] = None
+        self._sums: Optional[np.ndarray] = None
+        self._counts: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def query(
+        self,
+        selection: dict[str, Optional[Sequence]],
+        *,
+        nonzero: str,
+        group_by: str,
+        value_columns: Optional[Sequence[str]] = None,
+    ) -> pd.DataFrame:
+        cube = self.cube
+        cube._check_query(selection, group_by)
+        if value_columns is None:
+            value_columns = cube.value_columns
+        key = (nonzero, group_by, tuple(value_columns))
+        bilans = cube._select_bilans(selection)
+        postes = cube._select_postes(selection)
+        block_column = cube._block_column(group_by)
+        blocks, block_labels = cube._poste_groups(block_column)
+        kwargs = dict(
+            nonzero=nonzero,
+            column=block_column,
+            selected=[cube.value_columns.index(c) for c in value_columns],
+        )
+
+        # (the queries of a session may run concurrently, in different worker threads)
+        with self._lock:
+            incremental = key == self._key and np.isin(bilans, self._bilans).all()
+            if incremental:
+                changed = np.unique(blocks[postes != self._postes])
+                incremental = len(changed) <= len(block_labels) - len(changed)
+            if incremental:
+                sums, counts = self._sums.copy(), self._counts.copy()
+                if len(changed):
+                    changed_sums, changed_counts = cube._sums(
+                        self._bilans,
+                        np.flatnonzero(postes & np.isin(blocks, changed)),
+                        **kwargs,
+                    )
+                    sums[:, :, changed] = changed_sums[:, :, changed]
+                    counts[:, changed] = changed_counts[:, changed]
+                self.n_incremental += 1
+            else:
+                self._bilans = bilans
+                sums, counts = cube._sums(bilans, np.flatnonzero(postes), **kwargs)
+                self.n_full += 1
+            self._key, self._postes = key, postes
+            self._sums, self._counts = sums, counts
+            rows = np.searchsorted(self._bilans, bilans)
+
+        sums, counts = cube._reduce_blocks(
+            sums[:, rows], counts[rows], group_by=group_by
+        )
+        return cube._to_frame(
+            bilans, sums, counts, group_by=group_by, value_columns=value_columns
+        )
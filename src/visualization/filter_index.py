@@ -0,0 +1,95 @@
+"""
+Bitmap index of a DataFrame, to answer the filters of a dashboard without scanning the frame.
+
+For each indexed column, the rows of each distinct value are stored as a packed bitmap (1 bit per
+row). A filter state (a list of selected values per column) is answered by OR-ing the bitmaps of the
+selected values within a column, and AND-ing the result across columns: the cost only depends on the
+number of rows (and barely on the number of selected values), and the frame itself is only read to
+materialize the surviving rows.
+
+    >>> index = FilterIndex(df, columns=["Type de structure", "naf1"])
+    >>> rows = index.rows({"Type de structure": ["Entreprise"], "naf1": None})
+"""
+
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+class FilterIndex:
+    """
+    Args:
+        df: the frame to index (it should not be modified afterwards)
+        columns: the columns that can be filtered on
+        nonzero_columns: numerical columns for which rows with NaN or zero values can be excluded
+            (see `rows`)
+    """
+
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        columns: Sequence[str],
+        nonzero_columns: Sequence[str] = (),
+    ):
+        self.df = df
+        self.values: dict[str, pd.Index] = {}
+        self.bitmaps: dict[str, np.ndarray] = {}
+        for col in columns:
+            codes, uniques = pd.factorize(df[col])
+            self.values[col] = pd.Index(uniques)
+            # (the last bitmap is the one of the missing values, whose code is -1)
+            bitmaps = np.empty((len(uniques) + 1, (len(df) + 7) // 8), dtype=np.uint8)
+            for i in [*range(len(uniques)), -1]:
+                bitmaps[i] = np.packbits(codes == i)
+            self.bitmaps[col] = bitmaps
+        self.nonzero_bitmaps = {
+            col: np.packbits(df[col].fillna(0).ne(0).to_numpy())
+            for col in nonzero_columns
+        }
+
+    def __len__(self):
+        return len(self.df)
+
+    def _column_bitmap(self, col: str, selected_values: Sequence) -> np.ndarray:
+        selected_values = pd.Series(list(selected_values), dtype=object)
+        idx = self.values[col].get_indexer(selected_values.dropna())
+        idx = idx[idx >= 0]
+        if selected_values.isna().any():
+            # any missing value (None, NaN, ...) selects the rows with missing values
+            idx = np.append(idx, -1)
+        if len(idx) == 0:
+            return np.zeros(self.bitmaps[col].shape[1], dtype=np.uint8)
+        return np.bitwise_or.reduce(self.bitmaps[col][idx], axis=0)
+
+    def rows(
+        self,
+        selection: dict[str, Optional[Sequence]],
+        nonzero: Optional[str] = None,
+    ) -> np.ndarray:
+        """Positions of the rows matching all the filters.
+
+        Args:
+            selection: the selected values for each column (None to select all the values)
+            nonzero: if set, also exclude the rows with NaN or zero values in this column
+        """
+        bitmap = None
+        for col, selected_values in selection.items():
+            if selected_values is None:
+                continue
+            x = self._column_bitmap(col, selected_values)
+            bitmap = x if bitmap is None else bitmap & x
+        if nonzero is not None:
+            x = self.nonzero_bitmaps[nonzero]
+            bitmap = x if bitmap is None else bitmap & x
+        if bitmap is None:
+            return np.arange(len(self))
+        return np.flatnonzero(np.unpackbits(bitmap, count=len(self)))
+
+    def take(
+        self, rows: np.ndarray, columns: Optional[Sequence[str]] = None
+    ) -> pd.DataFrame:
+        """The given rows of the frame (and only the given columns, if set)."""
+        if columns is None:
+            return self.df.take(rows)
+        return self.df.iloc[rows, self.df.columns.get_indexer(columns)]
@@ -1,14 +1,35 @@
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
 import pandas as pd
 import panel as pn
 import param
 from panel.widgets import MultiChoice
 import holoviews as hv
 
-from src.data.make_dataset import DATA_PATH
-from src.visualization.utils import section
+from src.data.compaction import compact_frame
+from src.data.make_dataset import (
+    BENCHMARK_BILAN_COLUMNS,
+    CATEGORICAL_COLUMNS,
+    get_benchmark_df,
+    load_processed,
+)
+from src.data.shared_frames import load_shared_frame
+from src.settings import (
+    DASHBOARD_WORKERS,
+    DATA_PATH,
+    PROCESSED_ALL_DATA_PATH,
+    PROCESSED_EMISSIONS_DATA_PATH,
+)
+from src.visualization.cube import AggregationCube, IncrementalQuery
+from src.visualization.filter_index import FilterIndex
+from src.visualization.result_cache import LRUCache, sizeof
+from src.visualization.utils import AsyncMemoizedNode, section
 from src.visualization.visualize import (
-    _get_upper_bar,
     LABELS,
+    box_whisker_from_stats,
+    get_box_stats,
 )
 
 # -- Notes on flex-box and responsive sizing
@@ -42,27 +63,63 @@ STYLES = {
     "border": "1px solid WhiteSmoke",
 }
 
+# Results of the dashboard, shared by all the sessions of the process (see `get_result`)
+RESULT_CACHE = LRUCache(max_bytes=256 * 2**20)
+# Workers computing the results of the dashboard (see `prepare_result`), shared by all the sessions of
+# the process, so that a slow computation does not block the other sessions
+EXECUTOR = ThreadPoolExecutor(
+    max_workers=DASHBOARD_WORKERS, thread_name_prefix="benchmark"
+)
+
 
 @pn.cache
 def get_df() -> pd.DataFrame:
-    df = pd.read_csv(DATA_PATH / "processed/bilans-ges-benchmark.csv")
-    df = df.rename(
-        columns={
-            "naf1": LABELS.secteur_activite,
-            "scope_name": LABELS.scope_emissions,
-            "poste_name": LABELS.category_emissions,
-            "sub_poste_name": LABELS.poste_emissions,
-            "emissions_par_salarie": LABELS.emissions_par_collaborateur,
-            "emissions": LABELS.emissions_total,
-            "emissions_par_CA_kgco2_keur": LABELS.emissions_par_ca,
-        }
+    """The long frame of the dashboard, shared by the processes of the server (read-only, see
+    `load_shared_frame`)."""
+    return load_shared_frame(
+        "benchmark",
+        _build_df,
+        deps=[
+            PROCESSED_ALL_DATA_PATH,
+            PROCESSED_EMISSIONS_DATA_PATH,
+            # (read by get_benchmark_df, for the names of the postes)
+            DATA_PATH / "raw/light/mapping-poste-emissions-ademe.csv",
+        ],
+    )
+
+
+_COLUMN_LABELS = {
+    "naf1": LABELS.secteur_activite,
+    "scope_name": LABELS.scope_emissions,
+    "poste_name": LABELS.category_emissions,
+    "sub_poste_name": LABELS.poste_emissions,
+    "emissions_par_salarie": LABELS.emissions_par_collaborateur,
+    "emissions": LABELS.emissions_total,
+    "emissions_par_CA_kgco2_keur": LABELS.emissions_par_ca,
+}
+
+
+def _build_df(compact: bool = True) -> pd.DataFrame:
+    df = get_benchmark_df(
+        load_processed(PROCESSED_ALL_DATA_PATH, columns=BENCHMARK_BILAN_COLUMNS),
+        load_processed(
+            PROCESSED_EMISSIONS_DATA_PATH,
+            columns=["id_code", "poste_emissions", "emissions"],
+        ),
     )
+    df = df.rename(columns=_COLUMN_LABELS)
     df[LABELS.secteur_activite] = (
         df[LABELS.secteur_activite].fillna("undefined").astype(str)
     )
     df[LABELS.scope_emissions] = df[LABELS.scope_emissions].astype(str)
-    df.month_publication = pd.to_datetime(df.month_publication)
+    df.month_publication = df.month_publication.dt.to_timestamp()
     df[LABELS.annee_publication] = df.month_publication.dt.year
+    if compact:
+        df = compact_frame(
+            df,
+            categorical_columns=[_COLUMN_LABELS.get(c, c) for c in CATEGORICAL_COLUMNS],
+            name="benchmark",
+        )
     return df
 
 
@@ -174,26 +231,31 @@ def get_benchmark_dashboard():
         **{f"{k}_options": w.param.selected_options for k, w in _flat_widgets.items()},
     )
 
-    data = pn.bind(
-        filter_options, df=df, secteur_activite="all", plot_col=plot_col, **kwargs
+    # the filtered and aggregated data, and the outputs computed from it, are only computed once
+    # per change of the widgets (in a worker thread, see `prepare_result`), and shared with the
+    # other sessions (see `get_result`). The aggregations of the session are updated incrementally
+    # when a filter option is toggled (see `IncrementalQuery`).
+    data_node = AsyncMemoizedNode(
+        prepare_result, normalize=_state_key, executor=EXECUTOR
     )
-    data = pn.bind(aggregate_bilans, df=data, group_by=group_by)
-    plot_emissions_widget = pn.bind(
-        plot_emissions, df=data, plot_col=plot_col, group_by=group_by
+    state = dict(
+        cube=IncrementalQuery(get_cube()),
+        secteur_activite="all",
+        plot_col=plot_col,
+        group_by=group_by,
+        **kwargs,
     )
-    plot_n_bilans_widget = pn.bind(plot_n_bilans, df=data, group_by=group_by)
-    _n_bilans_text = pn.bind(n_bilans_text, df=data)
+
+    async def _get_output(name: str, **state):
+        return getattr(await data_node(**state), name)
+
+    plot_emissions_widget = pn.bind(_get_output, "emissions_plot", **state)
+    plot_n_bilans_widget = pn.bind(_get_output, "n_bilans_plot", **state)
 
     # Wrap the widget with a function that logs all the args for the request.
     # This is purely for logging purposes (but cannot be done as a standalone pn.bind call,
     # otherwise the callback is never called)
-    n_bilans_widget = pn.bind(
-        _log_request,
-        _n_bilans_text=_n_bilans_text,
-        plot_col=plot_col,
-        group_by=group_by,
-        **kwargs,
-    )
+    n_bilans_widget = pn.bind(_log_request, _data_node=data_node, **state)
 
     filter_widgets = [
         pn.layout.Card(
@@ -252,41 +314,116 @@ def get_benchmark_dashboard():
     )
 
 
-def filter_options(
-    df: pd.DataFrame,
-    *,
-    secteur_activite: str,
-    plot_col: str,
-    **kwargs,
-):
-    x = df.copy()
+def _build_filter_index(df: pd.DataFrame) -> FilterIndex:
+    return FilterIndex(
+        df,
+        columns=[opts["col"] for opts in FILTERS.values()],
+        nonzero_columns=PLOT_COL_OPTIONS,
+    )
 
+
+@pn.cache
+def get_filter_index() -> FilterIndex:
+    """The FilterIndex of the long frame of the dashboard (see `get_df`)."""
+    return _build_filter_index(get_df())
+
+
+@pn.cache
+def get_cube() -> AggregationCube:
+    perimetre_columns = GROUP_BY_OPTIONS["Périmètre"]
+    bilan_columns = [
+        *GROUP_BY_OPTIONS["Bilans"],
+        *(opts["col"] for opts in FILTERS.values()),
+    ]
+    return AggregationCube(
+        get_df(),
+        bilan_columns=[
+            c for c in dict.fromkeys(bilan_columns) if c not in perimetre_columns
+        ],
+        # from the finest to the coarsest level
+        poste_columns=perimetre_columns[::-1],
+        value_columns=PLOT_COL_OPTIONS,
+    )
+
+
+def _state_key(kwargs: dict) -> tuple:
+    """Canonical form of the state of the widgets: the selected options of a filter do not matter
+    when 'All' is checked, nor their order (nor the cube answering the queries of the session)."""
+    key = {
+        k: v
+        for k, v in kwargs.items()
+        if not (k == "cube" or k.endswith("_all") or k.endswith("_options"))
+    }
+    for k in FILTERS:
+        if not kwargs.get(f"{k}_all", True):
+            key[k] = frozenset(kwargs.get(f"{k}_options", []))
+    return tuple(sorted(key.items(), key=lambda item: item[0]))
+
+
+def _get_selection(secteur_activite: str, kwargs: dict) -> dict[str, list]:
+    """The selected options of each filtered column (popped from the widget `kwargs`)."""
+    selection = {}
     if secteur_activite != "all":
-        x = x[x[LABELS.secteur_activite] == secteur_activite]
+        selection[LABELS.secteur_activite] = [secteur_activite]
 
     for key, opts in FILTERS.items():
         select_all: bool = kwargs.pop(f"{key}_all", True)
         selected_options: list[str] = kwargs.pop(f"{key}_options", [])
         col_name = opts["col"]
         if not select_all:
-            x = x[x[col_name].isin(selected_options)]
+            if col_name in selection:
+                selected_options = [
+                    x for x in selection[col_name] if x in selected_options
+                ]
+            selection[col_name] = selected_options
 
     if kwargs:
         raise ValueError(f"Remaining {kwargs=}")
+    return selection
+
+
+def value_columns(plot_col: str) -> list[str]:
+    """The value columns displayed for `plot_col`: the indicator itself, and the total emissions (to
+    count the bilans including each poste, see `plot_n_bilans`)."""
+    return list(dict.fromkeys([plot_col, LABELS.emissions_total]))
+
+
+def filter_options(
+    df: pd.DataFrame,
+    *,
+    secteur_activite: str,
+    plot_col: str,
+    index: Optional[FilterIndex] = None,
+    columns: Optional[list[str]] = None,
+    **kwargs,
+):
+    """Select the rows of `df` matching the filter options, with non-zero values of `plot_col`.
+
+    Args:
+        index: the FilterIndex of `df` (by default, the one of `get_df`, or built on the fly for
+            another frame)
+        columns: only return these columns (by default, all of them)
+    """
+    if index is None:
+        index = get_filter_index() if df is get_df() else _build_filter_index(df)
+    selection = _get_selection(secteur_activite, kwargs)
 
     # drop nan values and zeros
-    with pd.option_context("future.no_silent_downcasting", True):
-        # the context is just here to remove a pandas warning
-        x = x.fillna(0)
-    x = x[x[plot_col] != 0]
-    return x
+    x = index.take(index.rows(selection, nonzero=plot_col), columns)
+    # (label columns are categoricals, only numerical columns are filled)
+    return x.fillna({c: 0 for c in x.select_dtypes("number").columns})
 
 
-def aggregate_bilans(df: pd.DataFrame, *, group_by: str):
+def aggregate_bilans(
+    df: pd.DataFrame,
+    *,
+    group_by: str,
+    value_columns: Optional[list[str]] = None,
+):
     """Aggregate data so that a group_by on the resulting data makes sense.
 
     Basically, before grouping emissions by an inter-bilan categories, we first need to group all the emissions
-    per bilan (Id) and sum them together.
+    per bilan (id_code) and sum them together.
     This then allows doing other stats (mean, median, ...) on the total emissions per bilan.
 
     Note that, if the data was filtered prior (e.g. excluding some categories of emissions), then the stats will
@@ -307,7 +444,7 @@ def aggregate_bilans(df: pd.DataFrame, *, group_by: str):
                      │    │ │   │ │   ├─┤   │ │
                      │    └─┘   └─┘   └─┘   └─┘
 
-                          ────────────────────►    Bilans (Id)
+                          ────────────────────►    Bilans (id_code)
 
                          │                │ │  │
                          └────────────────┘ └──┘
@@ -316,88 +453,171 @@ def aggregate_bilans(df: pd.DataFrame, *, group_by: str):
                                                    (secteur_activite,
                                                    type_structure, ...)
 
+    Args:
+        value_columns: the columns to sum (by default, the PLOT_COL_OPTIONS of `df`)
     """
+    if value_columns is None:
+        value_columns = [c for c in PLOT_COL_OPTIONS if c in df.columns]
     # If group_by is the smallest unit of intra-bilan, this group_by does nothing.
     # But it is necessary to do it for scope / category of emissions : we consider a category as long as there is at
     # least one poste_emission with non-zero data inside.
-    x = df.groupby([group_by, "Id"], dropna=False)[PLOT_COL_OPTIONS].sum()
+    x = df.groupby([group_by, "id_code"], dropna=False, observed=True)[
+        value_columns
+    ].sum()
     return x.reset_index()
 
 
+def query_bilans(
+    cube: AggregationCube | IncrementalQuery,
+    *,
+    secteur_activite: str,
+    plot_col: str,
+    group_by: str,
+    **kwargs,
+):
+    """Same as `aggregate_bilans` on the output of `filter_options`, but answered from the aggregation
+    cube (see `get_cube`) instead of the long frame, and only for the `value_columns` of `plot_col`.
+
+    Args:
+        cube: the aggregation cube, or the `IncrementalQuery` of a session on it
+    """
+    selection = _get_selection(secteur_activite, kwargs)
+    return cube.query(
+        selection,
+        nonzero=plot_col,
+        group_by=group_by,
+        value_columns=value_columns(plot_col),
+    )
+
+
+class BenchmarkResult:
+    """The aggregated data of a state of the widgets (see `query_bilans`), and the outputs of the
+    dashboard computed from it (on first access)."""
+
+    def __init__(self, df: pd.DataFrame, *, plot_col: str, group_by: str):
+        self.df = df
+        self.plot_col = plot_col
+        self.group_by = group_by
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the result in the cache: the aggregated data and the box plot statistics and
+        outliers (computed first if needed). The figures mostly reference them, and are not
+        accounted for."""
+        return sizeof(self.df) + sum(sizeof(x) for x in self.box_stats)
+
+    @functools.cached_property
+    def box_stats(self) -> tuple[pd.DataFrame, pd.DataFrame]:
+        return get_box_stats(self.df, by=self.group_by, y=self.plot_col)
+
+    @functools.cached_property
+    def emissions_plot(self):
+        return plot_emissions(
+            self.df,
+            plot_col=self.plot_col,
+            group_by=self.group_by,
+            box_stats=self.box_stats,
+        )
+
+    @functools.cached_property
+    def n_bilans_plot(self):
+        return plot_n_bilans(self.df, self.group_by)
+
+    @functools.cached_property
+    def n_bilans_text(self) -> str:
+        return n_bilans_text(self.df)
+
+
+def get_result(**kwargs) -> BenchmarkResult:
+    """`query_bilans`, through the cache shared by all the sessions (RESULT_CACHE)."""
+    return RESULT_CACHE.get_or_compute(
+        _state_key(kwargs),
+        lambda: BenchmarkResult(
+            query_bilans(**kwargs),
+            plot_col=kwargs["plot_col"],
+            group_by=kwargs["group_by"],
+        ),
+    )
+
+
+def prepare_result(**kwargs) -> BenchmarkResult:
+    """`get_result`, with the computations that can run outside of the event loop done (this is
+    the function run by the worker threads).
+
+    The figures themselves are built on first access, by the event loop: the global option
+    registry of holoviews is not meant to be used by several threads.
+    """
+    # (the box stats are computed by `get_result`, to size the result in the cache)
+    result = get_result(**kwargs)
+    result.n_bilans_text
+    return result
+
+
 def plot_emissions(
     df: pd.DataFrame,
     *,
     plot_col: str,
     group_by: str,
     plot_average=True,
+    box_stats: Optional[tuple[pd.DataFrame, pd.DataFrame]] = None,
 ):
-    x = df.copy()
-
-    box = x.plot(
-        kind="box",
-        # Note: it would be possible here to pass `by=[LABELS.categorie_emissions, LABELS.poste_emissions]`
-        # in order to group postes by category (with a multi-level index). But this does not work when combining
-        # with a regular scatter plot.
+    """
+    Args:
+        box_stats: the output of `get_box_stats` on `df`, computed here if not set
+    """
+    # The box plot is drawn from its statistics: only the statistics and a bounded number of
+    # outliers are sent to the browser, whatever the number of bilans.
+    # Note: grouping postes by category (with a multi-level axis) is not supported.
+    if box_stats is None:
+        box_stats = get_box_stats(df, by=group_by, y=plot_col)
+    stats, outliers = box_stats
+    fig = box_whisker_from_stats(
+        stats,
+        outliers,
         by=group_by,
         y=plot_col,
-        **SIZE,
+        mean_label="Moyenne" if plot_average else None,
     )
-    mean_data = x.groupby(group_by)[plot_col].mean().rename("Moyenne")
-    scatter = mean_data.plot(kind="scatter", **SIZE)
+    # upper bound of all the whiskers
+    upper = max(1.0, stats["upper"].max()) if len(stats) else 1.0
 
     match plot_col:
         case LABELS.emissions_par_ca:
             opts = dict(
-                ylabel="kgCO2 eq. / k€ de C.A.",
+                xlabel="kgCO2 eq. / k€ de C.A.",
                 # logx=True,
-                ylim=(
-                    0,
-                    # mean_data.max()
-                    _boxwhisker_upper_bound(x, group_by=group_by, plot_col=plot_col)
-                    + 1.0,
-                ),
+                xlim=(0, upper + 1.0),
             )
         case LABELS.emissions_par_collaborateur:
             opts = dict(
-                ylabel="tCO2 eq. / collaborateur",
-                ylim=(
-                    0,
-                    _boxwhisker_upper_bound(x, group_by=group_by, plot_col=plot_col)
-                    + 1.0,
-                ),
+                xlabel="tCO2 eq. / collaborateur",
+                xlim=(0, upper + 1.0),
             )
         case LABELS.emissions_total:
             opts = dict(
-                ylabel="tCO2 eq.",
+                xlabel="tCO2 eq.",
                 logx=True,
             )
         case _:
             raise ValueError(plot_col)
 
-    if plot_average:
-        fig = box * scatter
-    else:
-        fig = box
-
     return fig.opts(
         hv.opts(
-            invert_axes=True,
             # This is important to properly clear the axes when changing widget options (otherwise, both the emission
             # and the n_bilans plot keep their y-axis forever, even after un-selecting some options)
             shared_axes=False,
             legend_position="bottom",
+            ylabel=group_by,
             # active_tools=['ywheel_zoom'],
+            **SIZE,
             **opts,
         ),
-        hv.opts.BoxWhisker(show_legend=False),
-        hv.opts.Scatter(
-            color="red",
-        ),
     )
 
 
 def plot_n_bilans(df: pd.DataFrame, group_by: str):
-    x = df.groupby(group_by, sort=False)
+    # (missing labels are a group, as in the box plot, see `get_box_stats`)
+    x = df.groupby(group_by, sort=False, dropna=False, observed=True)
 
     _labels = {
         LABELS.scope_emissions: "ce scope",
@@ -412,16 +632,18 @@ def plot_n_bilans(df: pd.DataFrame, group_by: str):
 
         # there can be NaN or 0 values in 'emissions': we consider both as empty data
         x = (
-            x[LABELS.emissions_total]
-            .agg(lambda i: i.ne(0, fill_value=0).sum())
+            df[LABELS.emissions_total]
+            .ne(0, fill_value=0)
+            .groupby(df[group_by], sort=False, dropna=False, observed=True)
+            .sum()
             .rename(n_bilan_label)
         )
         x = x.to_frame()
-        n_bilans = df["Id"].nunique()
+        n_bilans = df["id_code"].nunique()
         x[part_bilan_label] = x[n_bilan_label] / n_bilans * 100
     else:
         y_col = "Nombre de bilans"
-        x = x.Id.nunique().rename(y_col)
+        x = x.id_code.nunique().rename(y_col)
 
     fig = x.plot(
         kind="bar",
@@ -439,7 +661,7 @@ def plot_n_bilans(df: pd.DataFrame, group_by: str):
 
 
 def n_bilans(df: pd.DataFrame):
-    return df.Id.nunique()
+    return df.id_code.nunique()
 
 
 def n_bilans_text(df: pd.DataFrame):
@@ -449,17 +671,13 @@ def n_bilans_text(df: pd.DataFrame):
 # Helper functions
 
 
-def _log_request(_n_bilans_text, **kwargs):
-    pn.state.log(f"get_benchmark_dashboard, n_bilans={_n_bilans_text}, {kwargs}")
-    return _n_bilans_text
-
-
-def _boxwhisker_upper_bound(x, group_by: str, plot_col: str):
-    # compute the upper bound of all whisker plots
-    upper = 1.0
-    for category in x[group_by].unique():
-        if category is None:
-            continue
-        y = x[(x[group_by] == category) & ~pd.isna(x[plot_col])]
-        upper = max(upper, _get_upper_bar(y[plot_col].values))
-    return upper
+async def _log_request(_data_node: AsyncMemoizedNode, cube: IncrementalQuery, **kwargs):
+    result = await _data_node(cube=cube, **kwargs)
+    pn.state.log(
+        f"get_benchmark_dashboard, n_bilans={result.n_bilans_text}, "
+        f"recomputations avoided={_data_node.n_avoided}/{_data_node.n_calls}, "
+        f"superseded={_data_node.n_superseded}, "
+        f"incremental queries={cube.n_incremental}/{cube.n_incremental + cube.n_full}, "
+        f"{kwargs}"
+    )
+    return result.n_bilans_text
@@ -9,7 +9,10 @@ import pandas as pd
 import holoviews as hv
 import plotly.express as px
 
-from src.data.make_dataset import DATA_PATH
+from src.data.compaction import compact_frame
+from src.data.make_dataset import CATEGORICAL_COLUMNS, DATA_PATH, load_processed
+from src.data.shared_frames import load_shared_frame
+from src.settings import PROCESSED_ALL_DATA_PATH
 from src.visualization.visualize import LABELS
 
 import textwrap
@@ -31,14 +34,19 @@ PLOTLY_OPTS = dict(
     height=PLOTLY_HEIGHT,
 )
 
+# Bilans and entities are counted on their integer codes (see src/data/keys.py)
 _LABELS_NUNIQUE = {
-    "Id": LABELS.n_bilans,
-    "SIREN principal": LABELS.n_entites,
+    "id_code": LABELS.n_bilans,
+    "siren_code": LABELS.n_entites,
 }
 
 
 def df_nunique(df, groupby: str, sort=True):
-    x = df.groupby([groupby], as_index=False).nunique().rename(columns=_LABELS_NUNIQUE)
+    x = (
+        df.groupby([groupby], as_index=False, observed=True)[list(_LABELS_NUNIQUE)]
+        .nunique()
+        .rename(columns=_LABELS_NUNIQUE)
+    )
     if sort:
         x = x.sort_values(LABELS.n_bilans, ascending=False)
     return x
@@ -72,19 +80,24 @@ def custom_wrap(s, width=20):
 
 @pn.cache
 def get_df():
-    df = pd.read_csv(
-        DATA_PATH / "processed/bilans-ges-all.csv",
-        dtype={"naf2_code": str, "naf3_code": str, "naf4_code": str},
-    )
-    df.month_publication = pd.to_datetime(df.month_publication)
+    # shared by the processes of the server (read-only, see `load_shared_frame`)
+    return load_shared_frame("profiles", _build_df, deps=[PROCESSED_ALL_DATA_PATH])
+
+
+def _build_df(compact=True):
+    df = load_processed(PROCESSED_ALL_DATA_PATH)
+    df.month_publication = df.month_publication.dt.to_timestamp()
     df[LABELS.annee_publication] = df.month_publication.dt.year
+    if compact:
+        df = compact_frame(df, categorical_columns=CATEGORICAL_COLUMNS, name="profiles")
     return df
 
 
 @pn.cache
 def get_df_ademe():
     x = pd.read_csv(
-        DATA_PATH / "raw/light/rapport-beges-ademe-2022-annexe-1.csv", dtype={"Code NAF": str}
+        DATA_PATH / "raw/light/rapport-beges-ademe-2022-annexe-1.csv",
+        dtype={"Code NAF": str},
     )
     x["Taux de conformité"] = x["Taux de conformité"].str.rstrip("%").astype(float)
     x = x[["Code NAF", "Nombre d'obligés", "Nombre conforme", "Taux de conformité"]]
@@ -136,8 +149,11 @@ class TailleEntreprise:
         # (it's more explicit)
         x = (
             x.groupby(
-                ["nb_salaries_range", "nb_salaries_min"], as_index=False, dropna=False
-            )
+                ["nb_salaries_range", "nb_salaries_min"],
+                as_index=False,
+                dropna=False,
+                observed=True,
+            )[list(_LABELS_NUNIQUE)]
             .nunique()
             .rename(columns=_LABELS_NUNIQUE)
             .rename(columns={"nb_salaries_range": LABELS.n_salaries})
@@ -276,7 +292,7 @@ def plot_share_scope_3(df):
     # Scatter plot : total number of bilans
     b = (
         df.groupby(LABELS.annee_reporting)
-        .Id.nunique()
+        .id_code.nunique()
         .rename("Nombre de bilans")
         .plot(kind="scatter")
     )
@@ -291,10 +307,12 @@ def plot_share_scope_3(df):
 def secteur_activite_n_entites_treemap(df):
     cols = ["naf1", "naf2", "naf3", "naf4"]
     x = (
-        df.groupby(cols + ["naf5"], dropna=False)
-        .nunique()
-        .rename(columns={"SIREN principal": LABELS.n_entites})[LABELS.n_entites]
+        df.groupby(cols + ["naf5"], dropna=False, observed=True)
+        .siren_code.nunique()
+        .rename(LABELS.n_entites)
         .reset_index()
+        # (labels are categoricals, without an "undefined" category)
+        .astype({c: object for c in cols + ["naf5"]})
         .fillna("undefined")
     )
 
@@ -318,9 +336,9 @@ def secteur_activite_n_entites_treemap(df):
 
 def secteur_activite_ratio_treemap(df):
     x = df.rename(columns=_LABELS_NUNIQUE)
-    x = x.groupby(["naf1", "naf2", "naf2_code"]).nunique()[
+    x = x.groupby(["naf1", "naf2", "naf2_code"], observed=True)[
         [LABELS.n_bilans, LABELS.n_entites]
-    ]
+    ].nunique()
     x = x.reset_index()
     x = pd.merge(x, get_df_ademe(), on="naf2_code", how="left")
     x[LABELS.ratio_n_entites_n_obliges] = x[LABELS.n_entites] / x["Nombre d'obligés"]
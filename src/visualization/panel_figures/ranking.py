@@ -0,0 +1,160 @@
+"""
+Where does a bilan sit in its sector: percentile rank of the indicators of a bilan (or of any value)
+among the bilans of the same sector and year (see `PercentileIndex`), next to the financial data of
+its entity (see `FinancialIndex.entity`).
+"""
+
+from typing import Optional
+
+import pandas as pd
+import panel as pn
+
+from src.data.financial_index import get_financial_index
+from src.data.keys import get_key_encoding
+from src.visualization.panel_figures.benchmark import (
+    PLOT_COL_OPTIONS,
+    get_cube,
+    get_df,
+)
+from src.visualization.percentile_rank import PercentileIndex
+from src.visualization.visualize import LABELS
+
+# Bilans are ranked among the bilans of the same sector and reporting year
+GROUP_COLUMNS = [LABELS.secteur_activite, LABELS.annee_reporting]
+
+
+@pn.cache
+def get_bilans() -> pd.DataFrame:
+    """One row per bilan, with its entity (siren_code), its group and the total of each indicator
+    over all its postes (NaN when the indicator is not available, e.g. without C.A.)."""
+    df = get_df()
+    bilans = df.loc[
+        ~df["id_code"].duplicated(), ["id_code", "siren_code", *GROUP_COLUMNS]
+    ]
+    cube = get_cube()
+    for indicator in PLOT_COL_OPTIONS:
+        x = cube.query(
+            {},
+            nonzero=indicator,
+            group_by=LABELS.secteur_activite,
+            value_columns=[indicator],
+        )
+        bilans = bilans.merge(x[["id_code", indicator]], on="id_code", how="left")
+    return bilans
+
+
+@pn.cache
+def get_percentile_index() -> PercentileIndex:
+    return PercentileIndex(
+        get_bilans(), group_columns=GROUP_COLUMNS, value_columns=PLOT_COL_OPTIONS
+    )
+
+
+@pn.cache
+def _ids_by_siren_code() -> pd.Series:
+    bilans = get_bilans()
+    return bilans.groupby("siren_code").id_code.agg(list)
+
+
+def percentile_rank(
+    *, secteur_activite: str, annee: int, indicator: str, value: float
+) -> tuple[Optional[float], int]:
+    """The percentile rank of `value` among the bilans of a sector and year (see
+    `PercentileIndex.rank`)."""
+    return get_percentile_index().rank((secteur_activite, annee), indicator, value)
+
+
+def percentile_ranks_of_siren(siren: str, indicator: str) -> pd.DataFrame:
+    """The percentile ranks of the bilans of an entity, within their sector and year (see
+    `PercentileIndex.rank_bilans`). Empty for an unknown SIREN."""
+    siren_code = get_key_encoding().encode_sirens([siren.replace(" ", "")])[0]
+    ids = _ids_by_siren_code().get(siren_code, [])
+    return get_percentile_index().rank_bilans(ids, indicator)
+
+
+_FINANCIAL_LABELS = {
+    "annee_cloture_exercice": "Année de clôture",
+    "date_cloture_exercice": "Date de clôture",
+    "ca": "C.A. (€)",
+    "resultat_net": "Résultat net (€)",
+    "type_bilan": "Type de bilan",
+}
+
+
+def financial_data_of_siren(siren: str) -> pd.DataFrame:
+    """The financial data of an entity (INPI), by fiscal year. Empty for an unknown SIREN."""
+    x = get_financial_index().entity(siren.replace(" ", ""))
+    return x.rename(columns=_FINANCIAL_LABELS)
+
+
+def _financial_table(siren: str):
+    if not siren:
+        return pn.pane.Markdown("")
+    x = financial_data_of_siren(siren)
+    if x.empty:
+        return pn.pane.Markdown(f"Aucune donnée financière pour le SIREN {siren}.")
+    return pn.pane.DataFrame(x, index=False)
+
+
+def _siren_table(siren: str, indicator: str):
+    if not siren:
+        return pn.pane.Markdown("Entrer un numéro SIREN.")
+    x = percentile_ranks_of_siren(siren, indicator)
+    if x.empty:
+        return pn.pane.Markdown(
+            f"Aucun bilan avec cet indicateur pour le SIREN {siren}."
+        )
+    x = (
+        x.drop(columns="id_code")
+        .sort_values(LABELS.annee_reporting)
+        .rename(columns={"percentile": "Percentile (%)", "n": LABELS.n_bilans})
+        .round(1)
+    )
+    return pn.pane.DataFrame(x, index=False)
+
+
+def _value_text(secteur_activite: str, annee: int, indicator: str, value: float):
+    percentile, n = percentile_rank(
+        secteur_activite=secteur_activite, annee=annee, indicator=indicator, value=value
+    )
+    if percentile is None:
+        return pn.pane.Markdown("Aucun bilan pour ce secteur et cette année.")
+    return pn.pane.Markdown(
+        f"**{percentile:.1f}%** des {n} bilans du secteur en {annee} ont une valeur "
+        f"inférieure ou égale à {value}."
+    )
+
+
+def get_ranking_dashboard():
+    bilans = get_bilans()
+    indicator = pn.widgets.Select(name="Indicateur", options=PLOT_COL_OPTIONS)
+    siren = pn.widgets.TextInput(name="SIREN", placeholder="123456789")
+    secteur_activite = pn.widgets.Select(
+        name=LABELS.secteur_activite,
+        options=sorted(bilans[LABELS.secteur_activite].unique().tolist()),
+    )
+    annees = sorted(bilans[LABELS.annee_reporting].unique().tolist(), reverse=True)
+    annee = pn.widgets.Select(name=LABELS.annee_reporting, options=annees)
+    value = pn.widgets.FloatInput(name="Valeur de l'indicateur", value=0.0, start=0.0)
+
+    return pn.Column(
+        "## Positionner un bilan dans son secteur",
+        "Part des bilans du même secteur d'activité et de la même année de reporting dont "
+        "l'indicateur (sur l'ensemble des postes d'émissions) est inférieur ou égal.",
+        indicator,
+        "### À partir d'un SIREN",
+        siren,
+        pn.bind(_siren_table, siren=siren, indicator=indicator),
+        "Données financières de l'entité (INPI) :",
+        pn.bind(_financial_table, siren=siren),
+        "### À partir d'une valeur",
+        pn.Row(secteur_activite, annee, value),
+        pn.bind(
+            _value_text,
+            secteur_activite=secteur_activite,
+            annee=annee,
+            indicator=indicator,
+            value=value,
+        ),
+        margin=20,
+    )
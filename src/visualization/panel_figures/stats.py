@@ -0,0 +1,37 @@
+import pandas as pd
+import panel as pn
+
+from src.visualization.panel_figures.benchmark import RESULT_CACHE
+
+# Refresh period of the stats (ms)
+REFRESH_PERIOD = 5000
+
+
+def _cache_stats_table() -> pd.DataFrame:
+    stats = RESULT_CACHE.stats()
+    hit_rate = stats["hit_rate"]
+    rows = {
+        "Entrées": stats["entries"],
+        "Mémoire utilisée (MiB)": f"{stats['nbytes'] / 2**20:.1f} / {stats['max_bytes'] / 2**20:.0f}",
+        "Hits": stats["hits"],
+        "Misses": stats["misses"],
+        "Évictions": stats["evictions"],
+        "Taux de hits": "-" if hit_rate is None else f"{100 * hit_rate:.1f}%",
+    }
+    return pd.DataFrame({"Valeur": [str(v) for v in rows.values()]}, index=rows.keys())
+
+
+def get_stats_dashboard():
+    table = pn.pane.DataFrame(_cache_stats_table(), width=400)
+
+    def refresh():
+        table.object = _cache_stats_table()
+
+    pn.state.add_periodic_callback(refresh, period=REFRESH_PERIOD)
+    return pn.Column(
+        "## Cache des résultats du benchmark",
+        "Résultats partagés par toutes les sessions servies par ce processus "
+        f"(mis à jour toutes les {REFRESH_PERIOD // 1000} secondes).",
+        table,
+        margin=20,
+    )
@@ -0,0 +1,101 @@
+"""
+Percentile ranks of the bilans within their group (e.g. their sector and year), for each indicator.
+
+The values of each indicator are sorted once, by group and by value, so that the rank of any
+value within a group is found by binary search (O(log n)), without filtering or sorting the
+bilans of the group:
+
+    >>> index = PercentileIndex(df_bilans, group_columns=["naf1", "annee"], value_columns=["ca"])
+    >>> percentile, n = index.rank(("Industrie manufacturière", 2022), "ca", 1500.0)
+"""
+
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+class PercentileIndex:
+    """
+    Args:
+        df: one row per bilan (`id_column`), with the group and value columns
+        group_columns: the columns defining the groups within which bilans are ranked
+        value_columns: the indicators. Missing (NaN) values are not ranked.
+    """
+
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        group_columns: Sequence[str],
+        value_columns: Sequence[str],
+        id_column: str = "id_code",
+    ):
+        self.group_columns = list(group_columns)
+        self.value_columns = list(value_columns)
+        self.df = df[[id_column, *group_columns, *value_columns]].reset_index(drop=True)
+        self._rows = pd.Index(self.df[id_column])
+
+        group_codes = self.df.groupby(
+            self.group_columns, observed=True, dropna=False, sort=False
+        ).ngroup()
+        self._groups = pd.MultiIndex.from_frame(
+            self.df[self.group_columns].drop_duplicates()
+        )
+        self._group_codes = group_codes.to_numpy()
+        # for each value column: the values sorted by group and value, and the start of each group
+        self._sorted: dict[str, np.ndarray] = {}
+        self._starts: dict[str, np.ndarray] = {}
+        for col in self.value_columns:
+            values = self.df[col].to_numpy(dtype=float)
+            valid = np.flatnonzero(~np.isnan(values))
+            order = valid[np.lexsort((values[valid], self._group_codes[valid]))]
+            self._sorted[col] = values[order]
+            self._starts[col] = np.searchsorted(
+                self._group_codes[order], np.arange(len(self._groups) + 1)
+            )
+
+    def group_values(self, group: tuple, column: str) -> np.ndarray:
+        """The sorted values of `column` in a group (empty for an unknown group)."""
+        try:
+            code = self._groups.get_loc(group)
+        except KeyError:
+            return np.array([], dtype=float)
+        starts = self._starts[column]
+        return self._sorted[column][starts[code] : starts[code + 1]]
+
+    def rank(
+        self, group: tuple, column: str, value: float
+    ) -> tuple[Optional[float], int]:
+        """The percentile rank of `value` in a group: the share (%) of the bilans of the group
+        with a value of `column` lower than or equal to `value`.
+
+        Returns:
+            the percentile rank (None if the group has no value), and the number of bilans of the
+            group with a value
+        """
+        values = self.group_values(group, column)
+        if len(values) == 0:
+            return None, 0
+        n_below = np.searchsorted(values, value, side="right")
+        return 100 * n_below / len(values), len(values)
+
+    def rank_bilans(self, ids: Sequence, column: str) -> pd.DataFrame:
+        """The percentile ranks of some bilans (unknown ones are ignored) within their group.
+
+        Returns:
+            one row per bilan, with its group and value columns, and the columns "percentile"
+            and "n" (see `rank`)
+        """
+        rows = self._rows.get_indexer(ids)
+        df = self.df.iloc[rows[rows >= 0]]
+        df = df.loc[df[column].notna(), [self._rows.name, *self.group_columns, column]]
+        ranks = [
+            self.rank(tuple(group), column, value)
+            for group, value in zip(
+                df[self.group_columns].itertuples(index=False), df[column]
+            )
+        ]
+        return df.assign(
+            percentile=[percentile for percentile, _ in ranks],
+            n=np.array([n for _, n in ranks], dtype=int),
+        ).reset_index(drop=True)
@@ -0,0 +1,90 @@
+"""
+Process-wide cache of the results of the dashboards, shared by all the sessions served by the process.
+
+Entries are evicted in least-recently-used order when their total size exceeds a memory budget. The
+cache counts its hits, misses and evictions (see `LRUCache.stats`, displayed on the stats page).
+"""
+
+import logging
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+import pandas as pd
+
+
+def sizeof(value: Any) -> int:
+    """Approximate memory usage of a cached value (bytes).
+
+    Values can define their own size with an `nbytes` attribute.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum())
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """
+    Args:
+        max_bytes: memory budget of the entries (see `sizeof`). An entry bigger than the budget is
+            returned but not stored.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """The value of `key`, computed with `compute()` if it is not in the cache."""
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+            self.misses += 1
+
+        # (computed outside of the lock: two sessions may compute the same value concurrently)
+        value = compute()
+        size = sizeof(value)
+        if size > self.max_bytes:
+            logging.warning(f"result of {size} bytes is too big to be cached")
+            return value
+
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_size
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict[str, Any]:
+        n_requests = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "nbytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / n_requests if n_requests else None,
+        }
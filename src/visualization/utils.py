@@ -1,7 +1,12 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import Executor
 from pathlib import Path
 
 import panel as pn
-from typing import Literal
+import param
+from typing import Any, Callable, Hashable, Literal, Optional
 
 _SRC_PATH = Path(__file__).resolve().parent
 
@@ -15,3 +20,120 @@ def section(*names: str, extension: Literal["md", "html"] = "md"):
         return pn.pane.Markdown(content, **opts)
     elif extension == "html":
         return pn.pane.HTML(content, **opts)
+
+
+def _freeze(kwargs: dict) -> Hashable:
+    return tuple(
+        (k, tuple(v) if isinstance(v, list) else v) for k, v in sorted(kwargs.items())
+    )
+
+
+class MemoizedNode:
+    """Reactive node that computes `func` once per state, and shares the result between all the
+    outputs bound to it.
+
+    With `pn.bind`, a bound function passed to several other bound functions is evaluated once
+    per consumer (e.g. once per plot). Binding a MemoizedNode instead only calls `func` when the
+    state changes:
+
+        >>> node = MemoizedNode(aggregate)
+        >>> data = pn.bind(node, group_by=group_by_widget)
+        >>> plot_a, plot_b = pn.bind(plot_a, df=data), pn.bind(plot_b, df=data)
+
+    Args:
+        func: function of keyword arguments
+        normalize: canonical (hashable) form of the keyword arguments: the result is only
+            computed again if it changes (by default, the arguments themselves)
+    """
+
+    def __init__(
+        self,
+        func: Callable[..., Any],
+        normalize: Optional[Callable[[dict], Hashable]] = None,
+    ):
+        self.func = func
+        self.normalize = normalize or _freeze
+        self.n_calls = 0
+        self.n_computed = 0
+        self._key = None
+        self._value = None
+
+    def __call__(self, **kwargs):
+        self.n_calls += 1
+        key = self.normalize(kwargs)
+        if self.n_computed == 0 or key != self._key:
+            self._value = self.func(**kwargs)
+            self._key = key
+            self.n_computed += 1
+        return self._value
+
+    @property
+    def n_avoided(self) -> int:
+        """Number of calls answered without computing `func` again."""
+        return self.n_calls - self.n_computed
+
+
+class AsyncMemoizedNode(MemoizedNode):
+    """MemoizedNode that computes `func` in an executor (e.g. a thread pool), so that a slow
+    computation does not block the event loop of the server, and the other sessions it serves.
+
+    Calling the node returns a coroutine: the outputs bound to it must be async functions.
+
+        >>> node = AsyncMemoizedNode(aggregate, executor=executor)
+        >>> async def plot_a(**kwargs):
+        ...     return make_plot_a(await node(**kwargs))
+        >>> plot_a, plot_b = pn.bind(plot_a, group_by=group_by_widget), ...
+
+    The computation of a state is shared by all the outputs awaiting it. When the state changes,
+    the computation of the previous state is superseded: it is cancelled if it has not started
+    yet, and its result is discarded otherwise (the outputs still awaiting it are not updated,
+    with `param.Skip`). A computation that fails is not memoized: its exception is raised to the
+    outputs awaiting it, and the next call computes the state again.
+    """
+
+    def __init__(
+        self,
+        func: Callable[..., Any],
+        normalize: Optional[Callable[[dict], Hashable]] = None,
+        executor: Optional[Executor] = None,
+    ):
+        super().__init__(func, normalize)
+        self.executor = executor
+        self.n_superseded = 0
+        self._lock = threading.Lock()
+
+    async def __call__(self, **kwargs):
+        key = self.normalize(kwargs)
+        with self._lock:
+            self.n_calls += 1
+            if self.n_computed == 0 or key != self._key:
+                if self._value is not None and not self._value.done():
+                    self._value.cancel()
+                    self.n_superseded += 1
+                self._value = asyncio.get_running_loop().run_in_executor(
+                    self.executor, functools.partial(self.func, **kwargs)
+                )
+                self._value.add_done_callback(self._forget_failed)
+                self._key = key
+                self.n_computed += 1
+            future = self._value
+
+        # (shielded: an output being cancelled must not cancel the computation shared with the others)
+        try:
+            value = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                # (this output itself was cancelled)
+                raise
+            value = None
+        if key != self._key:
+            raise param.Skip(f"superseded state {key}")
+        return value
+
+    def _forget_failed(self, future: asyncio.Future):
+        if future.cancelled() or future.exception() is None:
+            return
+        with self._lock:
+            if self._value is future:
+                # (a new key, that no state has: the next call computes its state again)
+                self._key, self._value = object(), None
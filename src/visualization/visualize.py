@@ -1,3 +1,5 @@
+from typing import Optional
+
 import numpy as np
 import pandas as pd
 import panel as pn
@@ -20,17 +22,6 @@ hv.plotting.bokeh.ElementPlot.hooks.append(disable_logo)
 hv.plotting.bokeh.element.ElementPlot.active_tools = ["box_zoom"]
 
 
-def _patched_get_data(*args, **kwargs):
-    data, mapping, style = _original_get_data(*args, **kwargs)
-    mapping["circle_1"]["radius"] = 0.01
-    return data, mapping, style
-
-
-# apply https://github.com/holoviz/holoviews/pull/6169/files temporarily
-_original_get_data = hv.plotting.bokeh.stats.BoxWhiskerPlot.get_data
-hv.plotting.bokeh.stats.BoxWhiskerPlot.get_data = _patched_get_data
-
-
 def select_widget(
     df: pd.DataFrame, col: str, name=None, sort=False, widget=pn.widgets.Select
 ):
@@ -46,15 +37,143 @@ def select_widget(
     )
 
 
-def _get_upper_bar(vals: np.ndarray):
-    # compute the upper bar of the whisker plot (above which outliers are drawn as points)
-    # https://github.com/holoviz/holoviews/blob/0eeb0fc4d6ff977475b23d798262886372db0b87/holoviews/plotting/bokeh/stats.py#L137
-    if len(vals) == 0:
-        return -1
-    q1, q3 = (np.percentile(vals, q=q) for q in (25, 75))
+# Maximum number of outliers drawn per box of a box plot (see `get_box_stats`)
+MAX_OUTLIERS = 50
+
+
+def _quantile(vals: np.ndarray, starts: np.ndarray, counts: np.ndarray, q: float):
+    # quantile of each group of sorted values (linear interpolation, as np.percentile)
+    h = (counts - 1) * q
+    lo = np.floor(h).astype(int)
+    hi = np.ceil(h).astype(int)
+    v_lo, v_hi = vals[starts + lo], vals[starts + hi]
+    return v_lo + (v_hi - v_lo) * (h - lo)
+
+
+def get_box_stats(
+    df: pd.DataFrame, *, by: str, y: str, max_outliers: int = MAX_OUTLIERS
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Box plot statistics of `y` for each group of `by`, in a single grouped pass.
+
+    The statistics are the same as the ones of the holoviews BoxWhisker plot
+    (https://github.com/holoviz/holoviews/blob/0eeb0fc4d6ff977475b23d798262886372db0b87/holoviews/plotting/bokeh/stats.py#L137):
+    quartiles, whiskers at the furthest values within 1.5 IQR of the box, and outliers beyond
+    them. Non-finite values are ignored, and missing labels of `by` are a group (the last one, as
+    with groupby(dropna=False)).
+
+    Returns:
+        stats: one row per group (sorted), with the columns `by`, count, mean, q1, median, q3,
+            lower and upper (whiskers)
+        outliers: the columns `by` and `y`, with at most `max_outliers` outliers per group
+            (evenly spaced by rank, including the most extreme ones)
+    """
+    vals = df[y].to_numpy(dtype=float)
+    codes, groups = pd.factorize(df[by], sort=True, use_na_sentinel=False)
+    keep = np.isfinite(vals)
+    vals, codes = vals[keep], codes[keep]
+    order = np.lexsort((vals, codes))
+    vals, codes = vals[order], codes[order]
+    # (only keep the groups with finite values)
+    observed, codes = np.unique(codes, return_inverse=True)
+    groups = groups[observed]
+
+    counts = np.bincount(codes, minlength=len(groups))
+    starts = np.cumsum(counts) - counts
+    stats = pd.DataFrame({by: groups, "count": counts})
+    if len(groups) == 0:
+        for c in ["mean", "q1", "median", "q3", "lower", "upper"]:
+            stats[c] = np.array([], dtype=float)
+        return stats, pd.DataFrame({by: groups, y: np.array([], dtype=float)})
+
+    q1, median, q3 = (_quantile(vals, starts, counts, q) for q in (0.25, 0.5, 0.75))
     iqr = q3 - q1
-    upper = max(vals[vals <= q3 + 1.5 * iqr].max(), q3)
-    return upper
+    within = vals <= (q3 + 1.5 * iqr)[codes]
+    upper = np.maximum(np.maximum.reduceat(np.where(within, vals, -np.inf), starts), q3)
+    within = vals >= (q1 - 1.5 * iqr)[codes]
+    lower = np.minimum(np.minimum.reduceat(np.where(within, vals, np.inf), starts), q1)
+    stats = stats.assign(
+        mean=np.add.reduceat(vals, starts) / counts,
+        q1=q1,
+        median=median,
+        q3=q3,
+        lower=lower,
+        upper=upper,
+    )
+
+    is_outlier = (vals > upper[codes]) | (vals < lower[codes])
+    vals, codes = vals[is_outlier], codes[is_outlier]
+    # rank of each outlier in its group, and number of outliers in its group
+    out_counts = np.bincount(codes, minlength=len(groups))
+    rank = np.arange(len(codes)) - np.repeat(
+        np.cumsum(out_counts) - out_counts, out_counts
+    )
+    n = out_counts[codes]
+    # keep the ranks round(j * (n - 1) / (max_outliers - 1)), for j in [0, max_outliers)
+    j = np.round(rank * (max_outliers - 1) / np.maximum(n - 1, 1))
+    sampled = (n <= max_outliers) | (np.round(j * (n - 1) / (max_outliers - 1)) == rank)
+    outliers = pd.DataFrame({by: groups[codes[sampled]], y: vals[sampled]})
+    return stats, outliers
+
+
+def box_whisker_from_stats(
+    stats: pd.DataFrame,
+    outliers: pd.DataFrame,
+    *,
+    by: str,
+    y: str,
+    mean_label: Optional[str] = None,
+) -> hv.Overlay:
+    """Horizontal box plot (one box per group of `by`, from the top) drawn from `get_box_stats`, so
+    that only the statistics and the sampled outliers are sent to the browser.
+
+    Args:
+        mean_label: if set, also draw the mean of each group, as points with this label
+
+    Returns:
+        an overlay of the boxes, medians, whiskers, outliers (and means)
+    """
+    half_width, half_whisker_width = 0.35, 0.2
+    pos = np.arange(len(stats))[::-1].astype(float)
+    position = pd.Series(pos, index=stats[by])
+
+    boxes = hv.Rectangles(
+        stats.assign(y0=pos - half_width, y1=pos + half_width),
+        kdims=["q1", "y0", "q3", "y1"],
+        vdims=[by, "count", "median", "mean", "lower", "upper"],
+    ).opts(fill_color="#30a2da", line_color="black", tools=["hover"], show_legend=False)
+    segments = [
+        # medians
+        (stats["median"], pos - half_width, stats["median"], pos + half_width),
+        # whiskers
+        (stats["lower"], pos, stats["q1"], pos),
+        (stats["q3"], pos, stats["upper"], pos),
+        (
+            stats["lower"],
+            pos - half_whisker_width,
+            stats["lower"],
+            pos + half_whisker_width,
+        ),
+        (
+            stats["upper"],
+            pos - half_whisker_width,
+            stats["upper"],
+            pos + half_whisker_width,
+        ),
+    ]
+    segments = hv.Segments(
+        tuple(np.concatenate(x) for x in zip(*segments)),
+        kdims=["x0", "y0", "x1", "y1"],
+    ).opts(color="black", show_legend=False)
+    points = hv.Points(
+        (outliers[y].to_numpy(), position.loc[outliers[by]].to_numpy()),
+        kdims=[y, "position"],
+    ).opts(color="black", size=3, show_legend=False)
+    fig = boxes * segments * points
+    if mean_label is not None:
+        fig *= hv.Points(
+            (stats["mean"], pos), kdims=[y, "position"], label=mean_label
+        ).opts(color="red", size=6)
+    return fig.opts(yticks=list(zip(pos, stats[by].astype(str))))
 
 
 class LABELS:
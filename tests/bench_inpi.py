@@ -0,0 +1,87 @@
+"""
+Benchmark of the INPI processing steps (fiscal year and `keep_one_bilan`), on a synthetic input
+with millions of rows, against their previous implementations.
+
+    python tests/bench_inpi.py --rows 5000000
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.data.inpi import get_fiscal_year, get_fiscal_years, keep_one_bilan
+
+PRIO = {"K": "1-K", "C": "2-C", "S": "3-S"}
+
+
+def get_fiscal_years_apply(dates: pd.Series) -> pd.Series:
+    # Previous implementation
+    return dates.apply(get_fiscal_year)
+
+
+def keep_one_bilan_sort(df_bilan, prio: dict):
+    # Previous implementation (sort of the whole frame)
+    df_bilan["type_bilan_priority"] = df_bilan["type_bilan"].map(prio)
+    df_bilan = df_bilan.sort_values(
+        ["siren", "annee_cloture_exercice", "type_bilan_priority"],
+        ascending=[True, False, True],
+    )
+    df_bilan = df_bilan.drop_duplicates(
+        subset=["siren", "annee_cloture_exercice"], keep="first"
+    )
+    df_bilan = df_bilan.drop(columns=["type_bilan_priority"])
+    return df_bilan
+
+
+def get_synthetic_bilans(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """~3 bilans per entity, over a few years, with several types per year."""
+    rng = np.random.default_rng(seed)
+    n_sirens = max(n_rows // 3, 1)
+    dates = pd.Timestamp("2015-01-01") + pd.to_timedelta(
+        rng.integers(0, 9 * 365, n_rows), unit="D"
+    )
+    return pd.DataFrame(
+        {
+            "siren": pd.Series(rng.integers(0, n_sirens, n_rows)).map("{:09d}".format),
+            "ca": rng.lognormal(12, 2, n_rows),
+            "resultat_net": rng.normal(0, 1e5, n_rows),
+            "date_cloture_exercice": dates,
+            # a few unknown types
+            "type_bilan": rng.choice(["K", "C", "C", "S", "A"], n_rows),
+        }
+    )
+
+
+def timeit(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return result, time.perf_counter() - start
+
+
+def main(n_rows: int):
+    df = get_synthetic_bilans(n_rows)
+    print(f"{n_rows} rows, {df.siren.nunique()} sirens")
+
+    expected, t_before = timeit(get_fiscal_years_apply, df["date_cloture_exercice"])
+    result, t_after = timeit(get_fiscal_years, df["date_cloture_exercice"])
+    pd.testing.assert_series_equal(result, expected, check_dtype=False)
+    print(
+        f"fiscal year:    {t_before:.2f}s -> {t_after:.3f}s ({t_before / t_after:.0f}x)"
+    )
+
+    df["annee_cloture_exercice"] = result
+    expected, t_before = timeit(keep_one_bilan_sort, df.copy(), PRIO)
+    result, t_after = timeit(keep_one_bilan, df.copy(), PRIO)
+    pd.testing.assert_frame_equal(result, expected)
+    print(
+        f"keep_one_bilan: {t_before:.2f}s -> {t_after:.3f}s ({t_before / t_after:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    args = parser.parse_args()
+    main(args.rows)
@@ -1,16 +1,26 @@
 import itertools
 
 import numpy as np
+import pandas as pd
 import pytest
 import random
 
+from src.visualization.cube import IncrementalQuery
 from src.visualization.panel_figures.benchmark import (
+    BenchmarkResult,
     get_df,
     filter_options,
     FILTERS,
     aggregate_bilans,
+    get_cube,
     n_bilans,
+    query_bilans,
+    value_columns,
+    _state_key,
 )
+from src.data.make_dataset import load_processed
+from src.settings import PROCESSED_ALL_DATA_PATH
+from src.visualization.result_cache import sizeof
 from src.visualization.visualize import LABELS
 from tests.constants import N_POSTES_EMISSIONS, N_BILANS_TOTAL, TOTAL_EMISSIONS
 
@@ -21,13 +31,14 @@ def df():
 
 
 def test_full_data(df):
-    # Even though the emissions for many rows are 0 or nan, we have 22 rows per bilan in the full dataframe.
-    assert len(df) == N_BILANS_TOTAL * N_POSTES_EMISSIONS
+    # Only non-empty postes are kept in the dataframe: at most 22 rows per bilan, and no nan or zero emissions.
+    bilans = load_processed(PROCESSED_ALL_DATA_PATH)
+    assert len(bilans) == N_BILANS_TOTAL
+    assert df["id_code"].nunique() <= N_BILANS_TOTAL
+    assert df.groupby("id_code").size().max() <= N_POSTES_EMISSIONS
+    assert df[LABELS.emissions_total].fillna(0).ne(0).all()
 
-    # Default filtering option should remove rows with zero or nan values
-    n_nans_and_zeros = (
-        df[LABELS.emissions_total].eq(0).sum() + df[LABELS.emissions_total].isna().sum()
-    )
+    # Default filtering option should not remove any row
     # Note : here we are using the emissions_par_salarie column to filter for nans / zeros, but it should
     # be equivalent to using emissions_total (since the number of salaries seems always well-defined).
     x = filter_options(
@@ -36,7 +47,7 @@ def test_full_data(df):
         plot_col=LABELS.emissions_par_collaborateur,
         **{f"{k}_all": True for k in FILTERS},
     )
-    assert len(x) == N_BILANS_TOTAL * N_POSTES_EMISSIONS - n_nans_and_zeros
+    assert len(x) == len(df)
 
     # Check that the sum of all emissions is consistent
     assert (
@@ -131,7 +142,7 @@ def test_after_filter_and_group_by(df, group_by, filters):
     z = _filtered_df(df, filters)
     z = z[~z[LABELS.emissions_total].fillna(0).eq(0)]  # filter out nans and zeros
     expected_total_emissions = z[LABELS.emissions_total].sum()
-    expected_n_bilans = z["Id"].nunique()
+    expected_n_bilans = z["id_code"].nunique()
 
     # Apply the functions we want to test
     filter_kwargs = dict(
@@ -139,7 +150,10 @@ def test_after_filter_and_group_by(df, group_by, filters):
         **{f"{k}_options": v for k, v in filters.items()},
     )
     df_filtered = filter_options(
-        df, secteur_activite="all", plot_col=LABELS.emissions_par_collaborateur, **filter_kwargs
+        df,
+        secteur_activite="all",
+        plot_col=LABELS.emissions_par_collaborateur,
+        **filter_kwargs,
     )
     n_nans_and_zeros = (
         z[LABELS.emissions_total].eq(0).sum() + z[LABELS.emissions_total].isna().sum()
@@ -147,17 +161,44 @@ def test_after_filter_and_group_by(df, group_by, filters):
     assert len(df_filtered) == len(z) - n_nans_and_zeros
     assert n_bilans(df_filtered) == expected_n_bilans
     x = aggregate_bilans(df_filtered, group_by=group_by)
+    # The aggregation cube gives the same result, without grouping the filtered data
+    # (and only for the columns displayed)
+    columns = value_columns(LABELS.emissions_par_collaborateur)
+    pd.testing.assert_frame_equal(
+        query_bilans(
+            get_cube(),
+            secteur_activite="all",
+            plot_col=LABELS.emissions_par_collaborateur,
+            group_by=group_by,
+            **filter_kwargs,
+        ),
+        x[[group_by, "id_code", *columns]],
+    )
 
     # Total emissions grouped by the y_axis column...
     # ... in the original dataframe
     emissions_df = (
-        z.groupby(group_by, dropna=False)[LABELS.emissions_total].sum().values
+        z.groupby(group_by, dropna=False, observed=False)[LABELS.emissions_total]
+        .sum()
+        .values
     )
     # ... and in the filtered and aggregated dataframe
-    emissions_x = x.groupby(group_by, dropna=False)[LABELS.emissions_total].sum().values
+    emissions_x = (
+        x.groupby(group_by, dropna=False, observed=False)[LABELS.emissions_total]
+        .sum()
+        .values
+    )
     emissions_x2 = (
-        x.groupby(group_by, dropna=False)[LABELS.emissions_par_collaborateur].sum().values
-        * df_filtered.groupby(group_by, dropna=False)["nb_salaries_mean"].sum().values
+        x.groupby(group_by, dropna=False, observed=False)[
+            LABELS.emissions_par_collaborateur
+        ]
+        .sum()
+        .values
+        * df_filtered.groupby(group_by, dropna=False, observed=False)[
+            "nb_salaries_mean"
+        ]
+        .sum()
+        .values
     )
     # They should all match, category by category
     assert np.allclose(emissions_df, emissions_x, emissions_x2)
@@ -182,3 +223,72 @@ def _filtered_df(df, opts):
         if v != "all":
             df = df[df[FILTERS[k]["col"]].isin(v)]
     return df
+
+
+def test_result_nbytes():
+    group_by = LABELS.type_structure
+    df = query_bilans(
+        get_cube(),
+        secteur_activite="all",
+        plot_col=LABELS.emissions_total,
+        group_by=group_by,
+    )
+    result = BenchmarkResult(df, plot_col=LABELS.emissions_total, group_by=group_by)
+    # the box plot statistics and outliers are accounted for in the cache
+    stats, outliers = result.box_stats
+    assert sizeof(result) == sizeof(df) + sizeof(stats) + sizeof(outliers)
+    assert sizeof(outliers) > 0
+
+
+def test_state_key():
+    state = dict(
+        plot_col=LABELS.emissions_total,
+        type_structure_all=False,
+        type_structure_options=["Entreprise", "Association"],
+        annee_all=True,
+        annee_options=[2021],
+    )
+    same_state = dict(
+        state,
+        type_structure_options=["Association", "Entreprise"],
+        annee_options=[],
+    )
+    assert _state_key(state) == _state_key(same_state)
+    assert _state_key(state) != _state_key(dict(state, annee_all=False))
+
+
+def test_incremental_query():
+    cube = get_cube()
+    incremental = IncrementalQuery(cube)
+    categories = cube.postes[LABELS.category_emissions].dropna().unique().tolist()
+    secteurs = cube.bilans[LABELS.secteur_activite].unique().tolist()
+    # toggle the options one at a time, as in the dashboard
+    selections = [
+        {},
+        {LABELS.category_emissions: categories[1:]},
+        {LABELS.category_emissions: categories[2:]},
+        {
+            LABELS.category_emissions: categories[2:],
+            LABELS.secteur_activite: secteurs[:1],
+        },
+        {
+            LABELS.category_emissions: categories[:1],
+            LABELS.secteur_activite: secteurs[:1],
+        },
+        {LABELS.category_emissions: categories},
+    ]
+    group_bys = [*cube.poste_columns, *cube.bilan_columns]
+    for group_by in group_bys:
+        for selection in selections:
+            kwargs = dict(nonzero=LABELS.emissions_total, group_by=group_by)
+            # exactly the result of the cube (both can be in the result cache), whatever the
+            # previous queries of the session
+            pd.testing.assert_frame_equal(
+                incremental.query(selection, **kwargs),
+                cube.query(selection, **kwargs),
+                check_exact=True,
+            )
+    # the sums are only computed from scratch for the first state of each group_by, when more
+    # categories are toggled than kept, and when other bilans are selected (the last two states)
+    assert incremental.n_full == 3 * len(group_bys)
+    assert incremental.n_incremental == 3 * len(group_bys)
@@ -13,13 +13,7 @@ def df():
     return benchmark.get_df()
 
 
-def test_main_figures(df):
-    """
-    This test is helpful to:
-    - have the main figures (number of bilans, median, ...) stored explicitely somewhere
-    - make sure these figures do not change by accident (e.g. by changing an algorithm)
-    - see how these figures evolve when updating the dataset
-    """
+def _main_figures(df, decimals=1) -> dict:
     d = {}
     for group_by in [
         LABELS.type_structure,
@@ -27,17 +21,46 @@ def test_main_figures(df):
         LABELS.category_emissions,
     ]:
         x = benchmark.aggregate_bilans(df, group_by=group_by)
-        x_mean = x.groupby(group_by)[[LABELS.emissions_par_collaborateur]].mean()
-        x_median = x.groupby(group_by)[[LABELS.emissions_par_collaborateur]].median()
-        x_count = (
-            x.groupby(group_by)[[LABELS.emissions_par_collaborateur]]
-            .count()
-            .rename(columns={LABELS.emissions_par_collaborateur: "count"})
+        x = x.groupby(group_by, observed=True)[[LABELS.emissions_par_collaborateur]]
+        x_mean = x.mean()
+        x_median = x.median()
+        x_count = x.count().rename(
+            columns={LABELS.emissions_par_collaborateur: "count"}
         )
         x = pd.merge(x_mean, x_median, on=group_by, suffixes=("_mean", "_median"))
         x = pd.merge(x, x_count, on=group_by)
-        d[group_by] = x.round(1).to_dict()
+        if decimals is not None:
+            x = x.astype(float).round(decimals)
+        # (plain labels, whatever the dtype of the group_by column)
+        x.index = x.index.tolist()
+        d[group_by] = x.to_dict()
+    return d
+
+
+def test_main_figures(df):
+    """
+    This test is helpful to:
+    - have the main figures (number of bilans, median, ...) stored explicitely somewhere
+    - make sure these figures do not change by accident (e.g. by changing an algorithm)
+    - see how these figures evolve when updating the dataset
+    """
+    d = _main_figures(df)
     # helpful to update the constant
     # pprint is used to sort (recursively) the dict keys
     print(print(pprint.pformat(d).replace("\n", "")))
     assert d == constants.EMISSIONS_PER
+
+
+def test_main_figures_compaction(df):
+    """The compaction of the frame (categoricals, float32, ...) keeps the main figures, within the
+    float32 precision."""
+    expected = _main_figures(benchmark._build_df(compact=False), decimals=None)
+    actual = _main_figures(df, decimals=None)
+    assert actual.keys() == expected.keys()
+    for group_by in expected:
+        pd.testing.assert_frame_equal(
+            pd.DataFrame(actual[group_by]),
+            pd.DataFrame(expected[group_by]),
+            check_dtype=False,
+            rtol=1e-5,
+        )
@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+from src.data.compaction import compact_frame, compact_schema
+
+
+def test_compact_frame():
+    df = pd.DataFrame(
+        {
+            "naf1": ["A", np.nan, "B", "A"],
+            "Raison sociale": ["x", "y", "z", "t"],
+            "annee": [2019, 2020, 2021, 2022],
+            "id": [0, 1, 40_000, 3],
+            "emissions": [1.5, np.nan, 0.1, 3e6],
+            "siren_code": pd.array([1, None, 2, 1], dtype="Int32"),
+        }
+    )
+    assert compact_schema(df, categorical_columns=["naf1", "unknown"]) == {
+        "naf1": "category",
+        "annee": np.dtype("int16"),
+        "id": np.dtype("int32"),
+        "emissions": np.dtype("float32"),
+    }
+
+    compact = compact_frame(df, categorical_columns=["naf1"])
+    assert compact.memory_usage(deep=True).sum() < df.memory_usage(deep=True).sum()
+    pd.testing.assert_frame_equal(
+        compact.astype(df.dtypes.to_dict()), df, check_exact=False, rtol=1e-7
+    )
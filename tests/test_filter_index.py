@@ -0,0 +1,38 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from src.visualization.filter_index import FilterIndex
+
+
+def test_filter_index():
+    rng = np.random.default_rng(0)
+    n = 1001
+    df = pd.DataFrame(
+        {
+            "a": np.array(["x", "y", "z", np.nan], dtype=object)[rng.integers(0, 4, n)],
+            "b": rng.choice([2019, 2020, 2021], n),
+            "value": rng.choice([0.0, 1.5, np.nan, 3.0], n),
+        }
+    )
+    index = FilterIndex(df, columns=["a", "b"], nonzero_columns=["value"])
+
+    for a, b, nonzero in itertools.product(
+        [None, [], ["x"], ["x", np.nan], ["unknown", "z"]],
+        [None, [2020], [2019, 2021]],
+        [None, "value"],
+    ):
+        expected = df
+        if a is not None:
+            expected = expected[expected["a"].isin(a)]
+        if b is not None:
+            expected = expected[expected["b"].isin(b)]
+        if nonzero is not None:
+            expected = expected[expected[nonzero].fillna(0) != 0]
+
+        rows = index.rows({"a": a, "b": b}, nonzero=nonzero)
+        pd.testing.assert_frame_equal(index.take(rows), expected)
+        pd.testing.assert_frame_equal(
+            index.take(rows, columns=["value", "a"]), expected[["value", "a"]]
+        )
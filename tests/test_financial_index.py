@@ -0,0 +1,60 @@
+import pandas as pd
+
+from src.data import financial_index
+
+
+def test_financial_index(tmp_path, monkeypatch):
+    df_financial = pd.DataFrame(
+        {
+            "siren": ["005781133", "005781133", "123456789"],
+            "date_cloture_exercice": ["2022-12-31", "2021-06-30", "2021-12-31"],
+            "ca": [1e6, 2e6, 3.5],
+            "resultat_net": [1.0, None, -2.0],
+            "type_bilan": ["K", "C", "S"],
+            "annee_cloture_exercice": [2022, 2020, 2021],
+        }
+    )
+    df_financial.to_csv(tmp_path / "financial.csv", index=False)
+    monkeypatch.setattr(
+        financial_index, "FILTERED_FINANCIAL_DATA_PATH", tmp_path / "financial.csv"
+    )
+    monkeypatch.setattr(financial_index, "FINANCIAL_INDEX_PATH", tmp_path / "index.npy")
+    index = financial_index.load_financial_index()
+
+    df = pd.DataFrame(
+        {
+            "SIREN principal": [
+                "123456789",
+                "005781133",
+                "5781133",
+                None,
+                "005781133",
+                "A1",
+            ],
+            "Année de reporting": [2021, 2020, 2020, 2020, 2019, 2021],
+        }
+    )
+    # same as the previous implementation of add_financial_data (with a merge)
+    for x in [df, df.iloc[:2]]:
+        expected = pd.merge(
+            x,
+            pd.read_csv(tmp_path / "financial.csv", dtype={"siren": str}).rename(
+                columns={
+                    "siren": "SIREN principal",
+                    "type_bilan": "type_bilan_financier",
+                }
+            ),
+            left_on=["SIREN principal", "Année de reporting"],
+            right_on=["SIREN principal", "annee_cloture_exercice"],
+            how="left",
+        )
+        result = pd.concat(
+            [x, index.lookup(x["SIREN principal"], x["Année de reporting"])], axis=1
+        )
+        pd.testing.assert_frame_equal(result, expected)
+
+    entity = index.entity("005781133")
+    assert entity["annee_cloture_exercice"].tolist() == [2020, 2022]
+    assert entity["ca"].tolist() == [2e6, 1e6]
+    assert len(index.entity("999999999")) == 0
+    assert len(index.entity("A1")) == 0
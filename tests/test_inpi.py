@@ -0,0 +1,93 @@
+import pandas as pd
+import pytest
+
+from src.data import inpi
+
+
+@pytest.fixture
+def inpi_paths(tmp_path, monkeypatch):
+    # Small raw ADEME / INPI files, with duplicates and several types of bilans per fiscal year
+    # (as in the real data, some SIRENs are not numeric)
+    pd.DataFrame(
+        {
+            "Id": [1, 2, 3, 4],
+            "SIREN principal": ["005781133", "123456789", None, "A12345678"],
+        }
+    ).to_csv(tmp_path / "ademe.csv", sep=";", index=False)
+    pd.DataFrame(
+        {
+            "siren": [
+                "005781133",
+                "005781133",
+                "005781133",
+                "999999999",
+                "123456789",
+                "123456789",
+                "123456789",
+                "005781133",
+                "999999999",
+            ],
+            "chiffre_d_affaires": [
+                "1e6",
+                "2e6",
+                "3e6",
+                "4e6",
+                "5e6",
+                "6e6",
+                "7e6",
+                "8e6",
+                "9e6",
+            ],
+            "resultat_net": ["1", "2", "3", "4", "5", "6", "7", "8", "9"],
+            "date_cloture_exercice": [
+                "2022-12-31",
+                "2022-12-31",
+                "2021-06-30",
+                "2022-12-31",
+                "2020-07-01",
+                "2020-07-01",
+                "2099-12-31",
+                "2022-12-31",
+                "2021-12-31",
+            ],
+            "type_bilan": ["C", "K", "C", "C", "S", "C", "C", "C", "K"],
+            "other_field": "x",
+        }
+    ).to_csv(tmp_path / "ratios_inpi_bce.csv", sep=";", index=False)
+
+    monkeypatch.setattr(inpi, "RAW_ADEME_DATA_PATH", tmp_path / "ademe.csv")
+    monkeypatch.setattr(
+        inpi, "RAW_FINANCIAL_DATA_PATH", tmp_path / "ratios_inpi_bce.csv"
+    )
+    monkeypatch.setattr(inpi, "FINANCIAL_DATA_PATH", tmp_path / "synthese.csv")
+    monkeypatch.setattr(inpi, "FILTERED_FINANCIAL_DATA_PATH", tmp_path / "filtered.csv")
+    return tmp_path
+
+
+def test_process_bilans_financiers_ademe_only(inpi_paths):
+    inpi.process_bilans_financiers()
+    inpi.filter_bilans_financiers_keep_only_ademe_sirens()
+    expected = (inpi_paths / "filtered.csv").read_text()
+
+    inpi.process_bilans_financiers_ademe_only(chunksize=2)
+    assert (inpi_paths / "filtered.csv").read_text() == expected
+
+    df = pd.read_csv(inpi_paths / "filtered.csv", dtype=str)
+    assert df[
+        ["siren", "annee_cloture_exercice", "type_bilan", "ca"]
+    ].values.tolist() == [
+        ["005781133", "2022", "K", "2000000.0"],
+        ["005781133", "2020", "C", "3000000.0"],
+        ["123456789", "2020", "C", "6000000.0"],
+    ]
+
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_process_bilans_financiers_parallel(inpi_paths, monkeypatch, workers):
+    inpi.process_bilans_financiers_ademe_only()
+    expected = (inpi_paths / "filtered.csv").read_text()
+
+    # a few lines per byte range
+    monkeypatch.setattr(inpi, "RANGE_BYTES", 100)
+    inpi.process_bilans_financiers_ademe_only(workers=workers)
+    assert (inpi_paths / "filtered.csv").read_text() == expected
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+from src.data.keys import KeyEncoding, add_key_columns, load_key_encoding
+
+
+def test_key_encoding(tmp_path):
+    df_bilans = pd.DataFrame(
+        {
+            "Id": [12, 5, 7, 40],
+            "SIREN principal": ["987654321", "005781133", None, "987654321"],
+        }
+    )
+    df_emissions = pd.DataFrame({"Id": [5, 5, 40, 12], "emissions": [1.0, 2, 3, 4]})
+
+    keys = KeyEncoding.build(df_bilans)
+    df_bilans, df_emissions = add_key_columns(df_bilans, df_emissions, keys)
+
+    assert df_bilans["id_code"].tolist() == [0, 1, 2, 3]
+    assert df_emissions["id_code"].tolist() == [1, 1, 3, 0]
+    assert df_bilans["siren_code"].tolist() == [1, 0, pd.NA, 1]
+    # missing SIRENs are not counted as an entity
+    assert df_bilans["siren_code"].nunique() == 2
+
+    keys.save(tmp_path / "keys.npz")
+    keys = load_key_encoding(tmp_path / "keys.npz")
+    assert keys.decode_ids(df_emissions["id_code"]).tolist() == [5, 5, 40, 12]
+    decoded = keys.decode_sirens(df_bilans["siren_code"])
+    assert decoded[[0, 1, 3]].tolist() == ["987654321", "005781133", "987654321"]
+    assert pd.isna(decoded[2])
+    assert (keys.encode_sirens(["005781133", "000000000"]) == np.array([0, -1])).all()
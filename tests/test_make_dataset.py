@@ -0,0 +1,246 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import make_dataset
+from src.data.make_dataset import (
+    enrich_df,
+    get_last_naf5,
+    build_datasets,
+    build_datasets_incremental,
+    build_datasets_streaming,
+    get_manifest,
+    load_processed,
+    read_raw_ademe_data,
+    save_processed,
+)
+from src.data.naf import _load_naf5_to_nafi_data, _load_naf_to_libelle_data
+
+
+@pytest.fixture
+def df_raw():
+    # A few (fake) bilans, covering the edge cases of the raw ADEME data
+    return pd.DataFrame(
+        {
+            "Id": [1, 2, 3, 4, 5, 6, 7],
+            "SIREN principal": [
+                "005781133",
+                "005781133",
+                "123456789",
+                "987654321",
+                "987654321",
+                "111111111",
+                "A12345678",
+            ],
+            "Nombre de salariés/d'agents": [
+                "Entre 5 000 et 9 999",
+                "Plus de 9 999",
+                "Entre 50 et 249",
+                np.nan,
+                "Entre 250 et 499",
+                "Entre 1 000 et 1 999",
+                "Entre 0 et 49",
+            ],
+            "Date de publication": [
+                "15/03/2021",
+                "02/11/2023",
+                "31/12/2019",
+                "01/01/2020",
+                "12/07/2022",
+                "28/02/2024",
+                "05/05/2018",
+            ],
+            "APE(NAF) associé": [
+                "0111Z",
+                "4711D",
+                "6201Z",
+                np.nan,
+                "3511Z",
+                "9999Z",  # does not exist
+                "8411Z",
+            ],
+        }
+    )
+
+
+def test_enrich_df(df_raw):
+    # note: missing values used to be None, they are now NaN
+    expected = _enrich_df_rowwise(df_raw).fillna(np.nan)
+    df = enrich_df(df_raw)
+    pd.testing.assert_frame_equal(df, expected)
+
+    # entities with multiple naf5 use the last one in date
+    assert df.loc[df["SIREN principal"] == "005781133", "naf5"].tolist() == [
+        "47.11D",
+        "47.11D",
+    ]
+    assert df.loc[df.Id == 2, "nb_salaries_range"].item() == "9999-"
+    assert (
+        df.loc[df.Id == 1, "naf1"].item()
+        == "Commerce ; réparation d'automobiles et de motocycles"
+    )
+
+
+def test_save_processed(df_raw, tmp_path):
+    # the last naf5 of 987654321 is missing
+    df_raw.loc[df_raw.Id == 4, "Date de publication"] = "01/01/2023"
+    df = enrich_df(df_raw)
+    assert (df.naf5 == "nan").sum() == 2
+
+    save_processed(df, tmp_path / "all.parquet")
+    naf5 = load_processed(tmp_path / "all.parquet", columns=["naf5"]).naf5
+    assert naf5.isna().sum() == 2
+    assert "nan" not in naf5.tolist()
+
+
+def test_build_datasets_incremental(df_raw):
+    df_raw = _add_bilan_columns(df_raw)
+    df_raw_prev = df_raw.iloc[[0, 2, 3, 4, 5]].copy()
+    # a bilan whose data changed since the previous export
+    df_raw_prev.loc[5, "Emissions publication P1.1"] = 1.0
+    # a bilan that was removed since the previous export
+    df_raw_prev = pd.concat([df_raw_prev, df_raw.iloc[[6]].assign(Id=8)])
+
+    df_enriched_prev, df_emissions_prev = build_datasets(df_raw_prev)
+    df_enriched, df_emissions = build_datasets_incremental(
+        df_raw,
+        get_manifest(df_raw, "0123456789abcdef"),
+        df_enriched_prev=df_enriched_prev,
+        df_emissions_prev=df_emissions_prev,
+        manifest_prev=get_manifest(df_raw_prev, "0123456789abcdef"),
+    )
+
+    df_enriched_expected, df_emissions_expected = build_datasets(df_raw)
+    pd.testing.assert_frame_equal(df_enriched, df_enriched_expected)
+    pd.testing.assert_frame_equal(df_emissions, df_emissions_expected)
+    # the new bilan (Id=2) changed the naf5 of a bilan (Id=1) that was already processed
+    assert df_enriched_prev.loc[df_enriched_prev.Id == 1, "naf5"].item() == "01.11Z"
+    assert df_enriched.loc[df_enriched.Id == 1, "naf5"].item() == "47.11D"
+
+
+def test_inputs_fingerprint(tmp_path, monkeypatch):
+    # the compiled artifacts are part of the fingerprint, like in the stage deps
+    path = tmp_path / "naf2008.npz"
+    path.write_bytes(b"v1")
+    monkeypatch.setattr(make_dataset, "NAF_HIERARCHY_PATH", path)
+    fingerprint = make_dataset._inputs_fingerprint()
+    assert path in make_dataset._stage_deps()["enrich_df"]
+    # (which are also the deps of the cached manifest)
+    assert path in make_dataset._inputs_paths()
+
+    path.write_bytes(b"v2")
+    assert make_dataset._inputs_fingerprint() != fingerprint
+
+
+def test_build_datasets_streaming(df_raw, tmp_path):
+    path = tmp_path / "export.csv"
+    _add_bilan_columns(df_raw).to_csv(path, sep=";", index=False)
+
+    df_enriched, df_emissions, manifest = build_datasets_streaming(path, chunksize=2)
+
+    df_raw = read_raw_ademe_data(path)
+    df_enriched_expected, df_emissions_expected = build_datasets(df_raw)
+    pd.testing.assert_frame_equal(df_enriched, df_enriched_expected)
+    pd.testing.assert_frame_equal(df_emissions, df_emissions_expected)
+    pd.testing.assert_series_equal(manifest["Id"], df_raw["Id"])
+
+
+def _add_bilan_columns(df_raw):
+    # Complete the df_raw fixture with the other columns used to build the datasets
+    rng = np.random.default_rng(0)
+    df_raw = df_raw.assign(
+        **{
+            "Méthode BEGES (V4,V5)": "V5",
+            "Type de structure": "Entreprise",
+            "Type de collectivité": np.nan,
+            "Mode de consolidation": "Opérationnel",
+            "Recalcul": "Non",
+            "Comparaison avec le précédent bilan": "Non",
+            "Année de reporting": [2020, 2022, 2019, 2019, 2021, 2023, 2017],
+            "Structure obligée": "Oui",
+        }
+    )
+    for code in ["1.1", "1.2", "2.1", "3.1", "4.1", "5.1", "6.1"]:
+        emissions = rng.lognormal(5, 2, size=len(df_raw))
+        emissions[rng.random(len(df_raw)) < 0.5] = np.nan
+        df_raw[f"Emissions publication P{code}"] = emissions
+    return df_raw
+
+
+def _enrich_df_rowwise(df_raw):
+    # Previous (row-wise) implementation of enrich_df, kept as a reference for regression tests
+    df = df_raw.copy()
+
+    df["nb_salaries_range"] = df["Nombre de salariés/d'agents"].map(_nb_salaries_range)
+    df["nb_salaries_min"] = df["nb_salaries_range"].map(_nb_salaries_min)
+    df["nb_salaries_max"] = df["nb_salaries_range"].map(_nb_salaries_max)
+    df["nb_salaries_mean"] = (df["nb_salaries_min"] + df["nb_salaries_max"]) / 2
+    df.loc[df.nb_salaries_max.isnull(), "nb_salaries_mean"] = 15000
+
+    df["month_publication"] = pd.to_datetime(
+        df["Date de publication"], dayfirst=True
+    ).dt.to_period("M")
+
+    df["naf5"] = df["APE(NAF) associé"].map(
+        lambda x: None if pd.isna(x) else f"{x[:2]}.{x[2:]}"
+    )
+
+    d = get_last_naf5(df).to_dict()["naf5"]
+
+    def _f(j):
+        if j["SIREN principal"] in d:
+            return d[j["SIREN principal"]]
+        return j["naf5"]
+
+    df["naf5_last"] = df.apply(_f, axis=1)
+    df = df.rename(columns={"naf5_last": "naf5", "naf5": "naf5_non_unique"})
+
+    _naf5_to_nafi = _load_naf5_to_nafi_data()
+    _naf_to_libelle = _load_naf_to_libelle_data()
+
+    def get_nafi(naf5: Optional[str], niv: int) -> Optional[str]:
+        if naf5 is None or naf5 not in _naf5_to_nafi[f"NIV{niv}"]:
+            return None
+        return _naf5_to_nafi[f"NIV{niv}"][naf5]
+
+    def naf_to_libelle(naf5: Optional[str], niv: int) -> Optional[str]:
+        if naf5 is None or naf5 not in _naf5_to_nafi[f"NIV{niv}"]:
+            return None
+        return _naf_to_libelle[f"NIV{niv}"][get_nafi(naf5, niv)]
+
+    for i in range(1, 5):
+        df[f"naf{i}"] = df.naf5.map(lambda x: naf_to_libelle(x, niv=i))
+        df[f"naf{i}_code"] = df.naf5.map(lambda x: get_nafi(x, niv=i))
+    return df
+
+
+def _nb_salaries_range(x: str):
+    if pd.isna(x):
+        return None
+    if "Plus de" in x:
+        x = x.removeprefix("Plus de ")
+        i = int(x.replace(" ", ""))
+        return f"{i}-"
+    x = x.removeprefix("Entre ")
+    i, j = x.split(" et ")
+    i = int(i.replace(" ", ""))
+    j = int(j.replace(" ", ""))
+    x = f"{i}-{j}"
+    return x
+
+
+def _nb_salaries_min(x: Optional[str]):
+    if x is None:
+        return None
+    return int(x.split("-")[0])
+
+
+def _nb_salaries_max(x: Optional[str]):
+    if x is None:
+        return None
+    i, j = x.split("-")
+    if len(j) == 0:
+        return None
+    return int(j)
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+
+from src.data.keys import get_key_encoding
+from src.settings import FILTERED_FINANCIAL_DATA_PATH
+from src.visualization.panel_figures.benchmark import (
+    aggregate_bilans,
+    filter_options,
+    get_df,
+)
+from src.visualization.panel_figures.ranking import (
+    financial_data_of_siren,
+    get_bilans,
+    percentile_rank,
+    percentile_ranks_of_siren,
+)
+from src.visualization.percentile_rank import PercentileIndex
+from src.visualization.visualize import LABELS
+
+
+def test_percentile_index():
+    rng = np.random.default_rng(0)
+    n = 500
+    df = pd.DataFrame(
+        {
+            "id_code": rng.permutation(n),
+            "naf1": rng.choice(["A", "B", "C"], n),
+            "annee": rng.choice([2021, 2022], n),
+            "value": np.where(rng.random(n) < 0.2, np.nan, rng.integers(0, 50, n)),
+        }
+    )
+    index = PercentileIndex(
+        df, group_columns=["naf1", "annee"], value_columns=["value"]
+    )
+
+    for (naf1, annee), group in df.groupby(["naf1", "annee"]):
+        values = group["value"].dropna()
+        for value in [-1, 0, 10, 10.5, 49, 100]:
+            percentile, n = index.rank((naf1, annee), "value", value)
+            assert n == len(values)
+            np.testing.assert_allclose(percentile, 100 * (values <= value).mean())
+    assert index.rank(("D", 2022), "value", 1.0) == (None, 0)
+
+    ranks = index.rank_bilans(df["id_code"], "value")
+    assert len(ranks) == df["value"].notna().sum()
+    for row in ranks.head(20).itertuples():
+        assert (row.percentile, row.n) == index.rank(
+            (row.naf1, row.annee), "value", row.value
+        )
+
+
+def test_percentile_ranks_of_siren():
+    bilans = get_bilans()
+    siren_code = bilans["siren_code"].value_counts().index[0]
+    siren = get_key_encoding().decode_sirens([siren_code])[0]
+    indicator = LABELS.emissions_par_collaborateur
+    ranks = percentile_ranks_of_siren(siren, indicator)
+    assert len(ranks) > 0
+    assert set(ranks["id_code"]) <= set(
+        bilans.loc[bilans["siren_code"] == siren_code, "id_code"]
+    )
+    assert percentile_ranks_of_siren("000000000", indicator).empty
+
+    # same as ranking the totals of the filtered and aggregated frame of the benchmark
+    x = aggregate_bilans(
+        filter_options(get_df(), secteur_activite="all", plot_col=indicator),
+        group_by=LABELS.secteur_activite,
+    )
+    x = x.merge(bilans[["id_code", LABELS.annee_reporting]], on="id_code")
+    for row in ranks.to_dict("records"):
+        secteur, annee = row[LABELS.secteur_activite], row[LABELS.annee_reporting]
+        group = x.loc[
+            (x[LABELS.secteur_activite] == secteur)
+            & (x[LABELS.annee_reporting] == annee),
+            indicator,
+        ]
+        assert row["n"] == len(group)
+        np.testing.assert_allclose(
+            row["percentile"], 100 * (group <= row[indicator]).mean()
+        )
+        assert percentile_rank(
+            secteur_activite=secteur,
+            annee=int(annee),
+            indicator=indicator,
+            value=row[indicator],
+        ) == (row["percentile"], row["n"])
+
+
+def test_financial_data_of_siren():
+    siren = "005781133"
+    x = financial_data_of_siren(siren[:3] + " " + siren[3:])
+    financial = pd.read_csv(FILTERED_FINANCIAL_DATA_PATH, dtype={"siren": str})
+    expected = financial[financial.siren == siren].sort_values("annee_cloture_exercice")
+    assert x["Année de clôture"].tolist() == expected.annee_cloture_exercice.tolist()
+    assert x["C.A. (€)"].tolist() == expected.ca.tolist()
+    assert financial_data_of_siren("999999999").empty
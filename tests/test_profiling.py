@@ -0,0 +1,33 @@
+import json
+
+import pandas as pd
+
+from src.data.profiling import StageProfiler, stage
+
+
+def test_stage_profiler(tmp_path):
+    df = pd.DataFrame({"a": range(10)})
+
+    # without an active profiler, stages are not measured
+    with stage("filter", df) as s:
+        assert s.output(df[df.a < 5]).shape == (5, 1)
+
+    with StageProfiler() as profiler:
+        with stage("filter", df) as s:
+            with stage("nested", df) as s_nested:
+                s_nested.output(df)
+            df_out = s.output(df[df.a < 5])
+        with stage("no output"):
+            pass
+    assert len(df_out) == 5
+
+    profiler.save(tmp_path / "report.json")
+    report = json.loads((tmp_path / "report.json").read_text())
+    nested, filter_, no_output = report["stages"]
+    assert [nested["name"], filter_["name"]] == ["nested", "filter"]
+    assert (filter_["rows_in"], filter_["rows_out"]) == (10, 5)
+    assert (filter_["depth"], nested["depth"]) == (0, 1)
+    assert filter_["memory_out"] < filter_["memory_in"]
+    assert filter_["rss_peak"] >= filter_["rss_start"] > 0
+    assert filter_["wall_time"] >= nested["wall_time"] >= 0
+    assert no_output["rows_in"] is None and no_output["rows_out"] is None
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+from src.visualization.result_cache import LRUCache, sizeof
+
+
+def test_lru_cache():
+    def frame(n):
+        return pd.DataFrame({"x": np.zeros(n)})
+
+    size = sizeof(frame(100))
+    cache = LRUCache(max_bytes=3 * size)
+    for key in ["a", "b", "c", "a", "d"]:
+        cache.get_or_compute(key, lambda: frame(100))
+
+    # "b" was the least recently used entry when "d" was added
+    assert cache.stats() == {
+        "entries": 3,
+        "nbytes": 3 * size,
+        "max_bytes": 3 * size,
+        "hits": 1,
+        "misses": 4,
+        "evictions": 1,
+        "hit_rate": 0.2,
+    }
+    computed = []
+    cache.get_or_compute("b", lambda: computed.append("b"))
+    cache.get_or_compute("a", lambda: computed.append("a"))
+    assert computed == ["b"]
+
+    # too big to be cached
+    assert len(cache.get_or_compute("e", lambda: frame(1000))) == 1000
+    assert cache.get_or_compute("e", lambda: None) is None
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+from src.data.shared_frames import load_shared_frame
+
+
+def _build_df():
+    return pd.DataFrame(
+        {
+            "Id": np.arange(4),
+            "emissions": [1.5, np.nan, 0.0, 3.0],
+            "naf1": pd.Categorical(["A", "B", None, "A"]),
+            "month": pd.to_datetime(["2020-01", "2021-03", "2021-03", "2022-12"]),
+            "label": ["x", None, "y", "x"],
+        }
+    )
+
+
+def test_load_shared_frame(tmp_path):
+    dep = tmp_path / "dep.csv"
+    dep.write_text("a")
+    df = load_shared_frame("test", _build_df, deps=[dep], cache_dir=tmp_path)
+    pd.testing.assert_frame_equal(df, _build_df())
+
+    # the numerical, datetime and categorical columns are read-only views on the mapped file
+    for values in [df["Id"], df["emissions"], df["naf1"].cat.codes, df["month"]]:
+        assert not values.to_numpy().flags.writeable
+
+    # loaded from the saved file, until the dependencies change
+    assert len(list(tmp_path.glob("test-*.arrow"))) == 1
+    load_shared_frame("test", _build_df, deps=[dep], cache_dir=tmp_path)
+    (path,) = tmp_path.glob("test-*.arrow")
+    dep.write_text("b")
+    load_shared_frame("test", _build_df, deps=[dep], cache_dir=tmp_path)
+    (new_path,) = tmp_path.glob("test-*.arrow")
+    assert new_path != path
+
+
+def test_load_shared_frame_code_deps(tmp_path, monkeypatch):
+    # a build function, using a helper of another module of its package
+    package = tmp_path / "shared_frames_pkg"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    (package / "helpers.py").write_text("VALUES = [1, 2]\n")
+    (package / "build.py").write_text(
+        "import pandas as pd\n"
+        "from shared_frames_pkg.helpers import VALUES\n"
+        "def build_df():\n"
+        "    return pd.DataFrame({'a': VALUES})\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    from shared_frames_pkg.build import build_df
+
+    cache_dir = tmp_path / "cache"
+    load_shared_frame("test", build_df, cache_dir=cache_dir)
+    (path,) = cache_dir.glob("test-*.arrow")
+    load_shared_frame("test", build_df, cache_dir=cache_dir)
+    assert list(cache_dir.glob("test-*.arrow")) == [path]
+
+    # editing the helper module rebuilds the frame
+    (package / "helpers.py").write_text("VALUES = [1, 2, 3]\n")
+    load_shared_frame("test", build_df, cache_dir=cache_dir)
+    (new_path,) = cache_dir.glob("test-*.arrow")
+    assert new_path != path
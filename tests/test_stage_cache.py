@@ -0,0 +1,29 @@
+import pandas as pd
+
+from src.data.stage_cache import StageCache
+
+
+def test_stage_cache(tmp_path):
+    calls = []
+
+    def double(df):
+        calls.append(1)
+        return df * 2
+
+    input_path = tmp_path / "input.csv"
+    pd.DataFrame({"a": [1, 2]}).to_csv(input_path, index=False)
+
+    def run():
+        cache = StageCache(tmp_path / "cache")
+        x = cache.file(input_path, pd.read_csv)
+        return cache.stage(double, x).load()
+
+    assert run()["a"].tolist() == [2, 4]
+    assert run()["a"].tolist() == [2, 4]
+    # the second run used the cache
+    assert len(calls) == 1
+
+    # changing the input invalidates the cache
+    pd.DataFrame({"a": [3]}).to_csv(input_path, index=False)
+    assert run()["a"].tolist() == [6]
+    assert len(calls) == 2
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+from src.data.synthetic import scale_ademe_data, scale_financial_data
+
+
+def test_scale_ademe_data():
+    df_raw = pd.DataFrame(
+        {
+            "Id": ["1", "2", "3", "4", "5"],
+            "SIREN principal": [
+                "005781133",
+                "123456789",
+                "005781133",
+                np.nan,
+                "100000000",
+            ],
+            "APE(NAF) associé": ["0111Z", "4711D", "0111Z", "8411Z", "3511Z"],
+            "Emissions publication P1.1": ["10.0", np.nan, "0", "5.5", "1.0"],
+            "Emissions publication P2.1": [np.nan, "2.0", "3.0", np.nan, np.nan],
+        }
+    )
+    emission_columns = ["Emissions publication P1.1", "Emissions publication P2.1"]
+    df, df_sirens = scale_ademe_data(df_raw, 2.5, np.random.default_rng(0))
+
+    # 4 entities (including a bilan without SIREN) -> 10 synthetic entities
+    assert len(df_sirens) + df["SIREN principal"].isnull().sum() == 10
+    assert df.columns.tolist() == df_raw.columns.tolist()
+    assert df["Id"].is_unique
+    # the first copy is the real data
+    assert df["Id"].iloc[: len(df_raw)].astype(str).tolist() == df_raw["Id"].tolist()
+    assert (df_sirens.siren == df_sirens.siren_source).sum() == 3
+    # new SIRENs are valid and not used by the real data
+    new_sirens = df_sirens.siren[df_sirens.siren != df_sirens.siren_source]
+    assert new_sirens.is_unique and new_sirens.str.fullmatch(r"\d{9}").all()
+    assert not new_sirens.isin(df_raw["SIREN principal"]).any()
+
+    # each entity keeps its bilans, with the same NAF codes and sparsity of postes
+    for siren, siren_source, factor in df_sirens.itertuples(index=False):
+        x = df[df["SIREN principal"] == siren]
+        x_source = df_raw[df_raw["SIREN principal"] == siren_source]
+        assert x["APE(NAF) associé"].tolist() == x_source["APE(NAF) associé"].tolist()
+        np.testing.assert_allclose(
+            x[emission_columns].to_numpy(dtype=float),
+            x_source[emission_columns].to_numpy(dtype=float) * factor,
+        )
+
+    df_financial = pd.DataFrame(
+        {
+            "siren": ["005781133", "005781133"],
+            "ca": ["1e6", "2e6"],
+            "annee": [2021, 2022],
+        }
+    )
+    df_financial = scale_financial_data(df_financial, df_sirens)
+    n_copies = (df_sirens.siren_source == "005781133").sum()
+    assert len(df_financial) == 2 * n_copies
+    assert df_financial.siren.nunique() == n_copies
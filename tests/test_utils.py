@@ -0,0 +1,86 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import panel as pn
+import param
+import pytest
+
+from src.visualization.utils import AsyncMemoizedNode, MemoizedNode
+
+
+def test_memoized_node():
+    calls = []
+
+    def f(x, y):
+        calls.append((x, y))
+        return x + y
+
+    node = MemoizedNode(f, normalize=lambda kwargs: (kwargs["x"], kwargs["y"] % 2))
+    x = pn.widgets.IntInput(value=1)
+    data = pn.bind(node, x=x, y=2)
+    outputs = [pn.bind(lambda df, i=i: df + i, df=data) for i in range(3)]
+
+    assert [o() for o in outputs] == [3, 4, 5]
+    x.value = 10
+    assert [o() for o in outputs] == [12, 13, 14]
+    assert calls == [(1, 2), (10, 2)]
+    assert (node.n_calls, node.n_computed, node.n_avoided) == (6, 2, 4)
+
+    # states with the same normalized key are not computed again
+    assert node(x=10, y=4) == 12
+    assert node.n_computed == 2
+
+
+def test_async_memoized_node():
+    started = []
+    release = threading.Event()
+
+    def f(x):
+        started.append(x)
+        release.wait()
+        return x * 10
+
+    async def main():
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            node = AsyncMemoizedNode(f, executor=executor)
+            # the first state is being computed, the second one is waiting for the worker
+            stale = [asyncio.create_task(node(x=1)) for _ in range(2)]
+            queued = asyncio.create_task(node(x=2))
+            await asyncio.sleep(0.05)
+            # a newer state supersedes both of them
+            latest = [asyncio.create_task(node(x=3)) for _ in range(2)]
+            await asyncio.sleep(0.05)
+            release.set()
+
+            for task in [*stale, queued]:
+                with pytest.raises(param.Skip):
+                    await task
+            assert [await task for task in latest] == [30, 30]
+            assert await node(x=3) == 30
+
+        assert started == [1, 3]
+        assert (node.n_calls, node.n_computed, node.n_superseded) == (6, 3, 2)
+
+    asyncio.run(main())
+
+
+def test_async_memoized_node_failure():
+    calls = []
+
+    def f(x):
+        calls.append(x)
+        if len(calls) == 1:
+            raise RuntimeError("failed")
+        return x * 10
+
+    async def main():
+        node = AsyncMemoizedNode(f)
+        with pytest.raises(RuntimeError):
+            await node(x=1)
+        # the failure is not memoized: the same state is computed again
+        assert await node(x=1) == 10
+        assert await node(x=1) == 10
+        assert calls == [1, 1]
+
+    asyncio.run(main())
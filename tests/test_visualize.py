@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+from src.visualization.visualize import get_box_stats
+
+
+def _box_stats(vals):
+    # reference implementation (holoviews BoxWhiskerPlot._box_stats)
+    vals = vals[np.isfinite(vals)]
+    q1, q2, q3 = (np.percentile(vals, q=q) for q in range(25, 100, 25))
+    iqr = q3 - q1
+    upper = max(vals[vals <= q3 + 1.5 * iqr].max(), q3)
+    lower = min(vals[vals >= q1 - 1.5 * iqr].min(), q1)
+    outliers = vals[(vals > upper) | (vals < lower)]
+    return q1, q2, q3, upper, lower, outliers
+
+
+def test_get_box_stats():
+    rng = np.random.default_rng(0)
+    n = 5000
+    df = pd.DataFrame(
+        {
+            "group": rng.choice(["a", "b", "c", None], n),
+            "value": rng.lognormal(3, 2, n),
+        }
+    )
+    df.loc[:3, "value"] = [np.nan, np.inf, 1.0, 2.0]
+    # a group with a single value, and a group with only non-finite values
+    df.loc[4, "group"], df.loc[5, "group"] = "d", "e"
+    df.loc[5, "value"] = np.nan
+
+    stats, outliers = get_box_stats(df, by="group", y="value", max_outliers=20)
+
+    # (the missing labels are the last group)
+    assert stats["group"].tolist()[:4] == ["a", "b", "c", "d"]
+    assert len(stats) == 5 and pd.isna(stats["group"].iloc[4])
+    for _, row in stats.iterrows():
+        in_group = (
+            df.group.isna() if pd.isna(row["group"]) else df.group == row["group"]
+        )
+        vals = df.loc[in_group, "value"].to_numpy()
+        q1, median, q3, upper, lower, expected_outliers = _box_stats(vals)
+        assert row["count"] == np.isfinite(vals).sum()
+        assert np.allclose(
+            row[["q1", "median", "q3", "upper", "lower", "mean"]].astype(float),
+            [q1, median, q3, upper, lower, vals[np.isfinite(vals)].mean()],
+        )
+        if pd.isna(row["group"]):
+            x = outliers.loc[outliers.group.isna(), "value"]
+        else:
+            x = outliers.loc[outliers.group == row["group"], "value"]
+        if len(expected_outliers) <= 20:
+            assert sorted(x) == sorted(expected_outliers)
+        else:
+            assert len(x) == 20
+            assert x.isin(expected_outliers).all()
+            assert x.min() == expected_outliers.min()
+            assert x.max() == expected_outliers.max()